@@ -261,10 +261,10 @@ class Application(
         if user:
             principal_path = "/%s/" % user
             if self.Rights.authorized(user, principal_path, "W"):
-                with self.Collection.acquire_lock("r", user):
+                with self.Collection.acquire_lock("r", user, principal_path):
                     principal = next(self.Collection.discover(principal_path, depth="1"), None)
                 if not principal:
-                    with self.Collection.acquire_lock("w", user):
+                    with self.Collection.acquire_lock("w", user, principal_path):
                         try:
                             self.Collection.create_collection(principal_path)
                         except ValueError as e:
@@ -14,10 +14,11 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 #
+import posixpath
 from http import client
 from xml.etree import ElementTree as ET
 
-from radicale import httputils, storage, xmlutils
+from radicale import httputils, pathutils, storage, xmlutils
 
 
 def xml_delete(base_prefix, path, collection, href=None):
@@ -48,7 +49,9 @@ class ApplicationDeleteMixin:
         """Manage DELETE request."""
         if not self.access(user, path, "w"):
             return httputils.NOT_ALLOWED
-        with self.Collection.acquire_lock("w", user):
+        # deleting an item or collection changes its parent collection
+        parent_path = pathutils.unstrip_path(posixpath.dirname(pathutils.strip_path(path)), True)
+        with self.Collection.acquire_lock("w", user, parent_path):
             item = next(self.Collection.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
@@ -65,7 +65,7 @@ class ApplicationGetMixin:
             return self.Web.get(environ, base_prefix, path, user)
         if not self.access(user, path, "r"):
             return httputils.NOT_ALLOWED
-        with self.Collection.acquire_lock("r", user):
+        with self.Collection.acquire_lock("r", user, path):
             item = next(self.Collection.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
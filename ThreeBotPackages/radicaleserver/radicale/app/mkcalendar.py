@@ -46,11 +46,12 @@ class ApplicationMkcalendarMixin:
             radicale_item.check_and_sanitize_props(props)
         except ValueError as e:
             logger.warning("Bad MKCALENDAR request on %r: %s", path, e, exc_info=True)
-        with self.Collection.acquire_lock("w", user):
+        # the new collection is a child of the parent collection
+        parent_path = pathutils.unstrip_path(posixpath.dirname(pathutils.strip_path(path)), True)
+        with self.Collection.acquire_lock("w", user, parent_path):
             item = next(self.Collection.discover(path), None)
             if item:
                 return self.webdav_error_response("D", "resource-must-be-null")
-            parent_path = pathutils.unstrip_path(posixpath.dirname(pathutils.strip_path(path)), True)
             parent_item = next(self.Collection.discover(parent_path), None)
             if not parent_item:
                 return httputils.CONFLICT
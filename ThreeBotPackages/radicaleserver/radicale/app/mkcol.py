@@ -47,11 +47,12 @@ class ApplicationMkcolMixin:
             return httputils.BAD_REQUEST
         if props.get("tag") and "w" not in permissions or not props.get("tag") and "W" not in permissions:
             return httputils.NOT_ALLOWED
-        with self.Collection.acquire_lock("w", user):
+        # the new collection is a child of the parent collection
+        parent_path = pathutils.unstrip_path(posixpath.dirname(pathutils.strip_path(path)), True)
+        with self.Collection.acquire_lock("w", user, parent_path):
             item = next(self.Collection.discover(path), None)
             if item:
                 return httputils.METHOD_NOT_ALLOWED
-            parent_path = pathutils.unstrip_path(posixpath.dirname(pathutils.strip_path(path)), True)
             parent_item = next(self.Collection.discover(parent_path), None)
             if not parent_item:
                 return httputils.CONFLICT
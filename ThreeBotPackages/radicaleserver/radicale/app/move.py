@@ -41,7 +41,12 @@ class ApplicationMoveMixin:
         if not self.access(user, to_path, "w"):
             return httputils.NOT_ALLOWED
 
-        with self.Collection.acquire_lock("w", user):
+        # moving within a collection only locks that collection, moving
+        # between collections locks the whole storage
+        parent_path = pathutils.unstrip_path(posixpath.dirname(pathutils.strip_path(path)), True)
+        to_parent_path = pathutils.unstrip_path(posixpath.dirname(pathutils.strip_path(to_path)), True)
+        lock_path = parent_path if parent_path == to_parent_path else None
+        with self.Collection.acquire_lock("w", user, lock_path):
             item = next(self.Collection.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
@@ -54,7 +59,6 @@ class ApplicationMoveMixin:
             to_item = next(self.Collection.discover(to_path), None)
             if isinstance(to_item, storage.BaseCollection):
                 return httputils.FORBIDDEN
-            to_parent_path = pathutils.unstrip_path(posixpath.dirname(pathutils.strip_path(to_path)), True)
             to_collection = next(self.Collection.discover(to_parent_path), None)
             if not to_collection:
                 return httputils.CONFLICT
@@ -360,7 +360,7 @@ class ApplicationPropfindMixin:
         except socket.timeout:
             logger.debug("client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
-        with self.Collection.acquire_lock("r", user):
+        with self.Collection.acquire_lock("r", user, path):
             items = self.Collection.discover(path, environ.get("HTTP_DEPTH", "0"))
             # take root item for rights checking
             item = next(items, None)
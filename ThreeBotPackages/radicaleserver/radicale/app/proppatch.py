@@ -93,7 +93,7 @@ class ApplicationProppatchMixin:
         except socket.timeout:
             logger.debug("client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
-        with self.Collection.acquire_lock("w", user):
+        with self.Collection.acquire_lock("w", user, path):
             item = next(self.Collection.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
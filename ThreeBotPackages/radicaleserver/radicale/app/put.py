@@ -132,7 +132,7 @@ class ApplicationPutMixin:
             vobject_items
         )
 
-        with self.Collection.acquire_lock("w", user):
+        with self.Collection.acquire_lock("w", user, parent_path):
             item = next(self.Collection.discover(path), None)
             parent_item = next(self.Collection.discover(parent_path), None)
             if not parent_item:
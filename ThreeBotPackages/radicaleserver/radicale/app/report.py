@@ -243,7 +243,7 @@ class ApplicationReportMixin:
             logger.debug("client timed out", exc_info=True)
             return httputils.REQUEST_TIMEOUT
         with contextlib.ExitStack() as lock_stack:
-            lock_stack.enter_context(self.Collection.acquire_lock("r", user))
+            lock_stack.enter_context(self.Collection.acquire_lock("r", user, path))
             item = next(self.Collection.discover(path), None)
             if not item:
                 return httputils.NOT_FOUND
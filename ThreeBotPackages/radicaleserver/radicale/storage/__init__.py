@@ -314,14 +314,18 @@ class BaseCollection:
 
     @classmethod
     @contextlib.contextmanager
-    def acquire_lock(cls, mode, user=None):
-        """Set a context manager to lock the whole storage.
+    def acquire_lock(cls, mode, user=None, path=None):
+        """Set a context manager to lock the storage.
 
         ``mode`` must either be "r" for shared access or "w" for exclusive
         access.
 
         ``user`` is the name of the logged in user or empty.
 
+        ``path`` is the sanitized path of the collection the request works
+        on, only that part of the storage gets locked. ``None`` locks the
+        whole storage.
+
         """
         raise j.exceptions.NotImplemented
 
@@ -25,7 +25,7 @@ from radicale.storage.multifilesystem.create_collection import CollectionCreateC
 from radicale.storage.multifilesystem.delete import CollectionDeleteMixin
 from radicale.storage.multifilesystem.discover import CollectionDiscoverMixin
 from radicale.storage.multifilesystem.get import CollectionGetMixin
-from radicale.storage.multifilesystem.history import CollectionHistoryMixin
+from radicale.storage.multifilesystem.index import CollectionIndexMixin
 from radicale.storage.multifilesystem.lock import CollectionLockMixin
 from radicale.storage.multifilesystem.meta import CollectionMetaMixin
 from radicale.storage.multifilesystem.move import CollectionMoveMixin
@@ -41,7 +41,7 @@ class Collection(
     CollectionDeleteMixin,
     CollectionDiscoverMixin,
     CollectionGetMixin,
-    CollectionHistoryMixin,
+    CollectionIndexMixin,
     CollectionLockMixin,
     CollectionMetaMixin,
     CollectionMoveMixin,
@@ -167,6 +167,6 @@ class Collection(
     @property
     def etag(self):
         # reuse cached value if the storage is read-only
-        if self._lock.locked == "w" or self._etag_cache is None:
+        if self._locked == "w" or self._etag_cache is None:
             self._etag_cache = super().etag
         return self._etag_cache
@@ -14,40 +14,75 @@
 # GNU General Public License for more details.
 #
 import os
-import pickle
 import time
 from hashlib import md5
 
-from radicale import pathutils, storage
 from radicale.log import logger
+from radicale.storage.multifilesystem.store import CacheStore
 from Jumpscale import j
 
+# the store gets compacted when it has this many records more than needed
+STORE_COMPACT_MIN = 1000
+
 
 class CollectionCacheMixin:
-    @classmethod
-    def _clean_cache(cls, folder, names, max_age=None):
-        """Delete all ``names`` in ``folder`` that are older than ``max_age``.
-        """
-        age_limit = time.time() - max_age if max_age is not None else None
+    def __init__(self):
+        super().__init__()
+        self._store_path = os.path.join(self._filesystem_path, ".Radicale.cache", "store")
 
-        for name in names:
-            if not pathutils.is_safe_filesystem_path_component(name):
-                continue
-            if age_limit is not None:
-                try:
-                    # Race: Another process might have deleted the file.
-                    mtime = j.sal.bcdbfs.get_epoch(os.path.join(folder, name))
-                except j.exceptions.NotFound:
-                    continue
-                if mtime > age_limit:
-                    continue
-            logger.debug("Found expired item in cache: %r", name)
-            # Race: Another process might have deleted or locked the
-            # file.
-            try:
-                j.sal.bcdbfs.file_remove(os.path.join(folder, name))
-            except (j.exceptions.NotFound, PermissionError):
-                continue
+    def _store_read(self):
+        try:
+            text = j.sal.bcdbfs.file_read(self._store_path).decode(self._encoding)
+        except j.exceptions.NotFound:
+            text = ""
+        return CacheStore.loads(text, self.path)
+
+    def _store_load(self):
+        """The cache store, kept in memory with the item index so it is only
+        read again when the generation of the collection changed."""
+        index = self._item_index()
+        if index.store is None:
+            index.store = self._store_read()
+            if index.store.records > 2 * index.store.live + STORE_COMPACT_MIN:
+                self._store_compact()
+        return index.store
+
+    def _store_forget(self):
+        """Read the cache store again the next time it is used, e.g. to see
+        what another process wrote."""
+        self._item_index().store = None
+
+    def _store_append(self, *records):
+        """Write ``records`` to the store in 1 operation."""
+        with self._acquire_cache_lock("store"):
+            j.sal.bcdbfs.file_write(self._store_path, "".join(CacheStore.record(*r) for r in records), append=True)
+        index = self._item_index()
+        if index.store is not None:
+            # the change log in memory is kept by ``_change_record``
+            for record in records:
+                if record[0] in ("item", "drop"):
+                    index.store.apply(record)
+        index.store_appended += len(records)
+        needed = len(index.entries) + (len(index.changes.hrefs) if index.changes else 0)
+        if index.store_appended > max(STORE_COMPACT_MIN, needed):
+            self._store_compact()
+
+    def _store_compact(self):
+        """Write the store again with only the records which are needed:
+        the cache entries of existing items and the changes which didn't
+        expire."""
+        with self._acquire_cache_lock("store"):
+            store = self._store_read()
+            hrefs = set(self._list())
+            store.items = {href: content for href, content in store.items.items() if href in hrefs}
+            if store.changes:
+                store.changes.expire(time.time() - self.configuration.get("storage", "max_sync_token_age"))
+            with self._atomic_write(self._store_path, "w") as f:
+                f.write(store.dumps())
+        index = self._item_index()
+        index.store = store
+        index.store_appended = 0
+        index.changes = store.changes
 
     def _item_cache_hash(self, raw_text):
         _hash = md5()
@@ -61,39 +96,18 @@ class CollectionCacheMixin:
         return (cache_hash, item.uid, item.etag, text, item.name, item.component_name, *item.time_range)
 
     def _store_item_cache(self, href, item, cache_hash=None):
-        cache_folder = os.path.join(self._filesystem_path, ".Radicale.cache", "item")
         content = self._item_cache_content(item, cache_hash)
-        self._makedirs_synced(cache_folder)
-        try:
-            # Race: Other processes might have created and locked the
-            # file.
-            with self._atomic_write(os.path.join(cache_folder, href), "wb") as f:
-                pickle.dump(content, f)
-        except PermissionError:
-            pass
+        self._store_append(("item", href, content))
         return content
 
     def _load_item_cache(self, href, input_hash):
-        cache_folder = os.path.join(self._filesystem_path, ".Radicale.cache", "item")
         cache_hash = uid = etag = text = name = tag = start = end = None
-        try:
-            file_contents = j.sal.bcdbfs.file_read(os.path.join(cache_folder, href))
-            cache_hash, *content = pickle.loads(file_contents)
-            if cache_hash == input_hash:
-                uid, etag, text, name, tag, start, end = content
-        except j.exceptions.NotFound:
-            pass
-        except (pickle.UnpicklingError, ValueError) as e:
-            logger.warning("Failed to load item cache entry %r in %r: %s", href, self.path, e, exc_info=True)
+        content = self._store_load().items.get(href)
+        if content is not None:
+            try:
+                cache_hash, *content = content
+                if cache_hash == input_hash:
+                    uid, etag, text, name, tag, start, end = content
+            except ValueError as e:
+                logger.warning("Failed to load item cache entry %r in %r: %s", href, self.path, e, exc_info=True)
         return cache_hash, uid, etag, text, name, tag, start, end
-
-    def _clean_item_cache(self):
-        cache_folder = os.path.join(self._filesystem_path, ".Radicale.cache", "item")
-        self._clean_cache(
-            cache_folder,
-            (
-                os.path.basename(entry)
-                for entry in j.sal.bcdbfs.list_files_and_dirs(cache_folder)
-                if not j.sal.bcdbfs.is_file(os.path.join(self._filesystem_path, os.path.basename(entry)))
-            ),
-        )
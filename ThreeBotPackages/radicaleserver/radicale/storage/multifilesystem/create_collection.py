@@ -42,5 +42,8 @@ class CollectionCreateCollectionMixin:
                 self._upload_all_nonatomic(items, suffix=".ics")
             elif props.get("tag") == "VADDRESSBOOK":
                 self._upload_all_nonatomic(items, suffix=".vcf")
+        # the items of an existing collection got replaced
+        self._index_reset()
+        self._change_log_reset()
 
         return cls(pathutils.unstrip_path(sane_path, True))
@@ -24,6 +24,7 @@ class CollectionDeleteMixin:
         if href is None:
             # Delete the collection
             j.sal.bcdbfs.dir_remove(self._filesystem_path)
+            self._item_indexes.pop(self._filesystem_path, None)
         else:
             # Delete an item
             if not pathutils.is_safe_filesystem_path_component(href):
@@ -32,6 +33,6 @@ class CollectionDeleteMixin:
             if not j.sal.bcdbfs.is_file(path):
                 raise storage.ComponentNotFoundError(href)
             j.sal.bcdbfs.file_remove(path)
-            # Track the change
-            self._update_history_etag(href, None)
-            self._clean_history()
+            self._index_update(href)
+            # Drop the cache entry and track the change
+            self._store_append(("drop", href), self._change_record(href))
@@ -49,6 +49,8 @@ class CollectionDiscoverMixin:
             href = None
 
         sane_path = "/".join(attributes)
+        # the collection can be below the level the request locked
+        cls._lock_child(sane_path)
         collection = cls(pathutils.unstrip_path(sane_path, True))
         if href:
             yield collection._get(href)
@@ -59,9 +61,9 @@ class CollectionDiscoverMixin:
         if depth == "0":
             return
 
-        for href in collection._list():
+        for href in collection._index_hrefs():
             with child_context_manager(sane_path, href):
-                yield collection._get(href)
+                yield collection._get_indexed(href)
 
         for entry in j.sal.bcdbfs.list_files_and_dirs(filesystem_path):
             if not j.sal.bcdbfs.is_dir(entry):
@@ -75,4 +77,5 @@ class CollectionDiscoverMixin:
             sane_child_path = posixpath.join(sane_path, href)
             child_path = pathutils.unstrip_path(sane_child_path, True)
             with child_context_manager(sane_child_path):
+                cls._lock_child(sane_child_path)
                 yield cls(child_path)
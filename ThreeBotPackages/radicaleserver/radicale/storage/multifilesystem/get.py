@@ -20,15 +20,12 @@ import vobject
 
 from radicale import item as radicale_item
 from radicale import pathutils
+from radicale.item import filter as radicale_filter
 from radicale.log import logger
 from Jumpscale import j
 
 
 class CollectionGetMixin:
-    def __init__(self):
-        super().__init__()
-        self._item_cache_cleaned = False
-
     def _list(self):
         for entry in j.sal.bcdbfs.list_files(self._filesystem_path):
 
@@ -70,8 +67,9 @@ class CollectionGetMixin:
                 # Lock the item cache to prevent multpile processes from
                 # generating the same data in parallel.
                 # This improves the performance for multiple requests.
-                if self._lock.locked == "r":
+                if self._locked == "r":
                     # Check if another process created the file in the meantime
+                    self._store_forget()
                     cache_hash, uid, etag, text, name, tag, start, end = self._load_item_cache(href, input_hash)
                 if input_hash != cache_hash:
                     try:
@@ -84,11 +82,10 @@ class CollectionGetMixin:
                         )
                     except Exception as e:
                         raise j.exceptions.Base("Failed to load item %r in %r: %s" % (href, self.path, e)) from e
-                    # Clean cache entries once after the data in the file
-                    # system was edited externally.
-                    if not self._item_cache_cleaned:
-                        self._item_cache_cleaned = True
-                        self._clean_item_cache()
+        return self._item_from_cache(href, path, (cache_hash, uid, etag, text, name, tag, start, end))
+
+    def _item_from_cache(self, href, path, cache_content):
+        _, uid, etag, text, name, tag, start, end = cache_content
         last_modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(j.sal.bcdbfs.get_epoch(path)))
         # Don't keep reference to ``vobject_item``, because it requires a lot
         # of memory.
@@ -124,4 +121,18 @@ class CollectionGetMixin:
     def get_all(self):
         # We don't need to check for collissions, because the the file names
         # are from os.listdir.
-        return (self._get(href, verify_href=False) for href in self._list())
+        return (self._get_indexed(href) for href in self._index_hrefs())
+
+    def get_filtered(self, filters):
+        tag, start, end, simple = radicale_filter.simplify_prefilters(filters, collection_tag=self.get_meta("tag"))
+        if not tag:
+            for item in self.get_all():
+                yield item, simple
+            return
+        # Only the items overlapping the time range are loaded
+        for href in self._index_overlapping(start, end):
+            item = self._get_indexed(href)
+            if item is None or tag != item.component_name:
+                continue
+            istart, iend = item.time_range
+            yield item, simple and (start <= istart or iend <= end)
@@ -0,0 +1,237 @@
+# This file is part of Radicale Server - Calendar Server
+# Copyright © 2014 Jean-Marc Martins
+# Copyright © 2012-2017 Guillaume Ayoub
+# Copyright © 2017-2019 Unrud <unrud@outlook.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+import binascii
+import bisect
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from radicale import item as radicale_item
+from Jumpscale import j
+
+# max amount of collections of which the item index is kept in memory
+ITEM_INDEX_SIZE = 1000
+
+IndexEntry = namedtuple("IndexEntry", ["uid", "etag", "name", "tag", "start", "end", "last_modified"])
+
+
+class ItemIndex:
+    """Metadata of the items of a collection at one generation.
+
+    Readers add the items they load, so the entries and the time ranges are
+    only changed while holding the lock of the index.
+
+    """
+
+    def __init__(self, generation):
+        self.generation = generation
+        # hrefs of the items in listing order (dict keys), None until the
+        # collection is listed
+        self.hrefs = None
+        # href -> IndexEntry
+        self.entries = {}
+        # (start, href) and (end, href) of all entries sorted, None until
+        # the first time range query
+        self.starts = None
+        self.ends = None
+        # ChangeLog of the collection, None until it is loaded
+        self.changes = None
+        # CacheStore of the collection, None until it is read
+        self.store = None
+        # records this process appended to the cache store since it was
+        # compacted
+        self.store_appended = 0
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self.hrefs is not None and len(self.entries) == len(self.hrefs)
+
+    def set(self, href, item):
+        # the item can be parsed to get its metadata, not while locked
+        entry = IndexEntry(item.uid, item.etag, item.name, item.component_name, *item.time_range, item.last_modified)
+        with self._lock:
+            if self.hrefs is not None:
+                self.hrefs[href] = None
+            self._time_remove(href)
+            self.entries[href] = entry
+            if self.starts is not None:
+                bisect.insort(self.starts, (entry.start, href))
+                bisect.insort(self.ends, (entry.end, href))
+
+    def remove(self, href):
+        with self._lock:
+            self._time_remove(href)
+            self.entries.pop(href, None)
+            if self.hrefs is not None:
+                self.hrefs.pop(href, None)
+
+    def _time_remove(self, href):
+        entry = self.entries.get(href)
+        if self.starts is None or entry is None:
+            return
+        for values, value in ((self.starts, entry.start), (self.ends, entry.end)):
+            i = bisect.bisect_left(values, (value, href))
+            if i < len(values) and values[i] == (value, href):
+                del values[i]
+
+    def overlapping(self, start, end):
+        """hrefs of the entries with a time range overlapping ``start`` to
+        ``end``, the index must be complete.
+
+        Items recurring forever end at ``TIMESTAMP_MAX`` and are always
+        part of the ends after ``start``.
+
+        """
+        with self._lock:
+            if self.starts is None:
+                self.starts = sorted((entry.start, href) for href, entry in self.entries.items())
+                self.ends = sorted((entry.end, href) for href, entry in self.entries.items())
+            # starts[:before_end] start before ``end``, ends[after_start:]
+            # end after ``start``, filter the shortest one with the other
+            # condition
+            before_end = bisect.bisect_left(self.starts, (end,))
+            after_start = bisect.bisect_left(self.ends, (start + 1,))
+            if before_end <= len(self.ends) - after_start:
+                return [href for _, href in self.starts[:before_end] if self.entries[href].end > start]
+            return [href for _, href in self.ends[after_start:] if self.entries[href].start < end]
+
+
+class IndexedItem(radicale_item.Item):
+    """Item of which the metadata comes from the index, the text is only
+    loaded when it is used."""
+
+    def __init__(self, load, **kwargs):
+        super().__init__(text="", **kwargs)
+        self._text = None
+        self._load = load
+
+    def serialize(self):
+        if self._text is None:
+            item = self._load()
+            if item is None:
+                raise j.exceptions.NotFound("Item %r in %r doesn't exist anymore" % (self.href, self._collection_path))
+            self._text = item.serialize()
+        return self._text
+
+    @property
+    def vobject_item(self):
+        if self._vobject_item is None:
+            self.serialize()
+        return super().vobject_item
+
+
+class CollectionIndexMixin:
+    """In memory index of the metadata of the items of every collection.
+
+    The index of a collection is valid as long as its generation is the one
+    stored in the collection, every upload, delete and move stores a new
+    generation, so other processes notice the change as well.
+
+    """
+
+    @classmethod
+    def static_init(cls):
+        super().static_init()
+        # filesystem path of the collection -> ItemIndex
+        cls._item_indexes = OrderedDict()
+
+    def __init__(self):
+        super().__init__()
+        # the generation was compared with the stored one by this instance
+        self._item_index_checked = False
+        self._generation_path = os.path.join(self._filesystem_path, ".Radicale.cache", "generation")
+
+    def _generation_read(self):
+        try:
+            return j.sal.bcdbfs.file_read(self._generation_path).decode("ascii").strip()
+        except j.exceptions.NotFound:
+            return None
+
+    def _generation_bump(self):
+        generation = binascii.hexlify(os.urandom(16)).decode("ascii")
+        with self._atomic_write(self._generation_path, "w") as f:
+            f.write(generation)
+        return generation
+
+    def _item_index(self):
+        index = self._item_indexes.get(self._filesystem_path)
+        if index is not None and self._item_index_checked:
+            return index
+        generation = self._generation_read()
+        if generation is None:
+            with self._acquire_cache_lock("item"):
+                generation = self._generation_read() or self._generation_bump()
+        if index is None or index.generation != generation:
+            index = ItemIndex(generation)
+            self._item_indexes[self._filesystem_path] = index
+        self._item_indexes.move_to_end(self._filesystem_path)
+        while len(self._item_indexes) > ITEM_INDEX_SIZE:
+            self._item_indexes.popitem(last=False)
+        self._item_index_checked = True
+        return index
+
+    def _index_update(self, href, item=None):
+        """Store the new generation after ``href`` changed, ``item`` is None
+        when it got deleted."""
+        index = self._item_index()
+        index.generation = self._generation_bump()
+        if item is None:
+            index.remove(href)
+        else:
+            index.set(href, item)
+
+    def _index_reset(self):
+        """Store a new generation, the index gets built again."""
+        self._item_indexes.pop(self._filesystem_path, None)
+        self._generation_bump()
+        self._item_index_checked = False
+
+    def _index_hrefs(self):
+        index = self._item_index()
+        if index.hrefs is None:
+            index.hrefs = dict.fromkeys(self._list())
+        return list(index.hrefs)
+
+    def _index_overlapping(self, start, end):
+        """hrefs of the items with a time range overlapping ``start`` to
+        ``end``."""
+        index = self._item_index()
+        if not index.complete:
+            for href in self._index_hrefs():
+                if href not in index.entries:
+                    self._get_indexed(href)
+        return index.overlapping(start, end)
+
+    def _get_indexed(self, href):
+        index = self._item_index()
+        entry = index.entries.get(href)
+        if entry is None:
+            item = self._get(href, verify_href=False)
+            if item is not None:
+                index.set(href, item)
+            return item
+        return IndexedItem(
+            lambda: self._get(href, verify_href=False),
+            collection=self,
+            href=href,
+            last_modified=entry.last_modified,
+            etag=entry.etag,
+            uid=entry.uid,
+            name=entry.name,
+            component_name=entry.tag,
+            time_range=(entry.start, entry.end),
+        )
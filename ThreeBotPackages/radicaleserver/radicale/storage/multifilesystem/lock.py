@@ -18,52 +18,163 @@ import logging
 import os
 import shlex
 import subprocess
+import threading
+from hashlib import md5
+
+import gevent.local
 
 from radicale import pathutils
 from radicale.log import logger
 
 
 class CollectionLockMixin:
+    """Hierarchical locks of the storage.
+
+    Every request takes the global lock in shared mode and the lock of the
+    principal (first path component) and of the collection (first two path
+    components) it works on, so requests for different users or calendars
+    don't wait for each other. The global lock is only taken exclusively
+    for requests without a path, e.g. a MOVE between collections.
+
+    The locks held are tracked per greenlet (every thread has its own
+    greenlets), so a request only sees its own locks. Collections below the locked level which are opened while
+    discovering are locked shared until the request releases its locks.
+
+    """
+
     @classmethod
     def static_init(cls):
         super().static_init()
         # folder = cls.configuration.get("storage", "filesystem_folder")
-        lock_path = os.path.join("/tmp", ".Radicale.lock")
-        cls._lock = pathutils.RwLock(lock_path)
+        cls._lock_folder = "/tmp"
+        cls._lock = pathutils.RwLock(os.path.join(cls._lock_folder, ".Radicale.lock"))
+        # lock key -> RwLock of a principal or collection
+        cls._locks = {"": cls._lock}
+        cls._locks_lock = threading.Lock()
+        # locks held by the current greenlet: ``held`` maps lock key -> mode,
+        # ``stack`` releases the locks taken for child collections
+        cls._lock_state = gevent.local.local()
+
+    @classmethod
+    def _lock_keys(cls, path):
+        """Keys of the locks covering ``path`` from the global lock down."""
+        if path is None:
+            return [""]
+        parts = pathutils.strip_path(pathutils.sanitize_path(path)).split("/")
+        parts = [part for part in parts if part]
+        return [""] + ["/".join(parts[:i]) for i in range(1, min(len(parts), 2) + 1)]
+
+    @classmethod
+    def _lock_file(cls, key, ns=""):
+        name = ".Radicale.lock"
+        if key:
+            name += ".%s" % md5(key.encode()).hexdigest()
+        if ns:
+            name += ".%s" % ns
+        return os.path.join(cls._lock_folder, name)
+
+    @classmethod
+    def _lock_get(cls, key):
+        with cls._locks_lock:
+            lock = cls._locks.get(key)
+            if lock is None:
+                lock = cls._locks[key] = pathutils.RwLock(cls._lock_file(key))
+            return lock
+
+    @classmethod
+    def _lock_held(cls):
+        return getattr(cls._lock_state, "held", None) or {}
+
+    @property
+    def _locked(self):
+        """Mode the current greenlet locked the collection in, "w", "r" or
+        empty."""
+        held = self._lock_held()
+        locked = ""
+        for key in self._lock_keys(self.path):
+            mode = held.get(key, "")
+            if mode == "w":
+                return "w"
+            locked = locked or mode
+        return locked
+
+    @classmethod
+    def _lock_child(cls, path):
+        """Lock the collection at ``path`` shared for the rest of the
+        request, if the current greenlet doesn't hold a lock on it yet."""
+        stack = getattr(cls._lock_state, "stack", None)
+        if stack is None:
+            return
+        held = cls._lock_held()
+        for key in cls._lock_keys(path):
+            if key not in held:
+                stack.enter_context(cls._lock_get(key).acquire("r"))
+                held[key] = "r"
 
     def _acquire_cache_lock(self, ns=""):
-        if self._lock.locked == "w":
+        if self._locked == "w":
             return contextlib.ExitStack()
-        # cache_folder = os.path.join(self._filesystem_path, ".Radicale.cache")
-        self._makedirs_synced("/tmp")
-        lock_path = os.path.join("/tmp", ".Radicale.lock" + (".%s" % ns if ns else ""))
-        lock = pathutils.RwLock(lock_path)
+        self._makedirs_synced(self._lock_folder)
+        key = self._lock_keys(self.path)[-1]
+        lock = pathutils.RwLock(self._lock_file(key, ns))
         return lock.acquire("w")
 
     @classmethod
     @contextlib.contextmanager
-    def acquire_lock(cls, mode, user=None):
-        with cls._lock.acquire(mode):
-            yield
-            # execute hook
-            hook = cls.configuration.get("storage", "hook")
-            if mode == "w" and hook:
-                folder = cls.configuration.get("storage", "filesystem_folder")
-                logger.debug("Running hook")
-                debug = logger.isEnabledFor(logging.DEBUG)
-                p = subprocess.Popen(
-                    hook % {"user": shlex.quote(user or "Anonymous")},
-                    stdin=subprocess.DEVNULL,
-                    stdout=subprocess.PIPE if debug else subprocess.DEVNULL,
-                    stderr=subprocess.PIPE if debug else subprocess.DEVNULL,
-                    shell=True,
-                    universal_newlines=True,
-                    cwd=folder,
-                )
-                stdout_data, stderr_data = p.communicate()
-                if stdout_data:
-                    logger.debug("Captured stdout hook:\n%s", stdout_data)
-                if stderr_data:
-                    logger.debug("Captured stderr hook:\n%s", stderr_data)
-                if p.returncode != 0:
-                    raise subprocess.CalledProcessError(p.returncode, p.args)
+    def acquire_lock(cls, mode, user=None, path=None):
+        keys = cls._lock_keys(path)
+        state = cls._lock_state
+        previous = (getattr(state, "held", None), getattr(state, "stack", None))
+        if not previous[0]:
+            # a write of this request needs the hook to run
+            state.hook_pending, state.hook_user = False, None
+        held = dict(previous[0] or {})
+        with contextlib.ExitStack() as lock_stack:
+            # shared locks on the parents, ``mode`` on the lowest level,
+            # locks the greenlet holds already are not taken again
+            for key in keys:
+                key_mode = mode if key == keys[-1] else "r"
+                if held.get(key) in ("w", key_mode):
+                    continue
+                lock_stack.enter_context(cls._lock_get(key).acquire(key_mode))
+                held[key] = key_mode
+            state.held, state.stack = held, lock_stack
+            try:
+                yield
+            finally:
+                state.held, state.stack = previous
+        # execute hook
+        hook = cls.configuration.get("storage", "hook")
+        if mode == "w":
+            state.hook_pending, state.hook_user = True, user
+        if not hook or not state.hook_pending:
+            return
+        if previous[0]:
+            # the outer lock of this greenlet runs the hook once it is released
+            return
+        # the hook runs under the exclusive global lock once the locks of the
+        # request are released, so no writer is busy while it runs
+        with cls._lock.acquire("w"):
+            cls._run_hook(hook, state.hook_user)
+
+    @classmethod
+    def _run_hook(cls, hook, user):
+        folder = cls.configuration.get("storage", "filesystem_folder")
+        logger.debug("Running hook")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        p = subprocess.Popen(
+            hook % {"user": shlex.quote(user or "Anonymous")},
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if debug else subprocess.DEVNULL,
+            stderr=subprocess.PIPE if debug else subprocess.DEVNULL,
+            shell=True,
+            universal_newlines=True,
+            cwd=folder,
+        )
+        stdout_data, stderr_data = p.communicate()
+        if stdout_data:
+            logger.debug("Captured stdout hook:\n%s", stdout_data)
+        if stderr_data:
+            logger.debug("Captured stderr hook:\n%s", stderr_data)
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, p.args)
@@ -28,7 +28,7 @@ class CollectionMetaMixin:
 
     def get_meta(self, key=None):
         # reuse cached value if the storage is read-only
-        if self._lock.locked == "w" or self._meta_cache is None:
+        if self._locked == "w" or self._meta_cache is None:
             try:
                 try:
 
@@ -13,7 +13,6 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 #
-import os
 
 from radicale import pathutils
 from Jumpscale import j
@@ -29,18 +28,11 @@ class CollectionMoveMixin:
             pathutils.path_to_filesystem(to_collection._filesystem_path, to_href),
         )
 
-        # Move the item cache entry
-        cache_folder = os.path.join(item.collection._filesystem_path, ".Radicale.cache", "item")
-        to_cache_folder = os.path.join(to_collection._filesystem_path, ".Radicale.cache", "item")
-        cls._makedirs_synced(to_cache_folder)
-        try:
-            j.sal.bcdbfs.file_move(os.path.join(cache_folder, item.href), os.path.join(to_cache_folder, to_href))
-        except j.exceptions.NotFound:
-            pass
+        item.collection._index_update(item.href)
+        to_collection._index_update(to_href, item)
 
-        # Track the change
-        to_collection._update_history_etag(to_href, item)
-        item.collection._update_history_etag(item.href, None)
-        to_collection._clean_history()
-        if item.collection._filesystem_path != to_collection._filesystem_path:
-            item.collection._clean_history()
+        # Move the item cache entry and track the change
+        to_collection._store_append(
+            ("item", to_href, to_collection._item_cache_content(item)), to_collection._change_record(to_href)
+        )
+        item.collection._store_append(("drop", item.href), item.collection._change_record(item.href))
@@ -0,0 +1,139 @@
+# This file is part of Radicale Server - Calendar Server
+# Copyright © 2014 Jean-Marc Martins
+# Copyright © 2012-2017 Guillaume Ayoub
+# Copyright © 2017-2019 Unrud <unrud@outlook.com>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+import bisect
+import itertools
+import json
+
+from radicale.log import logger
+from Jumpscale import j
+
+
+class ChangeLog:
+    """The hrefs changed in a collection, numbered by a sequence which only
+    increases.
+
+    ``log_id`` is random and changes when the log is started again, so tokens
+    of an old log are never mistaken for tokens of the new one.
+
+    """
+
+    def __init__(self, log_id, first_seq=1):
+        self.log_id = log_id
+        # sequence of hrefs[0]
+        self.first_seq = first_seq
+        self.hrefs = []
+        self.times = []
+
+    @property
+    def seq(self):
+        """Sequence of the last change, ``first_seq - 1`` when empty."""
+        return self.first_seq + len(self.hrefs) - 1
+
+    def token_name(self, seq=None):
+        return "%016x%016x" % (self.log_id, self.seq if seq is None else seq)
+
+    def append(self, href, epoch):
+        self.hrefs.append(href)
+        self.times.append(epoch)
+
+    def since(self, seq):
+        """The hrefs changed after ``seq``, each href once."""
+        return list(dict.fromkeys(self.hrefs[seq - self.first_seq + 1 :]))
+
+    def expire(self, age_limit):
+        """Drop the changes older than ``age_limit``, returns the amount."""
+        count = bisect.bisect_right(self.times, age_limit)
+        del self.hrefs[:count]
+        del self.times[:count]
+        self.first_seq += count
+        return count
+
+
+class CacheStore:
+    """Item cache and change log of a collection in 1 append-only file.
+
+    Every line is a JSON list, the first value is the type of the record:
+
+    - ``["item", href, cache content]`` the cache entry of an item
+    - ``["drop", href]`` the cache entry of an item got removed
+    - ``["log", log_id, first_seq]`` a new change log starts
+    - ``["change", seq, epoch, href]`` a change of the change log
+
+    A change which doesn't follow the last one (e.g. because the record in
+    between was only partly written) ends the change log, a new one is
+    started so no sync token misses the lost change.
+
+    """
+
+    def __init__(self):
+        # href -> cache content, see ``_item_cache_content``
+        self.items = {}
+        # ChangeLog or None when no log was started yet
+        self.changes = None
+        self.records = 0
+
+    @staticmethod
+    def record(*values):
+        return json.dumps(values) + "\n"
+
+    @property
+    def live(self):
+        """Amount of records a compacted store has."""
+        return len(self.items) + (1 + len(self.changes.hrefs) if self.changes else 0)
+
+    def apply(self, record):
+        kind, *values = record
+        if kind == "item":
+            href, content = values
+            self.items[href] = tuple(content)
+        elif kind == "drop":
+            self.items.pop(values[0], None)
+        elif kind == "log":
+            self.changes = ChangeLog(*values)
+        elif kind == "change":
+            seq, epoch, href = values
+            if self.changes is not None and seq != self.changes.seq + 1:
+                logger.warning("Change %d is missing in the change log, starting a new log", self.changes.seq + 1)
+                self.changes = None
+            if self.changes is not None:
+                self.changes.append(href, epoch)
+        else:
+            raise j.exceptions.Value("Unknown record type %r" % kind)
+        self.records += 1
+
+    @classmethod
+    def loads(cls, text, name=""):
+        store = cls()
+        for line in text.splitlines():
+            try:
+                store.apply(json.loads(line))
+            except (AttributeError, TypeError, ValueError) as e:
+                # e.g. a line which was only partly written
+                logger.warning("Skipping damaged record in cache store %r: %s", name, e)
+        return store
+
+    def dumps(self):
+        lines = []
+        if self.changes:
+            lines.append(self.record("log", self.changes.log_id, self.changes.first_seq))
+            lines.extend(
+                self.record("change", seq, epoch, href)
+                for seq, epoch, href in zip(
+                    itertools.count(self.changes.first_seq), self.changes.times, self.changes.hrefs
+                )
+            )
+        lines.extend(self.record("item", href, content) for href, content in self.items.items())
+        return "".join(lines)
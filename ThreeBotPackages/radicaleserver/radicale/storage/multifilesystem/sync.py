@@ -13,20 +13,51 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 #
-import itertools
+import binascii
 import os
-import pickle
-from hashlib import md5
+import time
 
-from radicale.log import logger
+from radicale.storage.multifilesystem.store import ChangeLog
 from Jumpscale import j
 
+TOKEN_PREFIX = "http://radicale.org/ns/sync/"
+
 
 class CollectionSyncMixin:
+    def _change_log(self):
+        """The change log of the collection, kept in memory with the item
+        index."""
+        index = self._item_index()
+        if index.changes is None:
+            changes = self._store_load().changes
+            if changes is None:
+                with self._acquire_cache_lock("sync"):
+                    # Check if another process started the log in the meantime
+                    self._store_forget()
+                    changes = self._store_load().changes or self._change_log_reset()
+            index.changes = changes
+        return index.changes
+
+    def _change_log_reset(self):
+        """Start a new change log, all existing sync tokens become invalid."""
+        log = ChangeLog(int(binascii.hexlify(os.urandom(8)), 16))
+        index = self._item_index()
+        index.changes = log
+        self._store_append(("log", log.log_id, log.first_seq))
+        return log
+
+    def _change_record(self, href):
+        """Add the change of ``href`` to the log, returns the store record to
+        write."""
+        epoch = int(time.time())
+        log = self._change_log()
+        log.append(href, epoch)
+        return ("change", log.seq, epoch, href)
+
     def sync(self, old_token=None):
         # The sync token has the form http://radicale.org/ns/sync/TOKEN_NAME
-        # where TOKEN_NAME is the md5 hash of all history etags of present and
-        # past items of the collection.
+        # where TOKEN_NAME is the id of the change log and the sequence of
+        # its last change, as 2 hexadecimal numbers of 16 digits.
         def check_token_name(token_name):
             if len(token_name) != 32:
                 return False
@@ -38,79 +69,20 @@ class CollectionSyncMixin:
         old_token_name = None
         if old_token:
             # Extract the token name from the sync token
-            if not old_token.startswith("http://radicale.org/ns/sync/"):
+            if not old_token.startswith(TOKEN_PREFIX):
                 raise j.exceptions.Value("Malformed token: %r" % old_token)
-            old_token_name = old_token[len("http://radicale.org/ns/sync/") :]
+            old_token_name = old_token[len(TOKEN_PREFIX) :]
             if not check_token_name(old_token_name):
                 raise j.exceptions.Value("Malformed token: %r" % old_token)
-        # Get the current state and sync-token of the collection.
-        state = {}
-        token_name_hash = md5()
-        # Find the history of all existing and deleted items
-        for href, item in itertools.chain(
-            ((item.href, item) for item in self.get_all()), ((href, None) for href in self._get_deleted_history_hrefs())
-        ):
-            history_etag = self._update_history_etag(href, item)
-            state[href] = history_etag
-            token_name_hash.update((href + "/" + history_etag).encode("utf-8"))
-        token_name = token_name_hash.hexdigest()
-        token = "http://radicale.org/ns/sync/%s" % token_name
-        if token_name == old_token_name:
+        log = self._change_log()
+        token = TOKEN_PREFIX + log.token_name()
+        if not old_token_name:
+            return token, self._index_hrefs()
+        if old_token_name == log.token_name():
             # Nothing changed
             return token, ()
-        token_folder = os.path.join(self._filesystem_path, ".Radicale.cache", "sync-token")
-        token_path = os.path.join(token_folder, token_name)
-        old_state = {}
-        if old_token_name:
-            # load the old token state
-            old_token_path = os.path.join(token_folder, old_token_name)
-            try:
-                # Race: Another process might have deleted the file.
-                old_state = pickle.loads(j.sal.bcdbfs.file_reads(old_token_path))
-            except (j.exceptions.NotFound, pickle.UnpicklingError, ValueError) as e:
-                if isinstance(e, (pickle.UnpicklingError, ValueError)):
-                    logger.warning(
-                        "Failed to load stored sync token %r in %r: %s", old_token_name, self.path, e, exc_info=True
-                    )
-                    # Delete the damaged file
-                    try:
-                        j.sal.bcdbfs.file_remove(old_token_path)
-                    except (j.exceptions.NotFound, PermissionError):
-                        pass
-                raise j.exceptions.Value("Token not found: %r" % old_token)
-        # write the new token state or update the modification time of
-        # existing token state
-        if not j.sal.bcdbfs.file_exists(token_path):
-            self._makedirs_synced(token_folder)
-            try:
-                # Race: Other processes might have created and locked the file.
-                with self._atomic_write(token_path, "wb") as f:
-                    pickle.dump(state, f)
-            except PermissionError:
-                pass
-            else:
-                # clean up old sync tokens and item cache
-                self._clean_cache(
-                    token_folder,
-                    j.sal.bcdbfs.list_files_and_dirs(token_folder),
-                    max_age=self.configuration.get("storage", "max_sync_token_age"),
-                )
-                self._clean_history()
-        else:
-            # Try to update the modification time
-            try:
-                # Race: Another process might have deleted the file.
-                j.sal.bcdbfs.get_epoch(token_path)
-            except j.exceptions.NotFound:
-                pass
-        changes = []
-        # Find all new, changed and deleted (that are still in the item cache)
-        # items
-        for href, history_etag in state.items():
-            if history_etag != old_state.get(href):
-                changes.append(href)
-        # Find all deleted items that are no longer in the item cache
-        for href, history_etag in old_state.items():
-            if href not in state:
-                changes.append(href)
-        return token, changes
+        log_id, seq = int(old_token_name[:16], 16), int(old_token_name[16:], 16)
+        if log_id != log.log_id or not log.first_seq - 1 <= seq <= log.seq:
+            # Unknown, expired or from a log which was started again
+            raise j.exceptions.Value("Token not found: %r" % old_token)
+        return token, log.since(seq)
@@ -14,7 +14,6 @@
 # GNU General Public License for more details.
 #
 import os
-import pickle
 
 from radicale import item as radicale_item
 from radicale import pathutils
@@ -26,19 +25,17 @@ class CollectionUploadMixin:
         if not pathutils.is_safe_filesystem_path_component(href):
             raise pathutils.UnsafePathError(href)
         try:
-            self._store_item_cache(href, item)
+            cache_content = self._item_cache_content(item)
         except Exception as e:
             raise j.exceptions.Value("Failed to store item %r in collection %r: %s" % (href, self.path, e)) from e
         path = pathutils.path_to_filesystem(self._filesystem_path, href)
         with self._atomic_write(path, newline="") as fd:
             fd.write(item.serialize())
-        # Clean the cache after the actual item is stored, or the cache entry
-        # will be removed again.
-        self._clean_item_cache()
-        # Track the change
-        self._update_history_etag(href, item)
-        self._clean_history()
-        return self._get(href, verify_href=False)
+        item = self._item_from_cache(href, path, cache_content)
+        self._index_update(href, item)
+        # Store the cache entry and track the change
+        self._store_append(("item", href, cache_content), self._change_record(href))
+        return item
 
     def _upload_all_nonatomic(self, items, suffix=""):
         """Upload a new set of items.
@@ -48,9 +45,8 @@ class CollectionUploadMixin:
 
         """
         try:
-            cache_folder = os.path.join(self._filesystem_path, ".Radicale.cache", "item")
-            self._makedirs_synced(cache_folder)
             hrefs = set()
+            records = []
 
             for item in items:
                 uid = item.uid
@@ -93,8 +89,10 @@ class CollectionUploadMixin:
                 with self._atomic_write(get_path(), newline="") as f:
                     f.write(item.serialize())
                 hrefs.add(href)
-                with self._atomic_write(os.path.join(cache_folder, href), mode="wb") as f:
-                    pickle.dump(cache_content, f)
+                records.append(("item", href, cache_content))
+            # Store the cache entries of all items at once
+            if records:
+                self._store_append(*records)
             # self._sync_directory(cache_folder)
             # self._sync_directory(self._filesystem_path)
         except Exception as e:
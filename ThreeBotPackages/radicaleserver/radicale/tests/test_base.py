@@ -23,12 +23,18 @@ import posixpath
 import shutil
 import sys
 import tempfile
+import threading
 import xml.etree.ElementTree as ET
 from functools import partial
 
+import gevent
 import pytest
 
 from radicale import Application, config, storage
+from radicale import item as radicale_item
+from radicale.item.filter import TIMESTAMP_MAX
+from radicale.storage.multifilesystem.index import ItemIndex
+from radicale.storage.multifilesystem.store import CacheStore, ChangeLog
 from Jumpscale import j
 from . import BaseTest
 from .helpers import get_file_content
@@ -1900,6 +1906,170 @@ class TestMultiFileSystem(BaseFileSystemTest, BaseRequestsMixIn):
         status, _, _ = self.request("MKCALENDAR", "/calendar.ics/")
         assert status != 201
 
+    def test_collection_locks(self):
+        """Verify that collections of different users are locked separately."""
+        Collection = self.application.Collection
+        with Collection.acquire_lock("w", path="/user1/calendar.ics/"):
+            assert Collection("/user1/calendar.ics")._locked == "w"
+            assert Collection("/user1/calendar.ics/item.ics")._locked == "w"
+            assert Collection("/user1")._locked == "r"
+            assert Collection("/user2/calendar.ics")._locked == "r"
+            # a read of another collection doesn't wait for the writer
+            with Collection.acquire_lock("r", path="/user2/calendar.ics/"):
+                pass
+            # the locks of other threads are not seen
+            locked = []
+            thread = threading.Thread(target=lambda: locked.append(Collection("/user1/calendar.ics")._locked))
+            thread.start()
+            thread.join()
+            assert locked == [""]
+        # the greenlets of a thread don't see each other's locks either
+        locked = []
+
+        def writer():
+            with Collection.acquire_lock("w", path="/user3/calendar.ics/"):
+                gevent.sleep(0.1)
+
+        greenlet = gevent.spawn(writer)
+        gevent.sleep(0.01)
+        gevent.spawn(lambda: locked.append(Collection("/user3/calendar.ics")._locked)).join()
+        greenlet.join()
+        assert locked == [""]
+        with Collection.acquire_lock("w"):
+            assert Collection("/user2/calendar.ics")._locked == "w"
+        # children opened by a reader of the parent are locked until it is done
+        with Collection.acquire_lock("r", path="/user1/"):
+            Collection._lock_child("user1/calendar.ics")
+            assert Collection._lock_held()["user1/calendar.ics"] == "r"
+        assert Collection("/user1/calendar.ics")._locked == ""
+
+    def test_item_index(self):
+        """Verify that listings use the item index and follow changes."""
+        status, _, _ = self.request("MKCALENDAR", "/calendar.ics/")
+        assert status == 201
+        event = get_file_content("event1.ics")
+        status, _, _ = self.request("PUT", "/calendar.ics/event1.ics", event)
+        assert status == 201
+        collection = next(self.application.Collection.discover("/calendar.ics/"))
+        etag = collection.etag
+        collection = next(self.application.Collection.discover("/calendar.ics/"))
+        # items must not be read again
+        collection._get = None
+        assert [item.href for item in collection.get_all()] == ["event1.ics"]
+        assert collection.has_uid("event1")
+        assert collection.etag == etag
+        status, _, _ = self.request("DELETE", "/calendar.ics/event1.ics")
+        assert status == 200
+        collection = next(self.application.Collection.discover("/calendar.ics/"))
+        assert list(collection.get_all()) == []
+        assert collection.etag != etag
+
+    def test_item_index_overlapping(self):
+        """Verify the time range index of the item index."""
+        index = ItemIndex("generation")
+        index.hrefs = {}
+        ranges = {"past": (10, 20), "now": (40, 60), "future": (80, 90), "forever": (30, TIMESTAMP_MAX)}
+        for href, time_range in ranges.items():
+            item = radicale_item.Item(
+                collection_path="calendar.ics",
+                text="",
+                etag='"%s"' % href,
+                uid=href,
+                name="VCALENDAR",
+                component_name="VEVENT",
+                time_range=time_range,
+            )
+            index.set(href, item)
+        assert index.complete
+        assert sorted(index.overlapping(45, 50)) == ["forever", "now"]
+        assert sorted(index.overlapping(0, 15)) == ["past"]
+        assert sorted(index.overlapping(20, 40)) == ["forever"]
+        index.remove("forever")
+        assert sorted(index.overlapping(85, 1000)) == ["future"]
+        index.set("past", item)
+        assert sorted(index.overlapping(0, 15)) == []
+        assert sorted(index.overlapping(20, 40)) == ["past"]
+
+    def test_item_index_concurrent(self):
+        """Verify that concurrent readers adding the same items leave every
+        item once in the time range index."""
+        index = ItemIndex("generation")
+        index.hrefs = {}
+        index.overlapping(0, 1)
+        items = []
+        for i in range(20):
+            items.append(
+                radicale_item.Item(
+                    collection_path="calendar.ics",
+                    text="",
+                    etag='"%d"' % i,
+                    uid=str(i),
+                    name="VCALENDAR",
+                    component_name="VEVENT",
+                    time_range=(i, i + 10),
+                )
+            )
+
+        def add():
+            for _ in range(200):
+                for i, item in enumerate(items):
+                    index.set("%d.ics" % i, item)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=add) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        assert len(index.starts) == len(index.ends) == len(items)
+        assert sorted(index.overlapping(0, 1000)) == sorted("%d.ics" % i for i in range(20))
+
+    def test_change_log(self):
+        """Verify the change log behind the sync tokens."""
+        log = ChangeLog(0x1234)
+        assert log.seq == 0
+        assert log.token_name() == "%016x%016x" % (0x1234, 0)
+        for epoch, href in enumerate(["a.ics", "b.ics", "a.ics", "c.ics"]):
+            log.append(href, epoch)
+        assert log.seq == 4
+        assert log.since(0) == ["a.ics", "b.ics", "c.ics"]
+        assert log.since(2) == ["a.ics", "c.ics"]
+        assert log.since(4) == []
+        store = CacheStore()
+        store.changes = log
+        store = CacheStore.loads(store.dumps())
+        log = store.changes
+        assert log.since(1) == ["b.ics", "a.ics", "c.ics"]
+        assert log.expire(1) == 2
+        assert log.first_seq == 3
+        assert log.seq == 4
+        assert log.since(2) == ["a.ics", "c.ics"]
+
+    def test_cache_store(self):
+        """Verify that the cache store keeps the last record of every item."""
+        store = CacheStore()
+        store.apply(("log", 0x1234, 1))
+        store.apply(("item", "a.ics", ["hash1", "a", '"etag1"', "text", "VCALENDAR", "VEVENT", 10, 20]))
+        store.apply(("item", "a.ics", ["hash2", "a", '"etag2"', "text", "VCALENDAR", "VEVENT", 10, 20]))
+        store.apply(("change", 1, 5, "a.ics"))
+        store.apply(("item", "b.ics", ["hash3", "b", '"etag3"', "text", "VCALENDAR", "VEVENT", 10, 20]))
+        store.apply(("drop", "b.ics"))
+        assert store.records == 6
+        assert store.live == 3
+        # a partly written last record is skipped
+        text = store.dumps() + CacheStore.record("item", "c.ics", [])[:10]
+        store = CacheStore.loads(text)
+        assert store.records == 3
+        assert store.items["a.ics"][0] == "hash2"
+        assert store.changes.token_name() == "%016x%016x" % (0x1234, 1)
+        # a change after a lost one ends the change log
+        store.apply(("change", 3, 6, "a.ics"))
+        assert store.changes is None
+
     def test_item_cache_rebuild(self):
         """Delete the item cache and verify that it is rebuild."""
         status, _, _ = self.request("MKCALENDAR", "/calendar.ics/")
@@ -1910,13 +2080,15 @@ class TestMultiFileSystem(BaseFileSystemTest, BaseRequestsMixIn):
         assert status == 201
         status, _, answer1 = self.request("GET", path)
         assert status == 200
-        cache_folder = os.path.join(self.colpath, "collection-root", "calendar.ics", ".Radicale.cache", "item")
-        assert os.path.exists(os.path.join(cache_folder, "event1.ics"))
-        shutil.rmtree(cache_folder)
+        store_path = os.path.join(self.colpath, "collection-root", "calendar.ics", ".Radicale.cache", "store")
+        assert os.path.exists(store_path)
+        os.remove(store_path)
+        # the store is kept in memory with the item index, like after a restart it is read again
+        self.application.Collection._item_indexes.clear()
         status, _, answer2 = self.request("GET", path)
         assert status == 200
         assert answer1 == answer2
-        assert os.path.exists(os.path.join(cache_folder, "event1.ics"))
+        assert os.path.exists(store_path)
 
     @pytest.mark.skipif(os.name not in ("nt", "posix"), reason="Only supported on 'nt' and 'posix'")
     def test_put_whole_calendar_uids_used_as_file_names(self):
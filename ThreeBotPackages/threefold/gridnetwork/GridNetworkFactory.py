@@ -1,6 +1,17 @@
 from Jumpscale import j
 
 
-class GridNetworkFactory(j.baseclasses.threebot_factory):
+class GridNetworkFactory(j.baseclasses.threebot_factory, j.baseclasses.testtools):
 
-    __jslocation__ = "j.threebot.package.grid_network"
\ No newline at end of file
+    __jslocation__ = "j.threebot.package.grid_network"
+
+    def test(self, name=""):
+        """
+
+        kosmos 'j.threebot.package.grid_network.test()'
+
+        """
+        self._test_run(name=name)
+
+        self._log_info("All TESTS DONE")
+        return "OK"
\ No newline at end of file
@@ -1,12 +1,168 @@
 from Jumpscale import j
+import bisect
+import gevent
+import gevent.pool
 import netaddr
 
+# seconds to wait for more peer changes before the endpoints get reconfigured
+PROPAGATE_DELAY = 1
+# max amount of endpoints configured at the same time
+PROPAGATE_WORKERS = 10
+# max seconds between 2 retries of endpoints which failed to configure, the delay doubles every retry
+RETRY_DELAY_MAX = 300
+
+
+class PeerPropagator:
+    """
+    keeps the members of the networks in memory and pushes peer changes to the public endpoints
+
+    peer changes are queued per endpoint, all changes made within PROPAGATE_DELAY seconds of each other
+    are applied together with 1 configure per endpoint, the endpoints are configured in parallel
+
+    the changes of an endpoint which failed to configure are kept and retried later, the delay doubles
+    on every failed attempt up to retry_delay_max seconds
+
+    :param wireguard: the wireguard tool, can be replaced by a stub for testing
+    """
+
+    def __init__(
+        self, wireguard=None, delay=PROPAGATE_DELAY, workers=PROPAGATE_WORKERS, retry_delay_max=RETRY_DELAY_MAX
+    ):
+        self.wireguard = wireguard or j.tools.wireguard
+        self.delay = delay
+        self.retry_delay_max = retry_delay_max
+        self.pool = gevent.pool.Pool(workers)
+        # network name -> {wid: member}
+        self._members = {}
+        # endpoint wid -> list of (action, peer) not pushed yet
+        self._pending = {}
+        # network name -> greenlet which will push the pending changes
+        self._scheduled = {}
+        # network name -> amount of failed attempts since the last successful one
+        self._retries = {}
+        # network name -> functions to call once the pending changes are pushed to all endpoints
+        self._callbacks = {}
+        # names of the networks of which the endpoints are being configured
+        self._flushing = set()
+
+    def members_get(self, network):
+        """
+        :return: dict wid -> member of the network
+        """
+        if network.name not in self._members:
+            self._members[network.name] = {wid: self.wireguard.get_by_id(wid) for wid in network.members}
+        return self._members[network.name]
+
+    def endpoints_get(self, network):
+        return [member for member in self.members_get(network).values() if member.network_public]
+
+    def member_add(self, network, member):
+        self.members_get(network)[member.wid] = member
+
+    def member_remove(self, network, wid):
+        self.members_get(network).pop(wid, None)
+
+    def members_forget(self, networkname=None):
+        """
+        forget the cached members, needs to be called when members got changed outside of the actor
+        """
+        if networkname:
+            self._members.pop(networkname, None)
+        else:
+            self._members.clear()
+
+    def peer_add(self, network, peer):
+        self.member_add(network, peer)
+        self._delta_add(network, "add", peer)
+
+    def peer_remove(self, network, peer, done=None):
+        """
+        :param done: function called once the removal is pushed to all endpoints, e.g. to delete the peer
+        """
+        self.member_remove(network, peer.wid)
+        self._delta_add(network, "remove", peer)
+        if done:
+            self._callbacks.setdefault(network.name, []).append(done)
+
+    def _delta_add(self, network, action, peer):
+        for endpoint in self.endpoints_get(network):
+            self._pending.setdefault(endpoint.wid, []).append((action, peer))
+        self._schedule(network, self.delay)
+
+    def _schedule(self, network, delay):
+        if network.name not in self._scheduled:
+            self._scheduled[network.name] = gevent.spawn_later(delay, self.flush, network)
+
+    def flush(self, network):
+        """
+        push the pending peer changes of the network to its endpoints now
+        """
+        greenlet = self._scheduled.pop(network.name, None)
+        if greenlet and greenlet is not gevent.getcurrent():
+            greenlet.kill(block=False)
+        if network.name in self._flushing:
+            # an endpoint is only configured by 1 flush at a time, the changes follow once it is done
+            self._schedule(network, self.delay)
+            return
+
+        self._flushing.add(network.name)
+        try:
+            self._flush(network)
+        finally:
+            self._flushing.discard(network.name)
+
+    def _flush(self, network):
+        todo = []
+        for endpoint in self.endpoints_get(network):
+            changes = self._pending.pop(endpoint.wid, None)
+            if changes:
+                todo.append((endpoint, changes))
+        callbacks = self._callbacks.pop(network.name, [])
+        results = self.pool.map(self._endpoint_update, todo)
+
+        failed = [item for item, result in zip(todo, results) if not result]
+        if failed:
+            # changes made while configuring come after the ones which failed
+            for endpoint, changes in failed:
+                self._pending[endpoint.wid] = changes + self._pending.get(endpoint.wid, [])
+            self._callbacks[network.name] = callbacks + self._callbacks.get(network.name, [])
+            retries = self._retries.get(network.name, 0) + 1
+            self._retries[network.name] = retries
+            self._schedule(network, min(self.delay * 2 ** retries, self.retry_delay_max))
+            return
+
+        self._retries.pop(network.name, None)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                j.errorhandler.exception_handle(e, die=False)
+
+    def _endpoint_update(self, item):
+        """
+        :return: True when the endpoint got configured
+        """
+        endpoint, changes = item
+        try:
+            for action, peer in changes:
+                if action == "add":
+                    endpoint.peer_add(peer)
+                else:
+                    endpoint.peer_remove(peer)
+            endpoint.configure()
+        except Exception as e:
+            j.errorhandler.exception_handle(e, die=False)
+            return False
+        return True
+
 
 class gridnetwork(j.baseclasses.threebot_actor):
     def _init(self, **kwargs):
         bcdb = j.data.bcdb.system
         self.networkmodel = bcdb.model_get(url="tfgrid.network.network.1")
         self.endpointmodel = bcdb.model_get(url="tfgrid.network.endpoint.1")
+        self.wireguard = j.tools.wireguard
+        self.propagator = PeerPropagator(wireguard=self.wireguard)
 
     def network_add(self, name, subnet, schema_out=None, user_session=None):
         """"
@@ -36,7 +192,7 @@ class gridnetwork(j.baseclasses.threebot_actor):
         """
         network = self._network_get(networkname)
         newip = self._get_free_ip(network)
-        wg = j.tools.wireguard.new(name=f"{networkname}-{sshclient_name}", save=False)
+        wg = self.wireguard.new(name=f"{networkname}-{sshclient_name}", save=False)
         sshclient = j.clients.ssh.get(sshclient_name, needexist=True)
         wg.sshclient_name = sshclient_name
         wg.install()
@@ -50,6 +206,7 @@ class gridnetwork(j.baseclasses.threebot_actor):
             raise
         network.members.append(wg.wid)
         network.save()
+        self.propagator.member_add(network, wg)
         out = schema_out.new()
         out.res = True
         return out
@@ -65,12 +222,15 @@ class gridnetwork(j.baseclasses.threebot_actor):
         ```
         """
         network = self._network_get(networkname)
-        wg = j.tools.wireguard.get(name=f"{networkname}-{sshclient_name}", needexist=True)
+        wg = self.wireguard.get(name=f"{networkname}-{sshclient_name}", needexist=True)
         wid = wg.wid
+        network_private = wg.network_private
         wg.delete()
         if wid in network.members:
             network.members.remove(wid)
+            self._release_ip(network, network_private)
             network.save()
+        self.propagator.member_remove(network, wid)
         out = schema_out.new()
         out.res = True
         return out
@@ -100,21 +260,55 @@ class gridnetwork(j.baseclasses.threebot_actor):
             raise j.exceptions.NotFound(f"Could not find exactly 1 network with name {networkname}")
         return networks[0]
 
+    def _allocated_get(self, network):
+        """
+        :return: sorted list of the offsets of the ips in use, rebuilt from the members for networks
+                 created before the offsets were stored
+        """
+        if network.members and not network.allocated:
+            subnet = netaddr.IPNetwork(network.subnet)
+            offsets = set()
+            for member in self.propagator.members_get(network).values():
+                offsets.add(netaddr.IPNetwork(member.network_private).ip.value - subnet.first)
+            return sorted(offsets)
+        return list(network.allocated)
+
     def _get_free_ip(self, network):
+        """
+        allocate the first free ip of the network, network needs to be saved afterwards
+        """
         subnet = netaddr.IPNetwork(network.subnet)
-        usedips = []
-        for memberid in network.members:
-            member = j.tools.wireguard.get_by_id(memberid)
-            usedips.append(netaddr.IPNetwork(member.network_private).ip)
+        allocated = self._allocated_get(network)
 
-        newip = netaddr.IPAddress(subnet.first + 1)
-        while newip in usedips:
-            newip += 1
+        # offsets start at 1 and are unique, so the first offset which is bigger then its position+1
+        # comes right after the first free one
+        low, high = 0, len(allocated)
+        while low < high:
+            middle = (low + high) // 2
+            if allocated[middle] > middle + 1:
+                high = middle
+            else:
+                low = middle + 1
+        offset = low + 1
 
         # sentinal against broadcast IPAddress
-        if newip + 1 not in subnet:
+        if subnet.first + offset + 1 > subnet.last:
             raise j.exceptions.Runtime("No free IPAdress inside network")
-        return f"{newip}/{subnet.prefixlen}"
+        allocated.insert(low, offset)
+        network.allocated = allocated
+        return f"{netaddr.IPAddress(subnet.first + offset)}/{subnet.prefixlen}"
+
+    def _release_ip(self, network, network_private):
+        """
+        give the ip of a member back to the network, network needs to be saved afterwards
+        """
+        subnet = netaddr.IPNetwork(network.subnet)
+        allocated = self._allocated_get(network)
+        offset = netaddr.IPNetwork(network_private).ip.value - subnet.first
+        index = bisect.bisect_left(allocated, offset)
+        if index < len(allocated) and allocated[index] == offset:
+            allocated.pop(index)
+        network.allocated = allocated
 
     def network_peer_add(self, networkname, peername, publickey, schema_out=None, user_session=None):
         """
@@ -128,28 +322,12 @@ class gridnetwork(j.baseclasses.threebot_actor):
         endpoints = (LO) !tfgrid.network.endpoint.1
         ```
         """
-        usedips = []
         network = self._network_get(networkname)
 
-        subnet = netaddr.IPNetwork(network.subnet)
-        endpoints = []
-        for memberid in network.members:
-            member = j.tools.wireguard.get_by_id(memberid)
-            if member.network_public:
-                endpoints.append(member)
-            usedips.append(netaddr.IPNetwork(member.network_private).ip)
-
-        newip = netaddr.IPAddress(subnet.first + 1)
-        while newip in usedips:
-            newip += 1
-        # sentinal against broadcast IPAddress
-        if newip + 1 not in subnet:
-            raise j.exceptions.Runtime("No free IPAdress inside network")
-
         out = schema_out.new()
-        out.network_private = f"{newip}/{subnet.prefixlen}"
+        out.network_private = self._get_free_ip(network)
 
-        peer = j.tools.wireguard.new(name=f"{networkname}-{peername}")
+        peer = self.wireguard.new(name=f"{networkname}-{peername}")
         peer.key_public = publickey
         peer.network_private = out.network_private
         peer.save()
@@ -157,16 +335,15 @@ class gridnetwork(j.baseclasses.threebot_actor):
         network.members.append(peer.wid)
         network.save()
 
-        for endpoint in endpoints:
+        for endpoint in self.propagator.endpoints_get(network):
             returnpoint = out.endpoints.new()
             returnpoint.network_public = endpoint.network_public
             returnpoint.network_private = endpoint.network_private
             returnpoint.key_public = endpoint.key_public
             returnpoint.port = endpoint.port
 
-            endpoint.peer_add(peer)
-            endpoint.configure()
-
+        # the endpoints get configured in the background, together with the other peers which join
+        self.propagator.peer_add(network, peer)
         return out
 
     def network_peer_remove(self, networkname, peername, schema_out=None, user_session=None):
@@ -181,23 +358,18 @@ class gridnetwork(j.baseclasses.threebot_actor):
         """
         fullname = f"{networkname}-{peername}"
         network = self._network_get(networkname)
-        endpoints = []
         neededmember = None
-        for memberid in network.members:
-            member = j.tools.wireguard.get_by_id(memberid)
-            if member.network_public:
-                endpoints.append(member)
+        for member in self.propagator.members_get(network).values():
             if member.name == fullname:
                 neededmember = member
         if not neededmember:
             raise j.exceptions.NotFound(f"Could not find peer {peername} inside network {networkname}")
         network.members.remove(neededmember.wid)
+        self._release_ip(network, neededmember.network_private)
         network.save()
-        for endpoint in endpoints:
-            endpoint.peer_remove(neededmember)
-            endpoint.configure()
+        # the peer is only deleted once the endpoints don't know it anymore
+        self.propagator.peer_remove(network, neededmember, done=neededmember.delete)
 
-        neededmember.delete()
         out = schema_out.new()
         out.res = True
         return out
@@ -0,0 +1,121 @@
+import importlib.util
+import logging
+import os
+
+import gevent
+from Jumpscale import j
+
+
+class FakeMember:
+    """
+    local replacement of a wireguard member, configure fails as long as fail is bigger then 0
+    and takes slow seconds
+    """
+
+    def __init__(self, wid, network_public="", fail=0):
+        self.wid = wid
+        self.name = "member%s" % wid
+        self.network_public = network_public
+        self.fail = fail
+        self.peers = set()
+        self.configured = set()
+        self.configures = 0
+        self.slow = 0
+        self.configuring = False
+        self.overlaps = 0
+        self.deleted = False
+
+    def peer_add(self, peer):
+        self.peers.add(peer.wid)
+
+    def peer_remove(self, peer):
+        self.peers.discard(peer.wid)
+
+    def configure(self):
+        self.configures += 1
+        if self.configuring:
+            self.overlaps += 1
+        self.configuring = True
+        try:
+            gevent.sleep(self.slow)
+        finally:
+            self.configuring = False
+        if self.fail:
+            self.fail -= 1
+            raise j.exceptions.Runtime("can not configure %s" % self.name)
+        self.configured = set(self.peers)
+
+    def delete(self):
+        self.deleted = True
+
+
+class FakeWireguard:
+    def __init__(self, members):
+        self.members = {member.wid: member for member in members}
+
+    def get_by_id(self, wid):
+        return self.members[wid]
+
+
+class FakeNetwork:
+    def __init__(self, name, members):
+        self.name = name
+        self.members = [member.wid for member in members]
+
+
+def main(self=None):
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "actors", "gridnetwork.py")
+    spec = importlib.util.spec_from_file_location("gridnetwork", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    endpoint1 = FakeMember(1, network_public="10.0.0.1")
+    endpoint2 = FakeMember(2, network_public="10.0.0.2")
+    network = FakeNetwork("test", [endpoint1, endpoint2])
+    propagator = module.PeerPropagator(wireguard=FakeWireguard([endpoint1, endpoint2]), delay=0.1)
+
+    logging.info("Peers added together are pushed with 1 configure per endpoint")
+    peers = [FakeMember(wid) for wid in range(10, 20)]
+    for peer in peers:
+        propagator.peer_add(network, peer)
+    gevent.sleep(0.3)
+    for endpoint in (endpoint1, endpoint2):
+        assert endpoint.configures == 1
+        assert endpoint.configured == {peer.wid for peer in peers}
+
+    logging.info("Failed endpoints are retried, the peer is only deleted once all endpoints are configured")
+    endpoint2.fail = 2
+    peer = peers[0]
+    propagator.peer_remove(network, peer, done=peer.delete)
+    gevent.sleep(0.2)
+    assert peer.wid not in endpoint1.configured
+    assert peer.wid in endpoint2.configured
+    assert not peer.deleted
+    # retried after 0.2 and 0.4 seconds
+    gevent.sleep(1)
+    assert endpoint2.configures == 4
+    assert peer.wid not in endpoint2.configured
+    assert peer.deleted
+    assert endpoint1.configures == 2
+
+    logging.info("Changes made while an endpoint is configured wait for that configure")
+    endpoint1.slow = 0.3
+    first, second = FakeMember(30), FakeMember(31)
+    propagator.peer_add(network, first)
+    gevent.sleep(0.15)
+    propagator.peer_add(network, second)
+    gevent.sleep(1)
+    assert endpoint1.overlaps == 0
+    assert {first.wid, second.wid} <= endpoint1.configured
+    endpoint1.slow = 0
+
+    logging.info("Flush pushes the pending changes right away")
+    propagator.peer_add(network, peer)
+    propagator.flush(network)
+    assert peer.wid in endpoint1.configured
+    assert peer.wid in endpoint2.configured
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -31,8 +31,7 @@ class TFPhonebookFactory(j.baseclasses.object, j.baseclasses.testtools):
 
         self.start()
 
-        j.shell()
-
-        print(name)
+        self._test_run(name=name)
 
+        self._log_info("All TESTS DONE")
         return "OK"
@@ -67,13 +67,11 @@ class phonebook(j.baseclasses.threebot_actor):
         """
         self._log_info("register step1: for 3bot name: %s" % name)
         # TODO: check the money parts
-        res = self.phonebook_model.find(name=name)
-        if len(res) == 1:
-            assert res[0].id
-            assert res[0].pubkey == pubkey
-            return res[0]
-        elif len(res) > 1:
-            raise j.exceptions.JSBUG("more then 1 should never be the case")
+        user = self.phonebook_model.get_by_name(name)
+        if user:
+            assert user.id
+            assert user.pubkey == pubkey
+            return user
         else:
             # is a new one, signature not known yet
             u = self.phonebook_model.new(name=name, pubkey=pubkey)
@@ -130,18 +128,14 @@ class phonebook(j.baseclasses.threebot_actor):
         if not ok:
             raise j.exceptions.Input("threebot cannot be registered, signature wrong")
 
-        res = self.phonebook_model.find(name=name)
-        if len(res) == 1:
-            u = res[0]
-            id = res[0].id
-            if not tid == id:
+        u = self.phonebook_model.get_by_name(name)
+        if u:
+            if not tid == u.id:
                 raise j.exceptions.Input("id does not match")
-            if pubkey != res[0].pubkey:
+            if pubkey != u.pubkey:
                 raise j.exceptions.Input(
                     "public key cannot be changed once registered, it serves as the security for making changes"
                 )
-        elif len(res) > 1:
-            raise j.exceptions.JSBUG("more thant 1 should never be the case")
         else:
             raise j.exceptions.JSBUG(
                 "there should have been 1 threebot, first use self.name_register() and then this method."
@@ -171,24 +165,56 @@ class phonebook(j.baseclasses.threebot_actor):
         ```
         """
         if tid and not tid == NONE:
-            user = self.phonebook_model.get(tid, die=False)
+            user = self.phonebook_model.get_cached(tid)
             if not user:
-                raise j.exceptions.NotFound("user not found id:{user_id}" % locals())
-            users = [user]
+                raise j.exceptions.NotFound("user not found id:%s" % tid)
         elif name:
-            users = self.phonebook_model.find(name=name)
+            user = self.phonebook_model.get_by_name(name)
         elif email:
-            users = self.phonebook_model.find(email=email)
+            user = self.phonebook_model.get_by_email(email)
         else:
             raise j.exceptions.NotFound("param error need to specify user_id or name or email")
 
-        if len(users) <= 0:
+        if not user:
             if die == False:
                 return None
             raise j.exceptions.NotFound("user not found (%s)" % locals())
-        if len(users) > 1:
-            raise j.exceptions.NotFound("more than 1 user found (%s)" % locals())
 
-        jsxobject = users[0]
+        return user
 
-        return jsxobject
+    def get_many(self, tids=None, names=None, schema_out=None, user_session=None):
+        """
+        get many users in 1 call
+
+        ```in
+        tids = (LI)
+        names = (LS)
+        ```
+
+        ```out
+        users = (dict)  # tid or name as given -> user (threebot.phonebook.user.1), not found ones are left out
+        ```
+        """
+        out = schema_out.new()
+        users = self.phonebook_model.get_many(tids=tids, names=names)
+        out.users = {str(key): user._ddict for key, user in users.items()}
+        return out
+
+    def verification_stats(self, schema_out=None, user_session=None):
+        """
+        counters of the signatures verified with the phonebook keys (see USER.signatures_verify)
+
+        ```out
+        signatures = (I)
+        valid = (I)
+        batches = (I)
+        per_second = (F)
+        ```
+        """
+        stats = self.phonebook_model.verify_stats
+        out = schema_out.new()
+        out.signatures = stats["signatures"]
+        out.valid = stats["valid"]
+        out.batches = stats["batches"]
+        out.per_second = stats["signatures"] / stats["seconds"] if stats["seconds"] else 0
+        return out
@@ -18,17 +18,300 @@
 # LICENSE END
 
 
+import binascii
+import time
+from collections import OrderedDict
+
+import gevent.threadpool
 from Jumpscale import j
 
+# batches smaller then this are verified in the calling greenlet
+VERIFY_BATCH_MIN = 8
+VERIFY_WORKERS = 4
+# max amount of users kept in memory
+USER_CACHE_SIZE = 10000
+# max amount of tids in 1 sqlite query
+QUERY_CHUNK_SIZE = 500
+UNIQUE_FIELDS = ["name", "email", "pubkey"]
+
 
 class USER(j.data.bcdb._BCDBModelClass):
+    """
+    phonebook user model with a lookup index (sqlite) which keeps name, email & pubkey unique
+    and an LRU cache of the most recently used users, which is updated every time a user is saved
+    """
+
     def _init2(self, **kwargs):
+        # tid -> decoded verify key (public key) of the user
+        self._verify_keys = {}
+        self._verify_pool = None
+        self.verify_stats = {"signatures": 0, "valid": 0, "batches": 0, "seconds": 0.0}
+        # tid -> user & name -> tid of the users in the cache
+        self._cache = OrderedDict()
+        self._cache_names = {}
+
+        class UserIndex(j.clients.peewee.Model):
+            class Meta:
+                database = None
+
+            # empty values are stored as NULL so they don't need to be unique
+            pw = j.clients.peewee
+            tid = pw.IntegerField(primary_key=True)
+            name = pw.TextField(unique=True, null=True)
+            email = pw.TextField(unique=True, null=True)
+            pubkey = pw.TextField(unique=True, null=True)
+
+        UserIndex._meta.database = self.bcdb.sqlite_index_client
+        UserIndex.create_table(safe=True)
+        self.UserIndex = UserIndex
+
         self.trigger_add(self.verify)
+        self.trigger_add(self._verify_key_trigger)
+        self.trigger_add(self._lookup_trigger)
+        if not UserIndex.select().exists():
+            self.index_rebuild()
 
     def verify(self, obj, action, propertyname):
         if action == "set_pre":
             # TODO: check the signature, if not ok fail
             pass
 
+    def _verify_key_trigger(self, obj, action, **kwargs):
+        if action in ("set_post", "delete"):
+            self._verify_keys.pop(obj.id, None)
+
+    def _lookup_trigger(self, obj, action, **kwargs):
+        if action == "set_pre":
+            self._unique_check(obj)
+        elif action == "set_post":
+            self._index_set(obj)
+            self._cache_pop(obj.id)
+            self._cache_set(obj)
+        elif action == "delete":
+            self.UserIndex.delete().where(self.UserIndex.tid == obj.id).execute()
+            self._cache_pop(obj.id)
+
+    def _unique_check(self, obj):
+        index = self.UserIndex
+        for field in UNIQUE_FIELDS:
+            value = getattr(obj, field)
+            if not value:
+                continue
+            query = index.select(index.tid).where(getattr(index, field) == value)
+            if obj.id:
+                query = query.where(index.tid != obj.id)
+            if query.exists():
+                # the cached user can have been modified before it was saved
+                self._cache_pop(obj.id)
+                raise j.exceptions.Input("a user with %s %s already exists" % (field, value))
+
+    def _index_set(self, obj):
+        """
+        index the user, values which are used by another user already (older data which was stored before
+        they were checked) are not indexed and logged, the user can still be found by its tid
+
+        :return: list of the fields which were not indexed
+        """
+        index = self.UserIndex
+        values = {}
+        conflicts = []
+        for field in UNIQUE_FIELDS:
+            value = getattr(obj, field) or None
+            if value:
+                other = index.get_or_none((getattr(index, field) == value) & (index.tid != obj.id))
+                if other:
+                    self._log_warning(
+                        "user %s has %s %s which is used by user %s already, not indexed"
+                        % (obj.id, field, value, other.tid)
+                    )
+                    conflicts.append(field)
+                    value = None
+            values[field] = value
+        with self.bcdb.sqlite_index_client.atomic():
+            index.delete().where(index.tid == obj.id).execute()
+            index.insert(tid=obj.id, **values).execute()
+        return conflicts
+
+    def destroy(self, *args, **kwargs):
+        super().destroy(*args, **kwargs)
+        self.UserIndex._meta.database = self.bcdb.sqlite_index_client
+        self.UserIndex.create_table(safe=True)
+        self.UserIndex.delete().execute()
+        self.cache_clear()
+
+    def index_rebuild(self):
+        """
+        rebuild the lookup index from the users stored in BCDB
+
+        :return: dict tid -> fields which were not indexed because another user has the same value
+        """
+        conflicts = {}
+        with self.bcdb.sqlite_index_client.atomic():
+            self.UserIndex.delete().execute()
+            self.cache_clear()
+            for obj in self.iterate():
+                fields = self._index_set(obj)
+                if fields:
+                    conflicts[obj.id] = fields
+        return conflicts
+
+    def _cache_set(self, obj):
+        self._cache[obj.id] = obj
+        self._cache.move_to_end(obj.id)
+        if obj.name:
+            self._cache_names[obj.name] = obj.id
+        if len(self._cache) > USER_CACHE_SIZE:
+            _, old = self._cache.popitem(last=False)
+            self._cache_names.pop(old.name, None)
+
+    def _cache_pop(self, tid):
+        obj = self._cache.pop(tid, None)
+        if obj:
+            self._cache_names.pop(obj.name, None)
+
+    def cache_clear(self):
+        """
+        forget all cached users, needs to be called when users got changed by another process
+        """
+        self._cache.clear()
+        self._cache_names.clear()
+        self._verify_keys.clear()
+
+    def get_cached(self, tid):
+        """
+        get a user through the cache, never modify the returned user without saving it
+
+        :return: the user or None
+        """
+        if tid in self._cache:
+            self._cache.move_to_end(tid)
+            return self._cache[tid]
+        obj = self.get(tid, die=False)
+        if obj:
+            self._cache_set(obj)
+        return obj
+
+    def get_by_name(self, name):
+        """
+        :return: the user with this name or None
+        """
+        if name in self._cache_names:
+            obj = self.get_cached(self._cache_names[name])
+            # the cached user can have been renamed
+            if obj and obj.name == name:
+                return obj
+        return self._get_by_field("name", name)
+
+    def get_by_email(self, email):
+        """
+        :return: the user with this email or None
+        """
+        return self._get_by_field("email", email)
+
+    def get_by_pubkey(self, pubkey):
+        """
+        :return: the user with this public key or None
+        """
+        return self._get_by_field("pubkey", pubkey)
+
+    def _get_by_field(self, field, value):
+        if not value:
+            return None
+        index = self.UserIndex
+        row = index.select(index.tid).where(getattr(index, field) == value).first()
+        return self.get_cached(row.tid) if row else None
+
+    def verify_keys_get(self, tids):
+        """
+        get the decoded verify keys (public keys) of many users at once
+
+        :param tids: threebot ids of the users
+        :return: dict tid -> verify key, users which don't exist are not part of the result
+        """
+        tids = set(tids)
+        missing = [tid for tid in tids if tid not in self._verify_keys]
+        for row in self._index_select(tids=missing):
+            if row.pubkey:
+                self._verify_keys[row.tid] = binascii.unhexlify(row.pubkey)
+        # users which are not in the index or whose pubkey could not be indexed
+        for tid in missing:
+            if tid not in self._verify_keys:
+                obj = self.get_cached(tid)
+                if obj and obj.pubkey:
+                    self._verify_keys[tid] = binascii.unhexlify(obj.pubkey)
+        return {tid: self._verify_keys[tid] for tid in tids if tid in self._verify_keys}
+
+    def _index_select(self, tids=None, names=None):
+        """
+        :return: generator of the index rows of the users with one of the tids or names
+        """
+        index = self.UserIndex
+        for field, values in ((index.tid, list(tids or [])), (index.name, list(names or []))):
+            for i in range(0, len(values), QUERY_CHUNK_SIZE):
+                yield from index.select().where(field.in_(values[i : i + QUERY_CHUNK_SIZE]))
+
+    def get_many(self, tids=None, names=None):
+        """
+        resolve many users at once, users which are cached are not looked up in the index
+
+        :param tids: threebot ids
+        :param names: threebot names
+        :return: dict tid or name -> user, tids & names which are not found are not part of the result
+        """
+        users = {}
+        missing_tids = []
+        for tid in set(tids or []):
+            if tid in self._cache:
+                users[tid] = self.get_cached(tid)
+            else:
+                missing_tids.append(tid)
+        missing_names = []
+        for name in set(names or []):
+            user = self._cache.get(self._cache_names.get(name))
+            if user and user.name == name:
+                users[name] = user
+            else:
+                missing_names.append(name)
+
+        wanted = set(missing_tids) | set(missing_names)
+        for row in self._index_select(tids=missing_tids, names=missing_names):
+            user = self.get_cached(row.tid)
+            if not user:
+                continue
+            for key in (row.tid, row.name):
+                if key in wanted:
+                    users[key] = user
+        return users
+
+    def _signature_verify(self, item):
+        payload, signature, verify_key = item
+        try:
+            signature = binascii.unhexlify(signature)
+            return bool(j.data.nacl.default.verify(payload.encode(), signature, verify_key=verify_key))
+        except Exception:
+            # wrong formatted or invalid signature
+            return False
+
+    def signatures_verify(self, items):
+        """
+        verify a batch of signatures, big batches are verified on a pool of threads
+
+        :param items: list of (payload, signature in hex, verify key) tuples, see verify_keys_get for the keys
+        :return: list of booleans in the same order as items
+        """
+        start = time.time()
+        if len(items) < VERIFY_BATCH_MIN:
+            results = [self._signature_verify(item) for item in items]
+        else:
+            if not self._verify_pool:
+                self._verify_pool = gevent.threadpool.ThreadPool(VERIFY_WORKERS)
+            results = list(self._verify_pool.imap(self._signature_verify, items))
+
+        self.verify_stats["batches"] += 1
+        self.verify_stats["signatures"] += len(items)
+        self.verify_stats["valid"] += sum(results)
+        self.verify_stats["seconds"] += time.time() - start
+        return results
+
     def _schema_get(self):
         return j.data.schema.get_from_url("threebot.phonebook.user.1")
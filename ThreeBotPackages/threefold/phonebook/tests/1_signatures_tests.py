@@ -0,0 +1,79 @@
+import binascii
+import importlib.util
+import logging
+import os
+import uuid
+
+from nacl import signing
+from Jumpscale import j
+
+
+def main(self=None):
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models", "USER.py")
+    spec = importlib.util.spec_from_file_location("USER", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    try:
+        bcdb = j.data.bcdb.new("threebot_phonebook")
+    except:
+        bcdb = j.data.bcdb.get("threebot_phonebook")
+    model = bcdb.model_get(url="threebot.phonebook.user.1")
+
+    keys = {}
+    for _ in range(3):
+        key = signing.SigningKey.generate()
+        name = uuid.uuid4().hex
+        user = model.new()
+        user.name = name
+        user.email = "%s@test.com" % name
+        user.pubkey = binascii.hexlify(key.verify_key.encode())
+        user.save()
+        keys[user.id] = key
+    verify_keys = model.verify_keys_get(list(keys))
+    assert set(verify_keys) == set(keys)
+
+    def items_get(amount):
+        """
+        valid, signed by another user & wrong formatted signatures, in turns
+        """
+        items = []
+        expected = []
+        tids = list(keys)
+        for i in range(amount):
+            tid = tids[i % len(tids)]
+            payload = "payload %s" % i
+            if i % 3 == 0:
+                signature = binascii.hexlify(keys[tid].sign(payload.encode()).signature)
+            elif i % 3 == 1:
+                other = tids[(i + 1) % len(tids)]
+                signature = binascii.hexlify(keys[other].sign(payload.encode()).signature)
+            else:
+                signature = "not hex"
+            items.append((payload, signature, verify_keys[tid]))
+            expected.append(i % 3 == 0)
+        return items, expected
+
+    logging.info("Small batches are verified in the calling greenlet")
+    model._verify_pool = None
+    items, expected = items_get(module.VERIFY_BATCH_MIN - 1)
+    assert model.signatures_verify(items) == expected
+    assert model._verify_pool is None
+
+    logging.info("Big batches are verified on the threadpool, the results keep the order of the items")
+    stats = dict(model.verify_stats)
+    items, expected = items_get(module.VERIFY_BATCH_MIN * 5)
+    assert model.signatures_verify(items) == expected
+    assert model._verify_pool is not None
+    assert model.verify_stats["batches"] == stats["batches"] + 1
+    assert model.verify_stats["signatures"] == stats["signatures"] + len(items)
+    assert model.verify_stats["valid"] == stats["valid"] + sum(expected)
+
+    logging.info("An empty batch verifies nothing")
+    assert model.signatures_verify([]) == []
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,17 @@ class TFDirectoryFactory(j.baseclasses.threebot_factory):
         package.save()
         return "OK"
 
+    def aggregates_rebuild(self):
+        """
+        recount the capacity totals per farm, country & grid from the nodes
+
+        kosmos 'j.threebot.package.directory.aggregates_rebuild()'
+        """
+        bcdb = j.data.bcdb.get("tf_directory")
+        bcdb.models_add(path=j.sal.fs.joinPaths(self._dirpath, "models"))
+        bcdb.model_get(url="tfgrid.node.2").aggregates_rebuild()
+        return "OK"
+
     def start(self):
         self.install()
         server = j.servers.threebot.default
@@ -1,5 +1,7 @@
 from Jumpscale import j
 
+MAX_PAGE_SIZE = 500
+
 
 class nodes(j.baseclasses.threebot_actor):
     def _init(self, **kwargs):
@@ -7,12 +9,19 @@ class nodes(j.baseclasses.threebot_actor):
         bcdb = j.data.bcdb.get("tf_directory")
         self.node_model = bcdb.model_get(url="tfgrid.node.2")
         self.farm_model = bcdb.model_get(url="tfgrid.farm.1")
+        if not self.node_model.NodeIndex.select().exists():
+            self.node_model.index_rebuild()
+        if not self.node_model.NodeCapacity.select().exists():
+            self.node_model.aggregates_rebuild()
 
     def _find(self, node_id):
-        nodes = self.node_model.find(node_id=node_id)
-        if len(nodes) <= 0:
-            return None
-        return nodes[0]
+        return self.node_model.get_by_node_id(node_id)
+
+    def _find_for_update(self, node_id):
+        node = self.node_model.get_for_update(node_id)
+        if not node:
+            raise j.exceptions.NotFound("node %s not found" % node_id)
+        return node
 
     def add(self, node, schema_out=None, user_session=None):
         """
@@ -42,7 +51,9 @@ class nodes(j.baseclasses.threebot_actor):
             return self.node_model.set_dynamic(node._ddict, obj_id=old_node.id)
         return self.node_model.new(data=node).save()
 
-    def list(self, farm_id, country, city, cru, sru, mru, hru, proofs, schema_out=None, user_session=None):
+    def list(
+        self, farm_id, country, city, cru, sru, mru, hru, proofs, cursor, page_size, schema_out=None, user_session=None
+    ):
         """
         ```in
         farm_id = (S)
@@ -53,28 +64,37 @@ class nodes(j.baseclasses.threebot_actor):
         sru = -1 (I)
         hru = -1 (I)
         proofs = False (B)
+        cursor = 0 (I)  # next_cursor of the previous page, 0 for the first page
+        page_size = 100 (I)
         ```
 
         ```out
         nodes = (LO) !tfgrid.node.2
+        next_cursor = 0 (I)  # 0 if there are no more pages
         ```
         """
+        if page_size <= 0 or page_size > MAX_PAGE_SIZE:
+            page_size = MAX_PAGE_SIZE
 
         output = schema_out.new()
-        for node in self.node_model.iterate():
-            if farm_id and farm_id != node.farm_id:
-                continue
-            if country != "" and node.location.country != country:
-                continue
-            if city != "" and node.location.city != city:
-                continue
-            if cru > -1 and node.total_resources.cru < cru:
-                continue
-            if mru > -1 and node.total_resources.mru < mru:
-                continue
-            if sru > -1 and node.total_resources.sru < sru:
-                continue
-            if hru > -1 and node.total_resources.hru < hru:
+        obj_ids = self.node_model.index_query(
+            farm_id=farm_id,
+            country=country,
+            city=city,
+            cru=cru,
+            mru=mru,
+            sru=sru,
+            hru=hru,
+            cursor=cursor,
+            limit=page_size + 1,
+        )
+        if len(obj_ids) > page_size:
+            obj_ids = obj_ids[:page_size]
+            output.next_cursor = obj_ids[-1]
+
+        for obj_id in obj_ids:
+            node = self.node_model.get(obj_id, die=False)
+            if not node:
                 continue
             if not proofs:
                 node.proofs = []
@@ -93,11 +113,54 @@ class nodes(j.baseclasses.threebot_actor):
         node = (O) !tfgrid.node.2
         ```
         """
-        node = self._find(node_id)
+        # not served from the cache because the returned object gets modified
+        node = self.node_model.get_by_node_id(node_id, cache=False)
+        if not node:
+            raise j.exceptions.NotFound("node %s not found" % node_id)
         if not proofs:
             node.proofs = []
         return node
 
+    def capacity_totals(self, farm_id, country, schema_out=None, user_session=None):
+        """
+        total, reserved & used resources summed over the nodes of a farm, of a country or of the whole grid
+        when no farm_id or country is given
+
+        ```in
+        farm_id = (S)
+        country = (S)
+        ```
+
+        ```out
+        nodes = 0 (I)
+        total = (O) !tfgrid.node.resource.amount.1
+        reserved = (O) !tfgrid.node.resource.amount.1
+        used = (O) !tfgrid.node.resource.amount.1
+        ```
+        """
+        totals = self.node_model.aggregates_get(farm_id=farm_id, country=country)
+        out = schema_out.new()
+        out.nodes = totals["nodes"]
+        for kind in ("total", "reserved", "used"):
+            resources = getattr(out, kind)
+            for unit, amount in totals[kind].items():
+                setattr(resources, unit, amount)
+        return out
+
+    def _resources_set(self, resources, resource):
+        """
+        copy the amounts of resource into resources
+
+        :return: True if one of the amounts changed
+        """
+        changed = False
+        for field in ("cru", "mru", "hru", "sru"):
+            value = getattr(resource, field)
+            if getattr(resources, field) != value:
+                setattr(resources, field, value)
+                changed = True
+        return changed
+
     def update_total_capacity(self, node_id, resource, schema_out=None, user_session=None):
         """
         ```in
@@ -106,14 +169,11 @@ class nodes(j.baseclasses.threebot_actor):
         ```
 
         """
-        node = self._find(node_id)
-        if not node:
-            raise j.exceptions.NotFound("node %s not found" % id)
-        node.total_resources.mru = resource.mru
-        node.total_resources.cru = resource.cru
-        node.total_resources.hru = resource.hru
-        node.total_resources.sru = resource.sru
-        node.save()
+        node = self._find_for_update(node_id)
+        if self._resources_set(node.total_resources, resource):
+            node.save()
+        else:
+            self.node_model.release(node)
         return True
 
     def update_reserved_capacity(self, node_id, resource, schema_out=None, user_session=None):
@@ -123,15 +183,11 @@ class nodes(j.baseclasses.threebot_actor):
         resource = (O) !tfgrid.node.resource.amount.1
         ```
         """
-        node = self._find(node_id)
-        if not node:
-            raise j.exceptions.NotFound("node %s not found" % id)
-        node.reserved_resources.mru = resource.mru
-        node.reserved_resources.cru = resource.cru
-        node.reserved_resources.hru = resource.hru
-        node.reserved_resources.sru = resource.sru
-
-        node.save()
+        node = self._find_for_update(node_id)
+        if self._resources_set(node.reserved_resources, resource):
+            node.save()
+        else:
+            self.node_model.release(node)
         return True
 
     def update_used_capacity(self, node_id, resource, schema_out=None, user_session=None):
@@ -142,16 +198,50 @@ class nodes(j.baseclasses.threebot_actor):
         ```
         """
 
-        node = self._find(node_id)
-        if not node:
-            raise j.exceptions.NotFound("node %s not found" % id)
-        node.used_resources.mru = resource.mru
-        node.used_resources.cru = resource.cru
-        node.used_resources.hru = resource.hru
-        node.used_resources.sru = resource.sru
-        node.save()
+        node = self._find_for_update(node_id)
+        if self._resources_set(node.used_resources, resource):
+            node.save()
+        else:
+            self.node_model.release(node)
         return True
 
+    def report_capacity_batch(self, reports, schema_out=None, user_session=None):
+        """
+        update the total, reserved & used capacity of many nodes at once
+        if a node is reported more then once only the last report is used
+        nodes are only written when their capacity changed
+
+        ```in
+        reports = (LO) !tfgrid.node.capacity.report.1
+        ```
+
+        ```out
+        updated = 0 (I)
+        unchanged = 0 (I)
+        not_found = (LS)
+        ```
+        """
+        latest = {}
+        for report in reports:
+            latest[report.node_id] = report
+
+        out = schema_out.new()
+        for node_id, report in latest.items():
+            node = self.node_model.get_for_update(node_id)
+            if not node:
+                out.not_found.append(node_id)
+                continue
+            changed = self._resources_set(node.total_resources, report.total)
+            changed = self._resources_set(node.reserved_resources, report.reserved) or changed
+            changed = self._resources_set(node.used_resources, report.used) or changed
+            if changed:
+                node.save()
+                out.updated += 1
+            else:
+                self.node_model.release(node)
+                out.unchanged += 1
+        return out
+
     def publish_interfaces(self, node_id, ifaces, schema_out=None, user_session=None):
         """
         ```in
@@ -160,9 +250,7 @@ class nodes(j.baseclasses.threebot_actor):
         ```
         """
 
-        node = self._find(node_id)
-        if not node:
-            raise j.exceptions.NotFound("node %s not found" % id)
+        node = self._find_for_update(node_id)
         node.ifaces = ifaces
         node.save()
         return True
@@ -175,9 +263,7 @@ class nodes(j.baseclasses.threebot_actor):
         ```
         """
 
-        node = self._find(node_id)
-        if not node:
-            raise j.exceptions.NotFound("node %s not found" % id)
+        node = self._find_for_update(node_id)
 
         node.public_config = public
         node.save()
@@ -1,21 +1,70 @@
-def sync_directory():
+def sync_directory(models_path=None, incremental=True, workers=10, client=None):
+    """
+    sync the farms & nodes of the (old) threefold directory into BCDB
+
+    :param models_path: path of the directory models, loads the NODE model class so the node index stays up to date
+    :param incremental: when True only nodes which changed since the last sync are written
+                        and an interrupted sync continues with the farms it did not process yet
+    :param workers: max amount of farms for which the capacity is fetched at the same time
+    :param client: the directory client, defaults to j.clients.threefold_directory.client
+    :return: dict with statistics of the sync
+    """
+    import hashlib
+    import json
+    import time
     from datetime import datetime
+    from functools import lru_cache
+
+    from gevent.pool import Pool
 
+    checkpoint_key = "tfgrid:directory:sync:done"
     old_format = "%a, %d %b %Y %H:%M:%S %Z"
     new_format = "%d/%m/%Y %H:%M"
 
+    @lru_cache(maxsize=4096)
+    def date_convert(value):
+        return datetime.strptime(value, old_format).strftime(new_format)
+
+    def node_hash(node):
+        data = json.dumps(node, sort_keys=True)
+        return hashlib.md5(data.encode()).hexdigest()
+
     bcdb = j.data.bcdb.get("tf_directory")
+    if models_path:
+        bcdb.models_add(path=models_path)
     farm_model = bcdb.model_get(url="tfgrid.farm.1")
     node_model = bcdb.model_get(url="tfgrid.node.2")
+    client = client or j.clients.threefold_directory.client
+
+    stats = {"farms": 0, "nodes": 0, "nodes_changed": 0, "farms_skipped": 0}
+    start = time.time()
 
-    response = j.clients.threefold_directory.client.ListFarmers()[1]
+    response = client.ListFarmers()[1]
     if response.status_code != 200:
         j.core.tools.log("Failed to list farmers: %s" % response.reason, level=40)
-        return
+        return stats
 
     farms = response.json()
 
-    for farm in farms:
+    if incremental:
+        # farms already processed by a previous sync which got interrupted
+        done = {name.decode() for name in j.core.db.smembers(checkpoint_key)}
+        stats["farms_skipped"] = len(done)
+        farms = [farm for farm in farms if farm["name"] not in done]
+    else:
+        j.core.db.delete(checkpoint_key)
+
+    def capacity_list(farm):
+        response = client.ListCapacity(query_params={"farmer": farm["iyo_organization"], "proofs": True})[1]
+        if response.status_code != 200:
+            j.core.tools.log(
+                "Failed to list capacity for farmer %s: %s" % (farm["iyo_organization"], response.reason), level=40
+            )
+            return farm, None
+        return farm, response.json()
+
+    pool = Pool(workers)
+    for farm, nodes in pool.imap_unordered(capacity_list, farms):
         j.core.tools.log("Processing farm %s" % farm["name"], level=20)
 
         farmobjs = farm_model.find(name=farm["name"])
@@ -24,39 +73,41 @@ def sync_directory():
         else:
             farm_object = farmobjs[0]
 
-        response = j.clients.threefold_directory.client.ListCapacity(
-            query_params={"farmer": farm["iyo_organization"], "proofs": True}
-        )[1]
-        if response.status_code != 200:
-            j.core.tools.log(
-                "Failed to list capacity for farmer %s: %s" % (farm["iyo_organization"], response.reason), level=40
-            )
+        if nodes is None:
             continue
 
-        nodes = response.json()
-
-        for node in nodes:
-            j.core.tools.log("Processing node %s" % node["node_id"], level=20)
-
-            node["farm_id"] = farm_object.id
-
-            if "updated" in node:
-                updated = datetime.strptime(node["updated"], old_format)
-                node["updated"] = updated.strftime(new_format)
-            if "created" in node:
-                created = datetime.strptime(node["created"], old_format)
-                node["created"] = created.strftime(new_format)
-
-            for proof in node["proofs"]:
-                created = datetime.strptime(proof["created"], old_format)
-                proof["created"] = created.strftime(new_format)
-
-            existing_nodes = node_model.find(node_id=node["node_id"])
-            if existing_nodes:
-                j.core.tools.log("Updating existing node %s" % node["node_id"], level=20)
-                node_object = existing_nodes[0]
-                node_model.set_dynamic(node, node_object.id)
-            else:
-                j.core.tools.log("Creating new node %s" % node["node_id"], level=20)
-                node_object = node_model.new(node)
-                node_object.save()
+        hashes = {node["node_id"]: node_hash(node) for node in nodes}
+        known_hashes = node_model.sync_state_get(hashes.keys()) if incremental else {}
+        changed_nodes = [node for node in nodes if known_hashes.get(node["node_id"]) != hashes[node["node_id"]]]
+
+        with bcdb.sqlite_index_client.atomic():
+            for node in changed_nodes:
+                node["farm_id"] = farm_object.id
+
+                if "updated" in node:
+                    node["updated"] = date_convert(node["updated"])
+                if "created" in node:
+                    node["created"] = date_convert(node["created"])
+                for proof in node["proofs"]:
+                    proof["created"] = date_convert(proof["created"])
+
+                node_object = node_model.get_by_node_id(node["node_id"], cache=False)
+                if node_object:
+                    j.core.tools.log("Updating existing node %s" % node["node_id"], level=20)
+                    node_model.set_dynamic(node, node_object.id)
+                else:
+                    j.core.tools.log("Creating new node %s" % node["node_id"], level=20)
+                    node_model.new(node).save()
+
+            node_model.sync_state_set({node["node_id"]: hashes[node["node_id"]] for node in changed_nodes})
+
+        j.core.db.sadd(checkpoint_key, farm["name"])
+        stats["farms"] += 1
+        stats["nodes"] += len(nodes)
+        stats["nodes_changed"] += len(changed_nodes)
+
+    # all farms processed, next sync starts from the beginning
+    j.core.db.delete(checkpoint_key)
+    stats["duration"] = time.time() - start
+    j.core.tools.log("Directory sync done: %s" % stats, level=20)
+    return stats
@@ -0,0 +1,381 @@
+import time
+from collections import OrderedDict
+
+from Jumpscale import j
+
+NODE_CACHE_SIZE = 10000
+RESOURCE_KINDS = ["total", "reserved", "used"]
+RESOURCE_UNITS = ["cru", "mru", "sru", "hru"]
+RESOURCE_COLUMNS = ["%s_%s" % (kind, unit) for kind in RESOURCE_KINDS for unit in RESOURCE_UNITS]
+
+
+class NODE(j.data.bcdb._BCDBModelClass):
+    """
+    node model with a secondary index (sqlite) on node_id, farm, location & total resources
+    so nodes can be found without loading every node object
+
+    the most recently used nodes are kept in memory (LRU) so the capacity updates nodes send all the time
+    only cost a dict lookup and a write, the version in the index tells when a node got saved by another
+    process (e.g. the directory sync job) since it was cached
+
+    the total, reserved & used resources are summed per farm, per country and for the whole grid
+    (CapacityAggregate), every save only applies the difference with what the node added before (NodeCapacity)
+    """
+
+    def _init2(self, **kwargs):
+        # node_id -> (version, node)
+        self._cache = OrderedDict()
+        # node_id -> version of the nodes taken out of the cache by get_for_update, cached again when saved
+        # or released
+        self._updating = {}
+
+        class NodeIndex(j.clients.peewee.Model):
+            class Meta:
+                database = None
+
+            pw = j.clients.peewee
+            obj_id = pw.IntegerField(primary_key=True)
+            node_id = pw.TextField(unique=True, default="")
+            farm_id = pw.TextField(index=True, default="")
+            country = pw.TextField(index=True, default="")
+            city = pw.TextField(index=True, default="")
+            cru = pw.IntegerField(index=True, default=0)
+            mru = pw.IntegerField(index=True, default=0)
+            sru = pw.IntegerField(index=True, default=0)
+            hru = pw.IntegerField(index=True, default=0)
+            # changes every time the node is saved, by any process
+            version = pw.IntegerField(default=0)
+
+        class NodeSyncState(j.clients.peewee.Model):
+            """
+            hash of the node as last received from the (old) directory, used by the sync job
+            """
+
+            class Meta:
+                database = None
+
+            pw = j.clients.peewee
+            node_id = pw.TextField(primary_key=True)
+            content_hash = pw.TextField(default="")
+
+        class NodeCapacity(j.clients.peewee.Model):
+            """
+            resources of every node as they are counted in the aggregates
+            """
+
+            class Meta:
+                database = None
+
+            pw = j.clients.peewee
+            obj_id = pw.IntegerField(primary_key=True)
+            farm_id = pw.TextField(default="")
+            country = pw.TextField(default="")
+            total_cru = pw.IntegerField(default=0)
+            total_mru = pw.IntegerField(default=0)
+            total_sru = pw.IntegerField(default=0)
+            total_hru = pw.IntegerField(default=0)
+            reserved_cru = pw.IntegerField(default=0)
+            reserved_mru = pw.IntegerField(default=0)
+            reserved_sru = pw.IntegerField(default=0)
+            reserved_hru = pw.IntegerField(default=0)
+            used_cru = pw.IntegerField(default=0)
+            used_mru = pw.IntegerField(default=0)
+            used_sru = pw.IntegerField(default=0)
+            used_hru = pw.IntegerField(default=0)
+
+        class CapacityAggregate(j.clients.peewee.Model):
+            """
+            resources summed per farm, per country & for the whole grid (scope grid, key is empty)
+            """
+
+            class Meta:
+                database = None
+                indexes = ((("scope", "key"), True),)
+
+            pw = j.clients.peewee
+            scope = pw.TextField()
+            key = pw.TextField(default="")
+            nodes = pw.IntegerField(default=0)
+            total_cru = pw.IntegerField(default=0)
+            total_mru = pw.IntegerField(default=0)
+            total_sru = pw.IntegerField(default=0)
+            total_hru = pw.IntegerField(default=0)
+            reserved_cru = pw.IntegerField(default=0)
+            reserved_mru = pw.IntegerField(default=0)
+            reserved_sru = pw.IntegerField(default=0)
+            reserved_hru = pw.IntegerField(default=0)
+            used_cru = pw.IntegerField(default=0)
+            used_mru = pw.IntegerField(default=0)
+            used_sru = pw.IntegerField(default=0)
+            used_hru = pw.IntegerField(default=0)
+
+        self._tables = (NodeIndex, NodeSyncState, NodeCapacity, CapacityAggregate)
+        db = self.bcdb.sqlite_index_client
+        for table in self._tables:
+            table._meta.database = db
+        if "nodeindex" in db.get_tables():
+            columns = [column.name for column in db.get_columns("nodeindex")]
+            if "version" not in columns:
+                # index of an older version, gets rebuilt by the actor
+                NodeIndex.drop_table()
+        for table in self._tables:
+            table.create_table(safe=True)
+        self.NodeIndex = NodeIndex
+        self.NodeSyncState = NodeSyncState
+        self.NodeCapacity = NodeCapacity
+        self.CapacityAggregate = CapacityAggregate
+        self.trigger_add(self._index_trigger)
+
+    def _schema_get(self):
+        return j.data.schema.get_from_url("tfgrid.node.2")
+
+    def _index_trigger(self, obj, action, **kwargs):
+        if action == "set_post":
+            with self.bcdb.sqlite_index_client.atomic():
+                version = self._index_set(obj)
+                # a node with the node_id of another node is not counted either
+                self._aggregates_update(obj.id, obj if version is not None else None)
+            if version is None:
+                return
+            if obj.node_id in self._cache or obj.node_id in self._updating:
+                self._updating.pop(obj.node_id, None)
+                self._cache_set(obj, version)
+        elif action == "delete":
+            with self.bcdb.sqlite_index_client.atomic():
+                self.NodeIndex.delete().where(self.NodeIndex.obj_id == obj.id).execute()
+                self._aggregates_update(obj.id, None)
+            cached = self._cache.get(obj.node_id)
+            if cached and cached[1].id == obj.id:
+                del self._cache[obj.node_id]
+
+    def destroy(self, *args, **kwargs):
+        super().destroy(*args, **kwargs)
+        for table in self._tables:
+            table._meta.database = self.bcdb.sqlite_index_client
+            table.create_table(safe=True)
+            table.delete().execute()
+        self.cache_clear()
+
+    def _aggregates_update(self, obj_id, obj):
+        """
+        replace what the node added to the aggregates before by its current resources
+
+        :param obj: the node, None when it got deleted
+        """
+        capacity = self.NodeCapacity
+        old = capacity.get_or_none(capacity.obj_id == obj_id)
+        new = None
+        if obj:
+            new = {"farm_id": str(obj.farm_id), "country": str(obj.location.country)}
+            for kind in RESOURCE_KINDS:
+                resources = getattr(obj, "%s_resources" % kind)
+                for unit in RESOURCE_UNITS:
+                    new["%s_%s" % (kind, unit)] = getattr(resources, unit)
+            if old and all(getattr(old, key) == value for key, value in new.items()):
+                return
+
+        if old:
+            old = {column: getattr(old, column) for column in ["farm_id", "country"] + RESOURCE_COLUMNS}
+
+        # (scope, key) -> [nodes, *resources]
+        deltas = {}
+        for row, sign in ((old, -1), (new, 1)):
+            if not row:
+                continue
+            for scope_key in (("farm", row["farm_id"]), ("country", row["country"]), ("grid", "")):
+                delta = deltas.setdefault(scope_key, [0] * (len(RESOURCE_COLUMNS) + 1))
+                delta[0] += sign
+                for i, column in enumerate(RESOURCE_COLUMNS):
+                    delta[i + 1] += sign * row[column]
+
+        aggregate = self.CapacityAggregate
+        for (scope, key), delta in deltas.items():
+            if not any(delta):
+                continue
+            values = dict(zip(["nodes"] + RESOURCE_COLUMNS, delta))
+            updated = (
+                aggregate.update({getattr(aggregate, c): getattr(aggregate, c) + v for c, v in values.items()})
+                .where((aggregate.scope == scope) & (aggregate.key == key))
+                .execute()
+            )
+            if not updated:
+                aggregate.insert(scope=scope, key=key, **values).execute()
+
+        if new:
+            capacity.insert(obj_id=obj_id, **new).on_conflict_replace().execute()
+        else:
+            capacity.delete().where(capacity.obj_id == obj_id).execute()
+
+    def aggregates_get(self, farm_id="", country=""):
+        """
+        :param farm_id: totals of 1 farm
+        :param country: totals of 1 country, when no farm_id is given
+        :return: dict with the amount of nodes and per kind (total, reserved, used) a dict unit -> amount,
+                 for the whole grid when neither farm_id or country is given
+        """
+        if farm_id:
+            scope, key = "farm", str(farm_id)
+        elif country:
+            scope, key = "country", country
+        else:
+            scope, key = "grid", ""
+        aggregate = self.CapacityAggregate
+        row = aggregate.get_or_none((aggregate.scope == scope) & (aggregate.key == key))
+        result = {"nodes": row.nodes if row else 0}
+        for kind in RESOURCE_KINDS:
+            result[kind] = {unit: getattr(row, "%s_%s" % (kind, unit)) if row else 0 for unit in RESOURCE_UNITS}
+        return result
+
+    def aggregates_rebuild(self):
+        """
+        recount the aggregates from the nodes stored in BCDB, only the nodes in the node index are counted
+        (see index_rebuild), a node with the node_id of another node is not
+        """
+        with self.bcdb.sqlite_index_client.atomic():
+            self.NodeCapacity.delete().execute()
+            self.CapacityAggregate.delete().execute()
+            indexed = {row.obj_id for row in self.NodeIndex.select(self.NodeIndex.obj_id)}
+            for obj in self.iterate():
+                if obj.id in indexed:
+                    self._aggregates_update(obj.id, obj)
+
+    def _cache_set(self, obj, version):
+        self._cache[obj.node_id] = (version, obj)
+        self._cache.move_to_end(obj.node_id)
+        if len(self._cache) > NODE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def cache_clear(self):
+        """
+        forget all cached nodes, needs to be called when nodes got changed by another process
+        """
+        self._cache.clear()
+        self._updating.clear()
+
+    def get_for_update(self, node_id):
+        """
+        get a node which is going to be modified and saved
+
+        the node is taken out of the LRU cache so other readers never see changes which are not saved,
+        it is cached again once it got saved or released (see release)
+        the cached node is only used when no other process saved the node since it was cached
+
+        :return: the node object or None
+        """
+        index = self.NodeIndex.get_or_none(self.NodeIndex.node_id == node_id)
+        if not index:
+            return None
+        version, obj = self._cache.pop(node_id, (None, None))
+        if version != index.version:
+            obj = self.get(index.obj_id, die=False)
+        if obj:
+            self._updating[node_id] = index.version
+        return obj
+
+    def release(self, obj):
+        """
+        put a node got with get_for_update back in the cache without saving it, it was not modified
+        """
+        version = self._updating.pop(obj.node_id, None)
+        if version is not None:
+            self._cache_set(obj, version)
+
+    def get_by_node_id(self, node_id, cache=True):
+        """
+        :param node_id: the node_id of the node (not the BCDB object id)
+        :param cache: when True the object is served from/kept in the LRU cache,
+                      never modify a cached object without saving it
+        :return: the node object or None
+        """
+        if cache and node_id in self._cache:
+            self._cache.move_to_end(node_id)
+            return self._cache[node_id][1]
+        index = self.NodeIndex.get_or_none(self.NodeIndex.node_id == node_id)
+        if not index:
+            return None
+        obj = self.get(index.obj_id, die=False)
+        if obj and cache:
+            self._cache_set(obj, index.version)
+        return obj
+
+    def _index_set(self, obj):
+        """
+        :return: the version of the node in the index, None when another node has the same node_id already,
+                 the node is not indexed then
+        """
+        index = self.NodeIndex
+        other = index.get_or_none((index.node_id == obj.node_id) & (index.obj_id != obj.id))
+        if other:
+            self._log_warning(
+                "node %s has node_id %s which is used by node %s already, not indexed"
+                % (obj.id, obj.node_id, other.obj_id)
+            )
+            return None
+        version = time.time_ns()
+        index.insert(
+            obj_id=obj.id,
+            node_id=obj.node_id,
+            farm_id=obj.farm_id,
+            country=obj.location.country,
+            city=obj.location.city,
+            cru=obj.total_resources.cru,
+            mru=obj.total_resources.mru,
+            sru=obj.total_resources.sru,
+            hru=obj.total_resources.hru,
+            version=version,
+        ).on_conflict_replace().execute()
+        return version
+
+    def index_rebuild(self):
+        """
+        rebuild the node index from the objects stored in BCDB
+
+        :return: ids of the nodes which were not indexed because their node_id is used by another node
+        """
+        duplicates = []
+        with self.bcdb.sqlite_index_client.atomic():
+            self.NodeIndex.delete().execute()
+            self.cache_clear()
+            for obj in self.iterate():
+                if not self._index_set(obj):
+                    duplicates.append(obj.id)
+        return duplicates
+
+    def index_query(self, farm_id="", country="", city="", cru=-1, mru=-1, sru=-1, hru=-1, cursor=0, limit=100):
+        """
+        search the node index
+
+        :param cursor: only return nodes with an object id bigger then the cursor
+        :param limit: max amount of object ids returned
+        :return: list of object ids ordered by object id
+        """
+        index = self.NodeIndex
+        query = index.select(index.obj_id).where(index.obj_id > cursor)
+        if farm_id:
+            query = query.where(index.farm_id == farm_id)
+        if country:
+            query = query.where(index.country == country)
+        if city:
+            query = query.where(index.city == city)
+        for field, value in (("cru", cru), ("mru", mru), ("sru", sru), ("hru", hru)):
+            if value > -1:
+                query = query.where(getattr(index, field) >= value)
+        query = query.order_by(index.obj_id).limit(limit)
+        return [row.obj_id for row in query]
+
+    def sync_state_get(self, node_ids):
+        """
+        :return: dict node_id -> content hash of the last synced version of the node
+        """
+        state = self.NodeSyncState
+        query = state.select().where(state.node_id.in_(list(node_ids)))
+        return {row.node_id: row.content_hash for row in query}
+
+    def sync_state_set(self, hashes):
+        """
+        :param hashes: dict node_id -> content hash
+        """
+        rows = [{"node_id": node_id, "content_hash": content_hash} for node_id, content_hash in hashes.items()]
+        # stay below the max number of variables sqlite accepts in 1 statement
+        for i in range(0, len(rows), 400):
+            self.NodeSyncState.insert_many(rows[i : i + 400]).on_conflict_replace().execute()
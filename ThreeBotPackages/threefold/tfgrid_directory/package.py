@@ -56,11 +56,13 @@ class Package(j.baseclasses.threebot_package):
         gevent.spawn(self.sync_directory)
 
     def sync_directory(self):
-        job = j.servers.myjobs.schedule(self._sync_dir)
+        job = j.servers.myjobs.schedule(self._sync_dir, models_path=os.path.join(self.package_root, "models"))
         try:
             job.wait()
         except Exception as e:
             j.errorhandler.exception_handle(e, die=False)
+        # the sync job ran in a worker, nodes cached by the actors can be outdated
+        self.bcdb.model_get(url="tfgrid.node.2").cache_clear()
 
         gevent.spawn_later(DIR_SYNC_TIME, self.sync_directory)
 
@@ -104,6 +104,28 @@ def main(self):
         logging.info("Filter by city, should succeed")
         result = cl.actors.nodes.list(city="ghent")
         assert result.nodes[0].location.city == "ghent"
+
+        logging.info("List nodes page by page, should succeed")
+        result = cl.actors.nodes.list(page_size=1)
+        assert len(result.nodes) == 1
+        assert result.next_cursor
+        next_page = cl.actors.nodes.list(page_size=1, cursor=result.next_cursor)
+        assert len(next_page.nodes) == 1
+        assert next_page.nodes[0].node_id != result.nodes[0].node_id
+        assert next_page.next_cursor == 0
+
+        logging.info("Capacity totals per country & for the grid, should succeed")
+        assert cl.actors.nodes.capacity_totals(country="egypt").nodes == 1
+        assert cl.actors.nodes.capacity_totals().nodes == 2
+
+        logging.info("Update the capacity of the nodes, totals should follow")
+        cl.actors.nodes.update_total_capacity("1001", {"cru": 7, "mru": 10, "sru": 15, "hru": 20})
+        cl.actors.nodes.update_total_capacity("1002", {"cru": 1, "mru": 2, "sru": 3, "hru": 4})
+        assert cl.actors.nodes.capacity_totals(farm_id="12").total.cru == 7
+        assert cl.actors.nodes.capacity_totals(country="belgium").total.hru == 4
+        totals = cl.actors.nodes.capacity_totals()
+        assert totals.total.cru == 8
+        assert totals.total.mru == 12
         node_model.destroy()
 
         logging.info("*** Test getting node ***")
@@ -188,5 +210,25 @@ def main(self):
         assert node.used_resource.mru == 22
         assert node.used_resource.sru == 33
         assert node.used_resource.hru == 44
+
+        logging.info("*** Test reporting capacity of many nodes at once ***")
+        capacity = {"cru": 1, "mru": 2, "sru": 3, "hru": 4}
+        reports = [
+            {"node_id": result.node_id, "total": capacity, "reserved": capacity, "used": capacity},
+            {"node_id": result.node_id, "total": capacity, "reserved": capacity, "used": {"cru": 1}},
+            {"node_id": "unknown", "total": capacity, "reserved": capacity, "used": capacity},
+        ]
+        result_batch = cl.actors.nodes.report_capacity_batch(reports)
+        assert result_batch.updated == 1
+        assert result_batch.not_found == ["unknown"]
+        node = cl.actors.nodes.get(result.node_id)
+        assert node.total_resources.hru == 4
+        assert node.used_resources.cru == 1
+        assert node.used_resources.hru == 0
+
+        logging.info("Report the same capacity again, node should not be written")
+        result_batch = cl.actors.nodes.report_capacity_batch(reports[1:2])
+        assert result_batch.updated == 0
+        assert result_batch.unchanged == 1
     finally:
         node_model.destroy()
@@ -0,0 +1,98 @@
+import logging
+import os
+import time
+from Jumpscale import j
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.status_code = 200
+        self.reason = "OK"
+        self._data = data
+
+    def json(self):
+        # the sync job modifies what it receives, always return a fresh copy
+        return j.data.serializers.json.loads(j.data.serializers.json.dumps(self._data))
+
+
+class FakeDirectoryClient:
+    """
+    local replacement of j.clients.threefold_directory.client, serves nr_farms farms with nr_nodes nodes each
+    """
+
+    def __init__(self, nr_farms=10, nr_nodes=50):
+        date = "Mon, 07 Oct 2019 10:00:00 GMT"
+        self.farms = []
+        self.nodes = {}
+        for farm_nr in range(nr_farms):
+            farm = {"name": "farm%s" % farm_nr, "iyo_organization": "org%s" % farm_nr}
+            self.farms.append(farm)
+            self.nodes[farm["iyo_organization"]] = [
+                {
+                    "node_id": "node%s_%s" % (farm_nr, node_nr),
+                    "os_version": "zos",
+                    "created": date,
+                    "updated": date,
+                    "total_resources": {"cru": 4, "mru": 8, "sru": 100, "hru": 1000},
+                    "proofs": [{"created": date, "hardware_hash": "aa", "disk_hash": "bb"}],
+                }
+                for node_nr in range(nr_nodes)
+            ]
+
+    def ListFarmers(self):
+        return None, FakeResponse(self.farms)
+
+    def ListCapacity(self, query_params):
+        return None, FakeResponse(self.nodes[query_params["farmer"]])
+
+
+def main(self=None):
+    try:
+        bcdb = j.data.bcdb.get("tf_directory")
+    except:
+        bcdb = j.data.bcdb.new("tf_directory")
+
+    path = os.path.dirname(os.path.dirname(__file__))
+    models_path = os.path.join(path, "models")
+    bcdb.models_add(models_path)
+    node_model = bcdb.model_get(url="tfgrid.node.2")
+    farm_model = bcdb.model_get(url="tfgrid.farm.1")
+    sync_directory = j.tools.codeloader.load(path=os.path.join(path, "jobs", "sync_directory.py"))
+
+    client = FakeDirectoryClient(nr_farms=10, nr_nodes=50)
+    try:
+        logging.info("Full sync, all nodes should be written")
+        start = time.time()
+        stats = sync_directory(models_path=models_path, incremental=False, client=client)
+        logging.info("full sync took %.2fs", time.time() - start)
+        assert stats["nodes"] == 500
+        assert stats["nodes_changed"] == 500
+        assert len(node_model.index_query(limit=1000)) == 500
+
+        logging.info("Incremental sync without changes, no node should be written")
+        start = time.time()
+        stats = sync_directory(models_path=models_path, client=client)
+        logging.info("incremental sync took %.2fs", time.time() - start)
+        assert stats["nodes"] == 500
+        assert stats["nodes_changed"] == 0
+
+        logging.info("Change 1 node, only that node should be written")
+        client.nodes["org3"][7]["total_resources"]["cru"] = 8
+        stats = sync_directory(models_path=models_path, client=client)
+        assert stats["nodes_changed"] == 1
+        assert node_model.get_by_node_id("node3_7", cache=False).total_resources.cru == 8
+
+        logging.info("Interrupted sync, should continue with the farms which were not done yet")
+        j.core.db.sadd("tfgrid:directory:sync:done", "farm0", "farm1")
+        stats = sync_directory(models_path=models_path, client=client)
+        assert stats["farms_skipped"] == 2
+        assert stats["farms"] == 8
+        print("OK")
+    finally:
+        j.core.db.delete("tfgrid:directory:sync:done")
+        node_model.destroy()
+        farm_model.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,55 @@
+from collections import OrderedDict
 from Jumpscale import j
+import numpy
 import random
 
+# max amount of aggregate results kept in memory
+AGGREGATE_CACHE_SIZE = 1000
+
+# series which can be aggregated -> the numeric fields which can be aggregated
+AGGREGATE_FIELDS = {
+    "capacity": ["compute_units", "storage_units", "cores", "storage"],
+    "market": [
+        "total_capitalization",
+        "max_supply",
+        "potential_revenue_per_token",
+        "total_supply",
+        "circulating_supply",
+        "average_compute_unit_price",
+        "average_storage_unit_price",
+        "five_years_network_revenue",
+        "monthly_trading_volume",
+    ],
+    "price": ["opening", "closing", "low", "high"],
+}
+# fields of type (N), aggregated in USD
+CURRENCY_FIELDS = [
+    "total_capitalization",
+    "potential_revenue_per_token",
+    "average_compute_unit_price",
+    "average_storage_unit_price",
+    "five_years_network_revenue",
+    "monthly_trading_volume",
+]
+
+
+def _buckets(times, bucket, bucket_week):
+    """
+    :param times: numpy array of epochs
+    :param bucket_week: the week bucketing of the price model (PRICE.bucket_week), so both use the same weeks
+    :return: numpy array with the start of the bucket of every epoch
+    """
+    if bucket == "hour":
+        return times - times % 3600
+    if bucket == "day":
+        return times - times % 86400
+    if bucket == "week":
+        return bucket_week(times)
+    if bucket in ("month", "year"):
+        unit = "datetime64[M]" if bucket == "month" else "datetime64[Y]"
+        return times.astype("datetime64[s]").astype(unit).astype("datetime64[s]").astype(numpy.int64)
+    raise j.exceptions.Input("unknown bucket %s" % bucket)
+
 
 class token(j.baseclasses.threebot_actor):
     def _init(self, **kwargs):
@@ -11,26 +60,178 @@ class token(j.baseclasses.threebot_actor):
         self.market = self.bcdb.model_get(url="tfgrid.market.1")
         self.capacity = self.bcdb.model_get(url="tfgrid.capacity.1")
         self.tokens = self.bcdb.model_get(url="tfgrid.token.price.1")
+        # series -> (times, {field: values}) & (series, field, bucket, from, to) -> aggregates (LRU)
+        self._columns = {}
+        self._aggregates = OrderedDict()
+        # model -> latest stored market or capacity snapshot
+        self._latest = {}
+        # generation of the price model the caches were built for
+        self._generation = None
+
+    def _cache_check(self):
+        """
+        clear the caches when a price, market or capacity object changed since they were built
+        """
+        if self._generation != self.tokens.generation:
+            self._columns.clear()
+            self._aggregates.clear()
+            self._latest.clear()
+            self._generation = self.tokens.generation
+
+    def _columns_get(self, series):
+        """
+        load the numeric fields of a series as numpy arrays sorted by time
+        :return: (times, {field: values})
+        """
+        self._cache_check()
+        if series not in self._columns:
+            fields = AGGREGATE_FIELDS[series]
+            if series == "price":
+                # hour prices, already numeric & sorted in the time series index of the price model
+                hours = self.tokens.series_get("hour")
+                times = numpy.array(hours.time, dtype=numpy.int64)
+                columns = {field: numpy.array(hours.columns[field], dtype=numpy.float64) for field in fields}
+            else:
+                model = self.capacity if series == "capacity" else self.market
+                rows = []
+                for obj in model.iterate():
+                    values = [getattr(obj, field + "_usd" if field in CURRENCY_FIELDS else field) for field in fields]
+                    rows.append([obj.time] + values)
+                rows.sort(key=lambda row: row[0])
+                data = numpy.array(rows, dtype=numpy.float64).reshape(len(rows), len(fields) + 1)
+                times = data[:, 0].astype(numpy.int64)
+                columns = {field: data[:, i + 1] for i, field in enumerate(fields)}
+            self._columns[series] = (times, columns)
+        return self._columns[series]
+
+    def _aggregate(self, series, field, bucket, from_date, to_date):
+        self._cache_check()
+        key = (series, field, bucket, from_date, to_date)
+        if key in self._aggregates:
+            self._aggregates.move_to_end(key)
+            return self._aggregates[key]
+
+        times, columns = self._columns_get(series)
+        start = numpy.searchsorted(times, from_date, side="left") if from_date > 0 else 0
+        end = numpy.searchsorted(times, to_date, side="right") if to_date > 0 else len(times)
+        times, values = times[start:end], columns[field][start:end]
+
+        result = []
+        if len(times):
+            buckets = _buckets(times, bucket, self.tokens.bucket_week)
+            starts, indexes, counts = numpy.unique(buckets, return_index=True, return_counts=True)
+            sums = numpy.add.reduceat(values, indexes)
+            mins = numpy.minimum.reduceat(values, indexes)
+            maxs = numpy.maximum.reduceat(values, indexes)
+            for i, group in enumerate(numpy.split(values, indexes[1:])):
+                p50, p90, p99 = numpy.percentile(group, [50, 90, 99])
+                result.append(
+                    {
+                        "time": int(starts[i]),
+                        "count": int(counts[i]),
+                        "sum": float(sums[i]),
+                        "avg": float(sums[i] / counts[i]),
+                        "min": float(mins[i]),
+                        "max": float(maxs[i]),
+                        "p50": float(p50),
+                        "p90": float(p90),
+                        "p99": float(p99),
+                    }
+                )
+        self._aggregates[key] = result
+        if len(self._aggregates) > AGGREGATE_CACHE_SIZE:
+            self._aggregates.popitem(last=False)
+        return result
+
+    def aggregate(self, series, field, bucket, from_date=None, to_date=None, schema_out=None, user_session=None):
+        """
+        sum, avg, min, max & percentiles of a field per time bucket, computed on the server
+
+        ```in
+        series = "capacity,market,price" (E)
+        field = (S)  # e.g. cores for capacity, closing for price (hour prices)
+        bucket = "hour,day,week,month,year" (E)
+        from_date = (T)
+        to_date = (T)
+        ```
+
+        ```out
+        buckets = (LO) !tfgrid.token.aggregate.1
+        ```
+        """
+        series = str(series).lower()
+        if field not in AGGREGATE_FIELDS[series]:
+            raise j.exceptions.Input("%s can't be aggregated, use one of %s" % (field, AGGREGATE_FIELDS[series]))
+        output = schema_out.new()
+        for item in self._aggregate(series, field, str(bucket).lower(), from_date or 0, to_date or 0):
+            aggregate = output.buckets.new()
+            for key, value in item.items():
+                setattr(aggregate, key, value)
+        return output
+
+    def _latest_get(self, model):
+        """
+        :return: the stored object of the model with the highest time, a new (not saved) object
+                 with the default values when nothing is stored
+        """
+        self._cache_check()
+        if model not in self._latest:
+            latest = None
+            for obj in model.iterate():
+                if not latest or obj.time > latest.time:
+                    latest = obj
+            self._latest[model] = latest
+        return self._latest[model] or model.new()
 
     def get_market(self, schema_out=None, user_session=None):
         """
+        the latest market snapshot added with add_market
+
         ```out
         market = (O) !tfgrid.market.1
         ```
         """
-        out = self.market.new()
-        self.market.set(out)
-        return out
+        return self._latest_get(self.market)
 
     def get_capacity(self, schema_out=None, user_session=None):
         """
+        the latest capacity snapshot added with add_capacity
+
+        ```out
+        capacity = (O) !tfgrid.capacity.1
+        ```
+        """
+        return self._latest_get(self.capacity)
+
+    def add_market(self, market, schema_out=None, user_session=None):
+        """
+        ```in
+        market = (O) !tfgrid.market.1
+        ```
+
+        ```out
+        market = (O) !tfgrid.market.1
+        ```
+        """
+        market = self.market.new(data=market)
+        if not market.time:
+            market.time = j.data.time.epoch
+        return market.save()
+
+    def add_capacity(self, capacity, schema_out=None, user_session=None):
+        """
+        ```in
+        capacity = (O) !tfgrid.capacity.1
+        ```
+
         ```out
         capacity = (O) !tfgrid.capacity.1
         ```
         """
-        out = self.capacity.new()
-        self.capacity.set(out)
-        return out
+        capacity = self.capacity.new(data=capacity)
+        if not capacity.time:
+            capacity.time = j.data.time.epoch
+        return capacity.save()
 
     def find_prices(self, price_timeframe, from_date=None, to_date=None, schema_out=None, user_session=None):
         """
@@ -44,26 +245,38 @@ class token(j.baseclasses.threebot_actor):
         prices = (LO) !tfgrid.token.price.1
         ```
         """
-        prices = self.tokens.find(timeframe=str(price_timeframe))
-        if from_date > 0 or to_date > 0:
-            res = []
-            for p in prices:
-                if from_date > 0:
-                    if p.time >= from_date:
-                        if to_date > 0:
-                            if p.time <= to_date:
-                                res.append(p)
-                        else:
-                            res.append(p)
-                else:
-                    if to_date > 0:
-                        if p.time <= to_date:
-                            res.append(p)
-                    else:
-                        res.append(p)
-        else:
-            res = prices
-        return res
+        prices = []
+        for price_id in self.tokens.prices_find(str(price_timeframe), from_date or 0, to_date or 0):
+            price = self.tokens.get(price_id, die=False)
+            if price:
+                prices.append(price)
+        return prices
+
+    def chart(self, price_timeframe, from_date=None, to_date=None, schema_out=None, user_session=None):
+        """
+        OHLC prices of the timeframe rolled up from the hour prices, these are not stored
+
+        ```in
+        price_timeframe = "hour,day,week,month,year" (E)
+        from_date = (T)
+        to_date = (T)
+        ```
+
+        ```out
+        prices = (LO) !tfgrid.token.price.1
+        ```
+        """
+        output = schema_out.new()
+        timeframe = str(price_timeframe)
+        for time, opening, closing, low, high in self.tokens.ohlc(timeframe, from_date or 0, to_date or 0):
+            price = output.prices.new()
+            price.timeframe = timeframe
+            price.time = time
+            price.opening = "%s USD" % opening
+            price.closing = "%s USD" % closing
+            price.low = "%s USD" % low
+            price.high = "%s USD" % high
+        return output
 
     def add(self, price, schema_out=None, user_session=None):
         """
@@ -79,6 +292,7 @@ class token(j.baseclasses.threebot_actor):
 
     def delete_all(self, schema_out=None, user_session=None):
         self.bcdb.destroy()
+        self.tokens.index_reset()
         return True
 
     def feed_dummy_data_prices(self, price_timeframe, year, month, day, price_from, schema_out=None, user_session=None):
@@ -0,0 +1,226 @@
+import bisect
+from array import array
+from datetime import datetime
+
+from Jumpscale import j
+
+# timeframe -> timeframe it is rolled up from, hour prices are the raw ticks
+ROLLUPS = {"day": "hour", "week": "day", "month": "day", "year": "month"}
+COLUMNS = ["opening", "closing", "low", "high"]
+
+
+def _bucket_day(epoch):
+    return epoch - epoch % 86400
+
+
+def _bucket_week(epoch):
+    # epoch 0 is a thursday, weeks start on monday
+    # works on numpy arrays of epochs as well, the token actor uses it that way
+    days = epoch // 86400
+    return (days - (days + 3) % 7) * 86400
+
+
+def _bucket_month(epoch):
+    date = datetime.utcfromtimestamp(epoch)
+    return int((datetime(date.year, date.month, 1) - datetime(1970, 1, 1)).total_seconds())
+
+
+def _bucket_year(epoch):
+    date = datetime.utcfromtimestamp(epoch)
+    return int((datetime(date.year, 1, 1) - datetime(1970, 1, 1)).total_seconds())
+
+
+BUCKETS = {"day": _bucket_day, "week": _bucket_week, "month": _bucket_month, "year": _bucket_year}
+
+
+class PriceSeries:
+    """
+    prices of 1 timeframe as numeric columns sorted by time
+    """
+
+    def __init__(self):
+        self.time = array("q")
+        self.obj_id = array("q")
+        self.columns = {column: array("d") for column in COLUMNS}
+
+    def append(self, time, obj_id, opening, closing, low, high):
+        self.time.append(time)
+        self.obj_id.append(obj_id)
+        for column, value in zip(COLUMNS, (opening, closing, low, high)):
+            self.columns[column].append(value)
+
+    def slice(self, from_date=0, to_date=0):
+        """
+        :return: (start, end) indexes of the prices with from_date <= time <= to_date, 0 means no limit
+        """
+        start = bisect.bisect_left(self.time, from_date) if from_date > 0 else 0
+        end = bisect.bisect_right(self.time, to_date) if to_date > 0 else len(self.time)
+        return start, max(start, end)
+
+    def rows(self, from_date=0, to_date=0):
+        """
+        :return: list of (time, opening, closing, low, high)
+        """
+        start, end = self.slice(from_date, to_date)
+        columns = [self.time[start:end]] + [self.columns[column][start:end] for column in COLUMNS]
+        return list(zip(*columns))
+
+    def rollup(self, bucket):
+        """
+        :param bucket: function which returns the start of the bucket of an epoch
+        :return: new PriceSeries with 1 OHLC price per bucket
+        """
+        out = PriceSeries()
+        opening, closing, low, high = (self.columns[column] for column in COLUMNS)
+        current = None
+        for i, time in enumerate(self.time):
+            start = bucket(time)
+            if start != current:
+                if current is not None:
+                    out.append(current, 0, first_opening, last_closing, lowest, highest)
+                current = start
+                first_opening, lowest, highest = opening[i], low[i], high[i]
+            last_closing = closing[i]
+            lowest = min(lowest, low[i])
+            highest = max(highest, high[i])
+        if current is not None:
+            out.append(current, 0, first_opening, last_closing, lowest, highest)
+        return out
+
+
+class PRICE(j.data.bcdb._BCDBModelClass):
+    """
+    token price model with a time series index (sqlite) of the numeric prices per timeframe
+
+    the prices of a timeframe are loaded once as columns sorted by time so ranges are binary searched,
+    the day, week, month & year OHLC prices are rolled up from the hour prices, all are cached
+    until a price gets added, changed or deleted
+
+    generation changes every time a price, market or capacity object is saved or deleted, caches built
+    on top of these objects (e.g. by the token actor) compare it to know when to clear themselves
+    """
+
+    # start of the week of an epoch (or of a numpy array of epochs), for the actors which can not import this module
+    bucket_week = staticmethod(_bucket_week)
+
+    def _init2(self, **kwargs):
+        class PriceIndex(j.clients.peewee.Model):
+            class Meta:
+                database = None
+                indexes = ((("timeframe", "time"), False),)
+
+            pw = j.clients.peewee
+            obj_id = pw.IntegerField(primary_key=True)
+            timeframe = pw.TextField(default="")
+            time = pw.IntegerField(default=0)
+            opening = pw.FloatField(default=0)
+            closing = pw.FloatField(default=0)
+            low = pw.FloatField(default=0)
+            high = pw.FloatField(default=0)
+
+        self.PriceIndex = PriceIndex
+        self._index_init()
+        # timeframe -> PriceSeries of the stored prices & of the rolled up prices
+        self._series = {}
+        self._rollups = {}
+        self.generation = 0
+        self.trigger_add(self._index_trigger)
+        for url in ("tfgrid.market.1", "tfgrid.capacity.1"):
+            self.bcdb.model_get(url=url).trigger_add(self._generation_trigger)
+        if not PriceIndex.select().exists():
+            self.index_rebuild()
+
+    def _schema_get(self):
+        return j.data.schema.get_from_url("tfgrid.token.price.1")
+
+    def _index_init(self):
+        self.PriceIndex._meta.database = self.bcdb.sqlite_index_client
+        self.PriceIndex.create_table(safe=True)
+
+    def _index_trigger(self, obj, action, **kwargs):
+        if action == "set_post":
+            self._index_set(obj)
+            self.cache_clear()
+        elif action == "delete":
+            self.PriceIndex.delete().where(self.PriceIndex.obj_id == obj.id).execute()
+            self.cache_clear()
+
+    def _generation_trigger(self, obj, action, **kwargs):
+        if action in ("set_post", "delete"):
+            self.generation += 1
+
+    def _index_set(self, obj):
+        self.PriceIndex.insert(
+            obj_id=obj.id,
+            timeframe=str(obj.timeframe).lower(),
+            time=obj.time,
+            opening=obj.opening_usd,
+            closing=obj.closing_usd,
+            low=obj.low_usd,
+            high=obj.high_usd,
+        ).on_conflict_replace().execute()
+
+    def cache_clear(self):
+        self._series.clear()
+        self._rollups.clear()
+        self.generation += 1
+
+    def index_rebuild(self):
+        """
+        rebuild the time series index from the prices stored in BCDB
+        """
+        with self.bcdb.sqlite_index_client.atomic():
+            self.PriceIndex.delete().execute()
+            for obj in self.iterate():
+                self._index_set(obj)
+        self.cache_clear()
+
+    def index_reset(self):
+        """
+        empty the index, to be called after the bcdb got destroyed
+        """
+        self._index_init()
+        self.PriceIndex.delete().execute()
+        self.cache_clear()
+
+    def series_get(self, timeframe):
+        """
+        :return: PriceSeries of the prices stored for the timeframe
+        """
+        timeframe = timeframe.lower()
+        if timeframe not in self._series:
+            index = self.PriceIndex
+            series = PriceSeries()
+            query = index.select().where(index.timeframe == timeframe).order_by(index.time, index.obj_id)
+            for row in query.tuples():
+                obj_id, _, time, opening, closing, low, high = row
+                series.append(time, obj_id, opening, closing, low, high)
+            self._series[timeframe] = series
+        return self._series[timeframe]
+
+    def rollup_get(self, timeframe):
+        """
+        :return: PriceSeries of the timeframe rolled up from the hour prices
+        """
+        timeframe = timeframe.lower()
+        if timeframe not in ROLLUPS:
+            return self.series_get(timeframe)
+        if timeframe not in self._rollups:
+            source = self.rollup_get(ROLLUPS[timeframe])
+            self._rollups[timeframe] = source.rollup(BUCKETS[timeframe])
+        return self._rollups[timeframe]
+
+    def prices_find(self, timeframe, from_date=0, to_date=0):
+        """
+        :return: ids of the prices stored for the timeframe with from_date <= time <= to_date,
+                 0 means no limit
+        """
+        series = self.series_get(timeframe)
+        start, end = series.slice(from_date, to_date)
+        return list(series.obj_id[start:end])
+
+    def ohlc(self, timeframe, from_date=0, to_date=0):
+        """
+        :return: list of (time, opening, closing, low, high) rolled up from the hour prices
+        """
+        return self.rollup_get(timeframe).rows(from_date, to_date)
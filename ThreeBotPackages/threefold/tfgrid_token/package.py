@@ -15,7 +15,8 @@ class Package(j.baseclasses.threebot_package):
         is called at install time
         :return:
         """
-        pass
+        j.builders.runtimes.python3.pip_package_install("numpy")
+        self.bcdb.models_add(path=self.package_root + "/models")
 
     def start(self):
         """
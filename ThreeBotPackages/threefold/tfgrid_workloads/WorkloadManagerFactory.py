@@ -23,6 +23,18 @@ class WorkloadManagerFactory(j.baseclasses.object, j.baseclasses.testtools):
         server = j.servers.threebot.default
         server.start(web=True, ssl=False, background=True)
 
+    def reindex(self):
+        """
+        rebuild the sqlite indexes of the reservations from the reservations stored in BCDB
+
+        kosmos 'j.threebot.package.workloadmanager.reindex()'
+
+        """
+        bcdb = j.data.bcdb.get("tf_workloads")
+        bcdb.models_add(path=j.sal.fs.joinPaths(self._dirpath, "models"))
+        bcdb.model_get(url="tfgrid.reservation.1").index_rebuild()
+        return "OK"
+
     def test(self, name=""):
         """
 
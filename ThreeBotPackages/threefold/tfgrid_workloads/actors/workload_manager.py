@@ -1,11 +1,9 @@
-import binascii
+import hashlib
+from collections import OrderedDict
 from Jumpscale import j
 
 INT_NULL_VALUE = 2147483647
-
-
-def gwid(reservation_id, workload_id):
-    return f"{reservation_id}-{workload_id}"
+SIGNATURE_CACHE_SIZE = 100000
 
 
 def rid_from_gwid(workload_id):
@@ -20,85 +18,74 @@ class workload_manager(j.baseclasses.threebot_actor):
         bcdb = j.data.bcdb.get("tf_workloads")
         self.reservation_model = bcdb.model_get(url="tfgrid.reservation.1")
         self.signature_model = bcdb.model_get(url="tfgrid.reservation.signing.signature.1")
-        self.workload_schema = j.data.schema.get_from_url("tfgrid.reservation.workload.1")
         tb_bcdb = j.data.bcdb.get("threebot_phonebook")
         self.user_model = tb_bcdb.model_get(url="threebot.phonebook.user.1")
-        self.nacl = j.data.nacl.default
-
-        class IndexTable(j.clients.peewee.Model):
-            class Meta:
-                database = None
-
-            pw = j.clients.peewee
-            id = pw.PrimaryKeyField()
-            reservation_id = pw.IntegerField(index=True, default=0)
-            workload_id = pw.IntegerField(index=True, default=0)
-            node_id = pw.TextField(index=True, default="")
-
-        def index_create(model, obj, action, **kwargs):
-            if action == "set_post":
-                index = model.IndexTable.get_or_none(reservation_id=obj.id)
-                if not index:
-                    for _, workload in self._iterate_over_workloads(obj):
-                        index = model.IndexTable.create(
-                            reservation_id=obj.id, workload_id=workload.workload_id, node_id=workload.node_id
-                        )
-
-        IndexTable._meta.database = self.reservation_model.bcdb.sqlite_index_client
-        IndexTable.create_table(safe=True)
-        self.reservation_model.IndexTable = IndexTable
-        self.reservation_model.trigger_add(index_create)
+        # (reservation id, payload hash, tid, signature) -> result of the verification
+        self._signatures_verified = OrderedDict()
+
+        if not self.reservation_model.IndexTable.select().exists():
+            self.reservation_model.index_rebuild()
 
     def _iterate_over_workloads(self, obj):
-        for _type in ["zdbs", "volumes", "containers", "networks"]:
-            for workload in getattr(obj.data_reservation, _type):
-                yield _type[:-1], workload
+        return self.reservation_model.workloads_iterate(obj)
 
-    def _validate_signature(self, payload, signature, key):
-        """
-        :param payload: the payload
-        :param signature: the signature to be verified
-        :param key: public key to verify the signature
-        """
-        key = binascii.unhexlify(key)
-        signature = binascii.unhexlify(signature.encode())
-        return self.nacl.verify(payload.encode(), signature, verify_key=key)
+    def _workload_obj(self, reservation, _type, workload):
+        return self.reservation_model.workload_obj(reservation, _type, workload)
 
-    def _validate_signing_signature(self, payload, signature):
-        """
-        :param payload: the payload
-        :param signature: the signature object (tfgrid.reservation.signing.signature)
+    def _signatures_check(self, reservation_id, payload, signatures):
         """
-        user = self.user_model.get(signature.tid)
-        if not user:
-            return False
-        return self._validate_signature(payload, signature.signature, user.pubkey)
+        verify many signatures of phonebook users on the same payload at once
+        results are memoized so a reservation which is read over and over again
+        does not need to verify the same signatures again
 
-    def _request_check(self, payload, request, signatures):
+        :param reservation_id: id of the reservation the payload belongs to
+        :param payload: the payload
+        :param signatures: list of (tid, signature in hex format)
+        :return: set of the tids which signed with a valid signature
+        """
+        payload_hash = hashlib.md5(payload.encode()).hexdigest()
+        valid = set()
+        todo = []
+        for tid, signature in signatures:
+            key = (reservation_id, payload_hash, tid, signature)
+            if key in self._signatures_verified:
+                self._signatures_verified.move_to_end(key)
+                if self._signatures_verified[key]:
+                    valid.add(tid)
+            else:
+                todo.append((key, tid, signature))
+        if not todo:
+            return valid
+
+        # users which are not found are not memoized, they can still register
+        verify_keys = self.user_model.verify_keys_get([tid for _, tid, _ in todo])
+        todo = [item for item in todo if item[1] in verify_keys]
+        results = self.user_model.signatures_verify(
+            [(payload, signature, verify_keys[tid]) for _, tid, signature in todo]
+        )
+        for (key, tid, _), result in zip(todo, results):
+            self._signatures_verified[key] = result
+            if result:
+                valid.add(tid)
+        while len(self._signatures_verified) > SIGNATURE_CACHE_SIZE:
+            self._signatures_verified.popitem(last=False)
+        return valid
+
+    def _request_check(self, reservation_id, payload, request, signatures):
         """
         Make sure that at least the quorum_min number of signers signed with a valid signature
         """
-        signers = 0
-        for signature in signatures:
-            if signature.tid not in request.signers:
-                continue
-
-            if self._validate_signing_signature(payload, signature):
-                signers += 1
-
-            if signers >= request.quorum_min:
-                return True
-        else:
+        signatures = [(s.tid, s.signature) for s in signatures if s.tid in request.signers]
+        if not signatures:
             return False
+        return len(self._signatures_check(reservation_id, payload, signatures)) >= request.quorum_min
 
     def _validate_customer_signature(self, jsxobj):
         """
         Checks if the signature of the customer is valid or not
         """
-        user = self.user_model.get(jsxobj.customer_tid)
-        if not user:
-            return False
-        return self._validate_signature(jsxobj.json, jsxobj.customer_signature, user.pubkey)
+        signatures = [(jsxobj.customer_tid, jsxobj.customer_signature)]
+        return bool(self._signatures_check(jsxobj.id, jsxobj.json, signatures))
 
     def _validate_farmers_signature(self, jsxobj):
         """
@@ -108,17 +95,19 @@ class workload_manager(j.baseclasses.threebot_actor):
         for _, workload in self._iterate_over_workloads(jsxobj):
             farmers_tids.add(workload.farmer_tid)
 
-        for signature in jsxobj.signatures_farmer:
-            if signature.tid not in farmers_tids:
-                continue
-
-            if self._validate_signing_signature(jsxobj.json, signature):
-                farmers_tids.remove(signature.tid)
-
-            if not farmers_tids:
-                return True
-        else:
+        signatures = [(s.tid, s.signature) for s in jsxobj.signatures_farmer if s.tid in farmers_tids]
+        if not signatures:
             return False
+        return farmers_tids <= self._signatures_check(jsxobj.id, jsxobj.json, signatures)
+
+    def _reservation_load(self, reservation_id):
+        """
+        fetch the reservation object from BCDB without checking it
+        """
+        try:
+            return self.reservation_model.get(reservation_id)
+        except j.exceptions.NotFound:
+            raise j.exceptions.NotFound("reservation with id: (%s) not found" % reservation_id)
 
     def _reservation_get(self, reservation_id):
         """
@@ -128,13 +117,9 @@ class workload_manager(j.baseclasses.threebot_actor):
 
         and return using _reservation_check
         """
-        try:
-            jsxobj = self.reservation_model.get(reservation_id)
-            return self._reservation_check(jsxobj)
-        except j.exceptions.NotFound:
-            raise j.exceptions.NotFound("reservation with id: (%s) not found" % reservation_id)
+        return self._reservation_check(self._reservation_load(reservation_id))
 
-    def _reservation_check(self, jsxobj):
+    def _reservation_check(self, jsxobj, changed=False):
         """
         will do
             - check signature of the customer to see json ok (created by a valid customer)
@@ -145,26 +130,26 @@ class workload_manager(j.baseclasses.threebot_actor):
                 - if the delete requests done the 'next_action' -> delete
             - if something invalid e.g. signature of customer not ok then 'next_action' -> invalid
 
+        expiration of reservations is not checked here, that is done by the expire_reservations job
+
+        the reservation is only saved when the 'next_action' changed or when changed is True
+        (the caller modified the reservation), so it is saved once for both changes
+
         will return the updated jsxobj
         """
         payload = jsxobj.json
-        if jsxobj.data_reservation.expiration_reservation < j.data.time.epoch:
-            jsxobj.next_action = "delete"
-
-        elif jsxobj.next_action == "create":
-            if jsxobj.data_reservation.expiration_provisioning > j.data.time.epoch:
-                if jsxobj.customer_signature:
-                    if self._validate_customer_signature(jsxobj):
-                        jsxobj.next_action = "sign"
-                    else:
-                        jsxobj.next_action = "invalid"
-            else:
-                jsxobj.next_action = "invalid"
+        next_action = str(jsxobj.next_action)
+        if jsxobj.next_action == "create":
+            if jsxobj.customer_signature:
+                if self._validate_customer_signature(jsxobj):
+                    jsxobj.next_action = "sign"
+                else:
+                    jsxobj.next_action = "invalid"
 
         elif jsxobj.next_action == "sign":
             signatures = jsxobj.signatures_provision
             request = jsxobj.data_reservation.signing_request_provision
-            if self._request_check(payload, request, signatures):
+            if self._request_check(jsxobj.id, payload, request, signatures):
                 jsxobj.next_action = "pay"
 
         elif jsxobj.next_action == "pay":
@@ -174,19 +159,17 @@ class workload_manager(j.baseclasses.threebot_actor):
         elif jsxobj.next_action == "deploy":
             signatures = jsxobj.signatures_delete
             request = jsxobj.data_reservation.signing_request_delete
-            if self._request_check(payload, request, signatures):
+            if self._request_check(jsxobj.id, payload, request, signatures):
                 jsxobj.next_action = "delete"
 
-        jsxobj.save()
+        if changed or str(jsxobj.next_action) != next_action:
+            jsxobj.save()
         return jsxobj
 
     def _filter_reservations(self, node_id, states, epoch):
-        query = None
-        if node_id:
-            query = self.reservation_model.IndexTable.node_id == node_id
-
-        result = self.reservation_model.IndexTable.select().where(query).execute()
-        reservations_ids = set([item.reservation_id for item in result])
+        reservations_ids = self.reservation_model.index_find(
+            node_id=node_id, states=states, epoch=None if epoch == INT_NULL_VALUE else epoch
+        )
 
         reservations = []
         for reservation_id in reservations_ids:
@@ -194,12 +177,10 @@ class workload_manager(j.baseclasses.threebot_actor):
                 reservation = self._reservation_get(reservation_id)
             except j.exceptions.NotFound:
                 continue
+            # the state can change while checking the reservation
             if states and str(reservation.next_action) not in [s.upper() for s in states]:
                 continue
 
-            if epoch != INT_NULL_VALUE and epoch >= reservation.epoch:
-                continue
-
             reservations.append(reservation)
         return reservations
 
@@ -238,7 +219,8 @@ class workload_manager(j.baseclasses.threebot_actor):
         reservation.epoch = j.data.time.epoch
         reservation = self.reservation_model.new(reservation)
         reservation.save()
-        return reservation
+        # the customer signature is checked right away, the reservation does not wait for a get in 'create'
+        return self._reservation_check(reservation, changed=True)
 
     def reservation_get(self, reservation_id, schema_out, user_session):
         """
@@ -250,10 +232,12 @@ class workload_manager(j.baseclasses.threebot_actor):
         !tfgrid.reservation.1
         ```
         """
-        return self._reservation_get(reservation_id)
+        return self.reservation_model.results_join(self._reservation_get(reservation_id))
 
     def reservations_list(self, node_id, state, epoch, schema_out, user_session):
         """
+        for big results use /tfgrid_workloads/reservations which streams the reservations (see app.py)
+
         ```in
         node_id = (S)  # filter results by node id
         state = (S)  # filter results by next_action
@@ -266,10 +250,13 @@ class workload_manager(j.baseclasses.threebot_actor):
         """
         if state and not isinstance(state, list):
             state = [state]
-        return self._filter_reservations(node_id, state, epoch)
+        reservations = self._filter_reservations(node_id, state, epoch)
+        return [self.reservation_model.results_join(reservation) for reservation in reservations]
 
     def workloads_list(self, node_id, epoch, schema_out, user_session):
         """
+        for big results use /tfgrid_workloads/workloads/<node_id> which streams the workloads (see app.py)
+
         ```in
         node_id = (S)  # filter results by node id
         epoch = (I)  # filter results which created after this epoch
@@ -280,25 +267,39 @@ class workload_manager(j.baseclasses.threebot_actor):
         ```
         """
         output = schema_out.new()
+        if node_id:
+            items = self.reservation_model.queue_find(node_id, epoch=None if epoch == INT_NULL_VALUE else epoch)
+            for obj in self.reservation_model.workloads_from_queue(items):
+                output.workloads.append(obj)
+            return output
+
         reservations = self._filter_reservations(node_id, ["deploy", "delete"], epoch)
         for reservation in reservations:
-
             for _type, workload in self._iterate_over_workloads(reservation):
-                if node_id and workload.node_id != node_id:
-                    continue
-
-                workload.reservation_id = reservation.id
-                obj = self.workload_schema.new()
-                obj.type = _type
-                obj.workload_id = gwid(reservation.id, workload.workload_id)
-                obj.user = str(reservation.customer_tid)
-                obj.content = workload._ddict
-                obj.created = reservation.epoch
-                obj.duration = reservation.data_reservation.expiration_reservation - reservation.epoch
-                obj.signature = ""
-                obj.to_delete = reservation.next_action == "delete"
-                output.workloads.append(obj)
+                output.workloads.append(self._workload_obj(reservation, _type, workload))
+
+        return output
+
+    def workloads_feed(self, node_id, cursor, page_size, schema_out, user_session):
+        """
+        workloads a node needs to act on (deploy or delete) which got in that state after the cursor
+
+        ```in
+        node_id = (S)
+        cursor = 0 (I)  # next_cursor of the previous call, 0 to start from the beginning
+        page_size = 500 (I)
+        ```
 
+        ```out
+        workloads = (LO) !tfgrid.reservation.workload.1
+        next_cursor = 0 (I)  # cursor to use in the next call
+        ```
+        """
+        output = schema_out.new()
+        items = self.reservation_model.queue_get(node_id, cursor=cursor, limit=page_size)
+        for obj in self.reservation_model.workloads_from_queue(items):
+            output.workloads.append(obj)
+        output.next_cursor = items[-1].seq if items else cursor
         return output
 
     def workload_get(self, gwid, schema_out, user_session):
@@ -313,20 +314,10 @@ class workload_manager(j.baseclasses.threebot_actor):
         """
         rid, wid = rid_from_gwid(gwid)
 
-        out = schema_out.new()
         reservation = self._reservation_get(rid)
         for _type, workload in self._iterate_over_workloads(reservation):
             if int(workload.workload_id) == int(wid):
-                obj = self.workload_schema.new()
-                obj.type = _type
-                obj.workload_id = gwid
-                obj.user = str(reservation.customer_tid)
-                obj.content = workload._ddict
-                obj.created = reservation.epoch
-                obj.duration = reservation.data_reservation.expiration_reservation - reservation.epoch
-                obj.signature = ""
-                obj.to_delete = reservation.next_action == "delete"
-                return obj
+                return self._workload_obj(reservation, _type, workload)
         raise j.exceptions.NotFound(f"workload {gwid} not found")
 
     def sign_provision(self, reservation_id, tid, signature, user_session):
@@ -341,12 +332,12 @@ class workload_manager(j.baseclasses.threebot_actor):
         signature = (S)
         ```
         """
-        reservation = self._reservation_get(reservation_id)
+        reservation = self._reservation_load(reservation_id)
         signature_obj = self.signature_model.new()
         signature_obj.tid = tid
         signature_obj.signature = signature
         reservation.signatures_provision.append(signature_obj)
-        reservation.save()
+        self._reservation_check(reservation, changed=True)
         return True
 
     def sign_delete(self, reservation_id, tid, signature, user_session):
@@ -361,12 +352,12 @@ class workload_manager(j.baseclasses.threebot_actor):
         signature = (S)
         ```
         """
-        reservation = self._reservation_get(reservation_id)
+        reservation = self._reservation_load(reservation_id)
         signature_obj = self.signature_model.new()
         signature_obj.tid = tid
         signature_obj.signature = signature
         reservation.signatures_delete.append(signature_obj)
-        reservation.save()
+        self._reservation_check(reservation, changed=True)
         return True
 
     def sign_farmer(self, reservation_id, tid, signature, user_session):
@@ -381,7 +372,7 @@ class workload_manager(j.baseclasses.threebot_actor):
         signature = (S)
         ```
         """
-        reservation = self._reservation_get(reservation_id)
+        reservation = self._reservation_load(reservation_id)
         farmers_tids = set()
         for _, workload in self._iterate_over_workloads(reservation):
             farmers_tids.add(workload.farmer_tid)
@@ -393,7 +384,7 @@ class workload_manager(j.baseclasses.threebot_actor):
         signature_obj.tid = tid
         signature_obj.signature = signature
         reservation.signatures_farmer.append(signature_obj)
-        reservation.save()
+        self._reservation_check(reservation, changed=True)
         return True
 
     def sign_customer(self, reservation_id, signature, user_session):
@@ -406,9 +397,9 @@ class workload_manager(j.baseclasses.threebot_actor):
         signature = (S)
         ```
         """
-        reservation = self._reservation_get(reservation_id)
+        reservation = self._reservation_load(reservation_id)
         reservation.customer_signature = signature
-        reservation.save()
+        self._reservation_check(reservation, changed=True)
         return True
 
     def set_workload_result(self, global_workload_id, result, user_session):
@@ -423,18 +414,12 @@ class workload_manager(j.baseclasses.threebot_actor):
         ```
         """
         rid, wid = rid_from_gwid(global_workload_id)
+        if not self.reservation_model.workload_exists(rid, wid):
+            raise j.exceptions.NotFound(f"workload {global_workload_id} not found")
 
+        # results are stored apart from the reservation, a newer result replaces the previous one
         result.workload_id = wid
-
-        reservation = self._reservation_get(rid)
-        # if there is already a result for this workload,
-        # remove it and add the one we just received
-        for i, r in enumerate(reservation.results):
-            if int(r.workload_id) == wid:
-                reservation.results.pop(i)
-
-        reservation.results.append(result)
-        reservation.save()
+        self.reservation_model.result_set(rid, result)
         return True
 
     def workload_deleted(self, workload_id):
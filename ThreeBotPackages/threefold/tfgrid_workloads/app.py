@@ -0,0 +1,54 @@
+"""
+streaming (newline delimited json) versions of reservations_list & workloads_list
+
+the results are read page by page from the reservation indexes and written to the client as they are
+serialized, so memory use stays the same no matter how many reservations or workloads are returned
+
+    curl "http://localhost:9202/tfgrid_workloads/reservations?node_id=1&state=deploy"
+    curl "http://localhost:9202/tfgrid_workloads/workloads/1?cursor=0"
+"""
+from Jumpscale import j
+
+from bottle import request, response, Bottle
+
+app = Bottle()
+
+
+def _reservation_model():
+    return j.data.bcdb.get("tf_workloads").model_get(url="tfgrid.reservation.1")
+
+
+def _ndjson(items):
+    for item in items:
+        yield j.data.serializers.json.dumps(item) + "\n"
+
+
+@app.route("/tfgrid_workloads/reservations")
+def reservations_stream():
+    """
+    query parameters: node_id, state (can be repeated), epoch, customer_tid
+    one reservation (tfgrid.reservation.1) per line
+    """
+    filters = {"node_id": request.query.node_id or None, "states": request.query.getall("state") or None}
+    if request.query.epoch:
+        filters["epoch"] = int(request.query.epoch)
+    if request.query.customer_tid:
+        filters["customer_tid"] = int(request.query.customer_tid)
+
+    response.content_type = "application/x-ndjson"
+    reservations = _reservation_model().reservations_stream(**filters)
+    return _ndjson(reservation._ddict for reservation in reservations)
+
+
+@app.route("/tfgrid_workloads/workloads/<node_id>")
+def workloads_stream(node_id):
+    """
+    query parameters: cursor, same as in workloads_feed
+    one {"cursor": .., "workload": (tfgrid.reservation.workload.1)} per line, the cursor of the last line
+    is the cursor to use in the next request
+    """
+    cursor = int(request.query.cursor or 0)
+
+    response.content_type = "application/x-ndjson"
+    workloads = _reservation_model().workloads_stream(node_id, cursor=cursor)
+    return _ndjson({"cursor": seq, "workload": workload._ddict} for seq, workload in workloads)
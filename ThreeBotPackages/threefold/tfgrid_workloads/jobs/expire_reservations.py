@@ -0,0 +1,28 @@
+def expire_reservations(models_path=None):
+    """
+    move the reservations which expired to delete and the ones which were not signed in time to invalid
+
+    :param models_path: path of the workload models, only needed when the models are not loaded yet
+        (e.g. when ran outside the 3bot), loads the RESERVATION model class so the indexes stay up to date
+    :return: dict with the amount of reservations moved to delete & invalid
+    """
+    bcdb = j.data.bcdb.get("tf_workloads")
+    if models_path:
+        bcdb.models_add(path=models_path)
+    reservation_model = bcdb.model_get(url="tfgrid.reservation.1")
+
+    expired, timed_out = reservation_model.expired_find(j.data.time.epoch)
+    stats = {"delete": 0, "invalid": 0}
+    with bcdb.sqlite_index_client.atomic():
+        for state, reservations_ids in (("delete", expired), ("invalid", timed_out)):
+            for reservation_id in reservations_ids:
+                reservation = reservation_model.get(reservation_id, die=False)
+                if not reservation:
+                    continue
+                reservation.next_action = state
+                reservation.save()
+                stats[state] += 1
+
+    if stats["delete"] or stats["invalid"]:
+        j.core.tools.log("Expired reservations: %s" % stats, level=20)
+    return stats
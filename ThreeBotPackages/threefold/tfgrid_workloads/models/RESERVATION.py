@@ -0,0 +1,400 @@
+from Jumpscale import j
+
+WORKLOAD_TYPES = ["zdbs", "volumes", "containers", "networks"]
+# states of a reservation a node needs to act on
+NODE_STATES = ["deploy", "delete"]
+# states in which a reservation moves to delete once it expired
+EXPIRE_STATES = ["create", "sign", "pay", "deploy"]
+# amount of reservations indexed in 1 transaction when rebuilding the indexes
+REINDEX_BATCH_SIZE = 1000
+# amount of index rows loaded at once when streaming reservations or workloads
+STREAM_PAGE_SIZE = 500
+
+
+def gwid(reservation_id, workload_id):
+    return f"{reservation_id}-{workload_id}"
+
+
+class RESERVATION(j.data.bcdb._BCDBModelClass):
+    """
+    reservation model which maintains 2 sqlite indexes
+
+    - IndexTable: 1 row per workload with the node, farmer, customer, state, epoch & expiration times
+      of its reservation
+    - WorkloadQueue: a queue of workloads per node, every time a reservation moves to a state a node
+      needs to act on, its workloads are (re)added at the end of the queue of their node with a new
+      sequence number, so a node only needs to ask for the items after the last sequence number it has seen
+    - QueueSequence: 1 row with the last sequence number handed out, it is increased in the same transaction
+      as the items are added to the queue so concurrent writers never get the same numbers
+    """
+
+    def _init2(self, **kwargs):
+        class IndexTable(j.clients.peewee.Model):
+            class Meta:
+                database = None
+                indexes = (
+                    (("reservation_id", "workload_id"), True),
+                    (("node_id", "next_action", "epoch"), False),
+                    (("next_action", "epoch"), False),
+                    (("customer_tid", "next_action"), False),
+                    (("farmer_tid", "next_action"), False),
+                    (("next_action", "expiration_reservation"), False),
+                    (("next_action", "expiration_provisioning"), False),
+                )
+
+            pw = j.clients.peewee
+            id = pw.PrimaryKeyField()
+            reservation_id = pw.IntegerField(index=True, default=0)
+            workload_id = pw.IntegerField(default=0)
+            node_id = pw.TextField(default="")
+            farmer_tid = pw.IntegerField(default=0)
+            customer_tid = pw.IntegerField(default=0)
+            next_action = pw.TextField(default="")
+            epoch = pw.IntegerField(default=0)
+            expiration_provisioning = pw.IntegerField(default=0)
+            expiration_reservation = pw.IntegerField(default=0)
+
+        class WorkloadQueue(j.clients.peewee.Model):
+            class Meta:
+                database = None
+                indexes = (
+                    (("reservation_id", "workload_id"), True),
+                    (("node_id", "state", "epoch"), False),
+                    (("node_id", "seq"), False),
+                )
+
+            pw = j.clients.peewee
+            id = pw.PrimaryKeyField()
+            seq = pw.IntegerField(index=True, default=0)
+            node_id = pw.TextField(default="")
+            state = pw.TextField(default="")
+            epoch = pw.IntegerField(default=0)
+            reservation_id = pw.IntegerField(default=0)
+            workload_id = pw.IntegerField(default=0)
+
+        class QueueSequence(j.clients.peewee.Model):
+            class Meta:
+                database = None
+
+            pw = j.clients.peewee
+            id = pw.PrimaryKeyField()
+            seq = pw.IntegerField(default=0)
+
+        db = self.bcdb.sqlite_index_client
+        for table in (IndexTable, WorkloadQueue, QueueSequence):
+            table._meta.database = db
+        if "indextable" in db.get_tables():
+            columns = [column.name for column in db.get_columns("indextable")]
+            if "expiration_reservation" not in columns:
+                # index of an older version, gets rebuilt by the actor
+                IndexTable.drop_table()
+        for table in (IndexTable, WorkloadQueue, QueueSequence):
+            table.create_table(safe=True)
+        # continue after the items which were queued before the sequence row existed
+        last = WorkloadQueue.select(j.clients.peewee.fn.MAX(WorkloadQueue.seq)).scalar() or 0
+        QueueSequence.insert(id=1, seq=last).on_conflict_ignore().execute()
+        self.IndexTable = IndexTable
+        self.WorkloadQueue = WorkloadQueue
+        self.QueueSequence = QueueSequence
+        self.trigger_add(self._index_trigger)
+
+    def _schema_get(self):
+        return j.data.schema.get_from_url("tfgrid.reservation.1")
+
+    def workloads_iterate(self, obj):
+        """
+        :return: generator of (type, workload) for all workloads of the reservation
+        """
+        for _type in WORKLOAD_TYPES:
+            for workload in getattr(obj.data_reservation, _type):
+                yield _type[:-1], workload
+
+    def workload_obj(self, reservation, _type, workload):
+        """
+        :return: the workload as sent to the nodes (tfgrid.reservation.workload.1)
+        """
+        workload.reservation_id = reservation.id
+        obj = j.data.schema.get_from_url("tfgrid.reservation.workload.1").new()
+        obj.type = _type
+        obj.workload_id = gwid(reservation.id, workload.workload_id)
+        obj.user = str(reservation.customer_tid)
+        obj.content = workload._ddict
+        obj.created = reservation.epoch
+        obj.duration = reservation.data_reservation.expiration_reservation - reservation.epoch
+        obj.signature = ""
+        obj.to_delete = reservation.next_action == "delete"
+        return obj
+
+    def workloads_from_queue(self, items):
+        """
+        :param items: workload queue items (see queue_get)
+        :return: generator of workload objects (tfgrid.reservation.workload.1)
+        """
+        for _, obj in self._workloads_from_queue(items):
+            yield obj
+
+    def _workloads_from_queue(self, items):
+        reservation = None
+        for item in items:
+            if not reservation or reservation.id != item.reservation_id:
+                # the state is already known, no need to evaluate the reservation again
+                reservation = self.get(item.reservation_id, die=False)
+                if not reservation:
+                    continue
+            for _type, workload in self.workloads_iterate(reservation):
+                if int(workload.workload_id) == item.workload_id:
+                    yield item, self.workload_obj(reservation, _type, workload)
+
+    def _index_trigger(self, obj, action, **kwargs):
+        if action == "set_post":
+            self._index_update(obj)
+            self._queue_update(obj)
+        elif action == "delete":
+            self.IndexTable.delete().where(self.IndexTable.reservation_id == obj.id).execute()
+            self.WorkloadQueue.delete().where(self.WorkloadQueue.reservation_id == obj.id).execute()
+            for result in self._result_model.find(reservation_id=obj.id):
+                result.delete()
+
+    @property
+    def _result_model(self):
+        return self.bcdb.model_get(url="tfgrid.reservation.workload.result.1")
+
+    def workload_exists(self, reservation_id, workload_id):
+        index = self.IndexTable
+        query = index.select().where((index.reservation_id == reservation_id) & (index.workload_id == workload_id))
+        return query.exists()
+
+    def result_set(self, reservation_id, result):
+        """
+        store the result of a workload, replaces the result the workload had before
+
+        :param result: tfgrid.reservation.result.1 object, workload_id needs to be set
+        """
+        model = self._result_model
+        found = model.find(reservation_id=reservation_id, workload_id=result.workload_id)
+        obj = found[0] if found else model.new()
+        obj.reservation_id = reservation_id
+        obj.workload_id = result.workload_id
+        obj.result = result
+        obj.save()
+
+    def results_join(self, obj):
+        """
+        add the stored results of the workloads to reservation.results, replacing the results of
+        the same workloads which were stored in the reservation itself (older reservations)
+        :return: the reservation
+        """
+        results = {int(r.workload_id): r for r in obj.results}
+        for stored in sorted(self._result_model.find(reservation_id=obj.id), key=lambda stored: stored.id):
+            results[stored.workload_id] = stored.result
+        obj.results = [results[workload_id] for workload_id in sorted(results)]
+        return obj
+
+    def _index_update(self, obj):
+        index = self.IndexTable
+        state = str(obj.next_action).lower()
+        updated = (
+            index.update(next_action=state, epoch=obj.epoch, customer_tid=obj.customer_tid)
+            .where(index.reservation_id == obj.id)
+            .execute()
+        )
+        if updated:
+            return
+        # workloads of a reservation never change, they only need to be added once
+        rows = [
+            {
+                "reservation_id": obj.id,
+                "workload_id": int(workload.workload_id),
+                "node_id": str(workload.node_id),
+                "farmer_tid": workload.farmer_tid,
+                "customer_tid": obj.customer_tid,
+                "next_action": state,
+                "epoch": obj.epoch,
+                "expiration_provisioning": obj.data_reservation.expiration_provisioning,
+                "expiration_reservation": obj.data_reservation.expiration_reservation,
+            }
+            for _, workload in self.workloads_iterate(obj)
+        ]
+        # stay below the max number of variables sqlite accepts in 1 statement
+        for i in range(0, len(rows), 100):
+            index.insert_many(rows[i : i + 100]).on_conflict_replace().execute()
+
+    def _queue_update(self, obj):
+        state = str(obj.next_action).lower()
+        if state not in NODE_STATES:
+            return
+        queue = self.WorkloadQueue
+        rows = list(queue.select().where(queue.reservation_id == obj.id))
+        if rows and all(row.state == state for row in rows):
+            # no state transition, nothing new for the nodes
+            return
+
+        workloads = [workload for _, workload in self.workloads_iterate(obj)]
+        with self.bcdb.sqlite_index_client.atomic():
+            seq = self._seq_reserve(len(workloads))
+            for workload in workloads:
+                seq += 1
+                queue.insert(
+                    seq=seq,
+                    node_id=str(workload.node_id),
+                    state=state,
+                    epoch=obj.epoch,
+                    reservation_id=obj.id,
+                    workload_id=int(workload.workload_id),
+                ).on_conflict_replace().execute()
+
+    def _seq_reserve(self, amount):
+        """
+        reserve sequence numbers for the workload queue, needs to be called inside the transaction
+        which adds the items, the update locks the database for writing so the numbers can not be handed
+        out twice
+
+        :return: the sequence number before the reserved ones
+        """
+        sequence = self.QueueSequence
+        sequence.update(seq=sequence.seq + amount).where(sequence.id == 1).execute()
+        return sequence.get_by_id(1).seq - amount
+
+    def index_rebuild(self):
+        """
+        rebuild the index & workload queues from the reservations stored in BCDB
+        """
+        db = self.bcdb.sqlite_index_client
+        with db.atomic():
+            self.IndexTable.delete().execute()
+            self.WorkloadQueue.delete().execute()
+        batch = []
+        for obj in self.iterate():
+            batch.append(obj)
+            if len(batch) >= REINDEX_BATCH_SIZE:
+                self._index_batch(batch)
+                batch = []
+        self._index_batch(batch)
+
+    def _index_batch(self, objs):
+        with self.bcdb.sqlite_index_client.atomic():
+            for obj in objs:
+                self._index_update(obj)
+                self._queue_update(obj)
+
+    def index_find(
+        self, node_id=None, states=None, epoch=None, customer_tid=None, farmer_tid=None, cursor=0, limit=None
+    ):
+        """
+        :param node_id: only reservations with a workload on this node
+        :param states: only reservations with a next_action in this list
+        :param epoch: only reservations created after this epoch
+        :param customer_tid: only reservations of this customer
+        :param farmer_tid: only reservations with a workload on a farm of this farmer
+        :param cursor: only reservations with an id bigger then the cursor
+        :param limit: max amount of reservation ids returned
+        :return: list of reservation ids
+        """
+        index = self.IndexTable
+        query = index.select(index.reservation_id).distinct().where(index.reservation_id > cursor)
+        if node_id:
+            query = query.where(index.node_id == str(node_id))
+        if states:
+            query = query.where(index.next_action.in_([state.lower() for state in states]))
+        if epoch is not None:
+            query = query.where(index.epoch > epoch)
+        if customer_tid is not None:
+            query = query.where(index.customer_tid == customer_tid)
+        if farmer_tid is not None:
+            query = query.where(index.farmer_tid == farmer_tid)
+        query = query.order_by(index.reservation_id)
+        if limit:
+            query = query.limit(limit)
+        return [row.reservation_id for row in query]
+
+    def reservations_stream(self, **filters):
+        """
+        same filters as index_find, the ids are loaded page by page so memory use does not depend
+        on the amount of reservations found
+
+        :return: generator of reservation objects ordered by id
+        """
+        cursor = 0
+        while True:
+            reservations_ids = self.index_find(cursor=cursor, limit=STREAM_PAGE_SIZE, **filters)
+            for reservation_id in reservations_ids:
+                reservation = self.get(reservation_id, die=False)
+                if reservation:
+                    yield self.results_join(reservation)
+            if len(reservations_ids) < STREAM_PAGE_SIZE:
+                return
+            cursor = reservations_ids[-1]
+
+    def queue_find(self, node_id, epoch=None):
+        """
+        :param node_id: node to get the queue for
+        :param epoch: only return items of reservations created after this epoch
+        :return: queue items ordered by sequence number
+        """
+        queue = self.WorkloadQueue
+        query = queue.select().where((queue.node_id == str(node_id)) & (queue.state.in_(NODE_STATES)))
+        if epoch is not None:
+            query = query.where(queue.epoch > epoch)
+        return list(query.order_by(queue.seq))
+
+    def queue_get(self, node_id, cursor=0, limit=None):
+        """
+        :param node_id: node to get the queue for
+        :param cursor: only return items with a sequence number bigger then the cursor
+        :param limit: max amount of items returned
+        :return: queue items ordered by sequence number
+        """
+        queue = self.WorkloadQueue
+        query = queue.select().where((queue.node_id == str(node_id)) & (queue.seq > cursor)).order_by(queue.seq)
+        if limit:
+            query = query.limit(limit)
+        return list(query)
+
+    def workloads_stream(self, node_id, cursor=0):
+        """
+        same as queue_get followed by workloads_from_queue, but the queue is loaded page by page
+        so memory use does not depend on the size of the queue
+
+        :return: generator of (sequence number, workload object)
+        """
+        while True:
+            items = self.queue_get(node_id, cursor=cursor, limit=STREAM_PAGE_SIZE)
+            for item, obj in self._workloads_from_queue(items):
+                yield item.seq, obj
+            if len(items) < STREAM_PAGE_SIZE:
+                return
+            cursor = items[-1].seq
+
+    def expired_find(self, now):
+        """
+        :param now: epoch to compare the expiration times with
+        :return: (ids of expired reservations, ids of reservations which were not signed in time)
+        """
+        index = self.IndexTable
+        expired = (
+            index.select(index.reservation_id)
+            .distinct()
+            .where(index.next_action.in_(EXPIRE_STATES) & (index.expiration_reservation < now))
+        )
+        timed_out = (
+            index.select(index.reservation_id)
+            .distinct()
+            .where((index.next_action == "create") & (index.expiration_provisioning <= now))
+        )
+        expired = [row.reservation_id for row in expired]
+        expired_ids = set(expired)
+        timed_out = [row.reservation_id for row in timed_out if row.reservation_id not in expired_ids]
+        return expired, timed_out
+
+    def expiration_next(self):
+        """
+        :return: first epoch at which a reservation expires or times out, None if there is none
+        """
+        index = self.IndexTable
+        fn = j.clients.peewee.fn
+        expiration = (
+            index.select(fn.MIN(index.expiration_reservation)).where(index.next_action.in_(EXPIRE_STATES)).scalar()
+        )
+        provisioning = index.select(fn.MIN(index.expiration_provisioning)).where(index.next_action == "create").scalar()
+        epochs = [epoch for epoch in (expiration, provisioning) if epoch]
+        return min(epochs) if epochs else None
@@ -1,10 +1,20 @@
 from Jumpscale import j
+import gevent
+import importlib.util
+
+# max time between 2 runs of expire_reservations, new reservations can expire earlier
+EXPIRE_INTERVAL_MAX = 60
+# port of the bottle server streaming reservations & workloads
+STREAM_PORT = 9202
 
 
 class Package(j.baseclasses.threebot_package):
     def _init(self, **kwargs):
         self.workloads_bcdb = self._package.threebot_server.bcdb_get("tf_workloads")
         self.phonebook_bcdb = self._package.threebot_server.bcdb_get("threebot_phonebook")
+        self._expire_reservations = j.tools.codeloader.load(
+            path=j.sal.fs.joinPaths(self.package_root, "jobs", "expire_reservations.py")
+        )
 
     def prepare(self):
         """
@@ -23,6 +33,44 @@ class Package(j.baseclasses.threebot_package):
         """
         self.gedis_server.actors_add(j.sal.fs.joinPaths(self.package_root, "actors"))
 
+        gevent.spawn(self.expire_reservations)
+
+        self.streaming_start()
+
+    def streaming_start(self):
+        """
+        serve the streaming versions of reservations_list & workloads_list under /tfgrid_workloads
+        """
+        spec = importlib.util.spec_from_file_location("app", j.sal.fs.joinPaths(self.package_root, "app.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.rack_server.bottle_server_add(name="tfgrid_workloads", port=STREAM_PORT, app=module.app)
+
+        website = self.openresty.get_from_port(80)
+        locations = website.locations.get("tfgrid_workloads")
+        proxy_location = locations.locations_proxy.new()
+        proxy_location.name = "tfgrid_workloads"
+        proxy_location.path_url = "/tfgrid_workloads"
+        proxy_location.ipaddr_dest = "0.0.0.0"
+        proxy_location.port_dest = STREAM_PORT
+        proxy_location.scheme = "http"
+        locations.configure()
+        website.configure()
+
+    def expire_reservations(self):
+        # runs in a greenlet of the 3bot process, so its writes are serialized with the ones of the actors
+        try:
+            self._expire_reservations()
+        except Exception as e:
+            j.errorhandler.exception_handle(e, die=False)
+
+        # run again when the next reservation expires
+        delay = EXPIRE_INTERVAL_MAX
+        expiration = self.workloads_bcdb.model_get(url="tfgrid.reservation.1").expiration_next()
+        if expiration:
+            delay = min(max(expiration - j.data.time.epoch + 1, 1), EXPIRE_INTERVAL_MAX)
+        gevent.spawn_later(delay, self.expire_reservations)
+
     def stop(self):
         """
         called when the 3bot stops
@@ -137,8 +137,52 @@ def main(self):
     workloads = cl.actors.workload_manager.workloads_list(node_id=0)
     assert len(workloads) == 0
 
+    # TEST07b: WORKLOADS FEED
+    feed = feed_first = cl.actors.workload_manager.workloads_feed(node_id=1)
+    assert len(feed.workloads) == 2
+    assert not any(workload.to_delete for workload in feed.workloads)
+    cursor = feed.next_cursor
+    feed = cl.actors.workload_manager.workloads_feed(node_id=1, cursor=cursor)
+    assert len(feed.workloads) == 0
+    assert feed.next_cursor == cursor
+
+    # TEST07c: STREAM WORKLOADS & RESERVATIONS
+    streamed = list(reservation_model.workloads_stream("1"))
+    assert [workload.workload_id for _, workload in streamed] == [w.workload_id for w in feed_first.workloads]
+    assert streamed[-1][0] == cursor
+    streamed = list(reservation_model.reservations_stream(node_id="1", states=["deploy"]))
+    assert [r.id for r in streamed] == [reservation.id]
+
+    # TEST07d: SET WORKLOAD RESULT, A NEW RESULT REPLACES THE PREVIOUS ONE
+    result_model = bcdb.model_get(url="tfgrid.reservation.result.1")
+    gwid = feed_first.workloads[0].workload_id
+    for state in ["error", "ok"]:
+        result = result_model.new()
+        result.category = "volume"
+        result.state = state
+        result.epoch = j.data.time.epoch
+        cl.actors.workload_manager.set_workload_result(gwid, result._ddict)
+    results = cl.actors.workload_manager.reservation_get(reservation.id).results
+    assert len(results) == 1
+    assert results[0].state == "OK"
+
     # TEST08: FILL SING DELETE
     signature = signer_signing_key.sign(reservation.json.encode())
     cl.actors.workload_manager.sign_delete(reservation.id, tbots["signer"].id, binascii.hexlify(signature.signature))
     reservation = cl.actors.workload_manager.reservation_get(reservation.id)
     assert reservation.next_action == "DELETE"
+
+    # TEST09: WORKLOADS FEED RETURNS THE DELETED WORKLOADS AFTER THE CURSOR
+    feed = cl.actors.workload_manager.workloads_feed(node_id=1, cursor=cursor)
+    assert len(feed.workloads) == 2
+    assert all(workload.to_delete for workload in feed.workloads)
+
+    # TEST10: EXPIRED RESERVATIONS ARE MOVED TO DELETE BY THE EXPIRE JOB
+    reservation_data["data_reservation"]["expiration_reservation"] = int(j.data.time.epoch - 60)
+    reservation = cl.actors.workload_manager.reservation_register(reservation_data)
+    path = j.sal.fs.getDirName(j.sal.fs.getDirName(__file__))
+    expire_reservations = j.tools.codeloader.load(path=j.sal.fs.joinPaths(path, "jobs", "expire_reservations.py"))
+    stats = expire_reservations()
+    assert stats["delete"] == 1
+    reservation = cl.actors.workload_manager.reservation_get(reservation.id)
+    assert reservation.next_action == "DELETE"
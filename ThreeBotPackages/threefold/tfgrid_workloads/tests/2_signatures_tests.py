@@ -0,0 +1,92 @@
+import binascii
+import importlib.util
+import logging
+import os
+import uuid
+from collections import OrderedDict
+
+from nacl import signing
+from Jumpscale import j
+
+
+def main(self=None):
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "actors", "workload_manager.py")
+    spec = importlib.util.spec_from_file_location("workload_manager", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    try:
+        ph_bcdb = j.data.bcdb.new("threebot_phonebook")
+    except:
+        ph_bcdb = j.data.bcdb.get("threebot_phonebook")
+    user_model = ph_bcdb.model_get(url="threebot.phonebook.user.1")
+
+    keys = {}
+    for _ in range(2):
+        key = signing.SigningKey.generate()
+        name = uuid.uuid4().hex
+        user = user_model.new()
+        user.name = name
+        user.email = "%s@test.com" % name
+        user.pubkey = binascii.hexlify(key.verify_key.encode())
+        user.save()
+        keys[user.id] = key
+    valid_tid, invalid_tid = keys
+
+    def sign(tid, payload):
+        return binascii.hexlify(keys[tid].sign(payload.encode()).signature).decode()
+
+    # only the memo & the phonebook model are needed to check signatures
+    actor = module.workload_manager.__new__(module.workload_manager)
+    actor.user_model = user_model
+    actor._signatures_verified = OrderedDict()
+
+    def verified():
+        return user_model.verify_stats["signatures"]
+
+    payload = "payload"
+    signatures = [(valid_tid, sign(valid_tid, payload)), (invalid_tid, sign(invalid_tid, "other payload"))]
+
+    logging.info("Signatures are verified once per reservation, payload & signature")
+    before = verified()
+    assert actor._signatures_check(1, payload, signatures) == {valid_tid}
+    assert verified() == before + 2
+    assert actor._signatures_check(1, payload, signatures) == {valid_tid}
+    assert verified() == before + 2
+
+    logging.info("Another reservation or payload is verified again")
+    assert actor._signatures_check(2, payload, signatures) == {valid_tid}
+    assert verified() == before + 4
+    assert actor._signatures_check(1, payload + " changed", signatures) == set()
+    assert verified() == before + 6
+
+    logging.info("Users which are not in the phonebook are not memoized")
+    memoized = len(actor._signatures_verified)
+    assert actor._signatures_check(1, payload, [(2 ** 30, signatures[0][1])]) == set()
+    assert len(actor._signatures_verified) == memoized
+
+    logging.info("The memo is bounded, the least recently used results are dropped")
+    size = module.SIGNATURE_CACHE_SIZE
+    module.SIGNATURE_CACHE_SIZE = 4
+    try:
+        actor._signatures_verified.clear()
+        signatures = signatures[:1]
+        for reservation_id in range(1, 5):
+            actor._signatures_check(reservation_id, payload, signatures)
+        # reservation 1 is used again, reservation 2 is the least recently used now
+        actor._signatures_check(1, payload, signatures)
+        before = verified()
+        actor._signatures_check(5, payload, signatures)
+        assert len(actor._signatures_verified) == 4
+        actor._signatures_check(1, payload, signatures)
+        assert verified() == before + 1
+        actor._signatures_check(2, payload, signatures)
+        assert verified() == before + 2
+    finally:
+        module.SIGNATURE_CACHE_SIZE = size
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
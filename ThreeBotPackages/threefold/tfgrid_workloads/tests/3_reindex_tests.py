@@ -0,0 +1,64 @@
+import logging
+import uuid
+
+from Jumpscale import j
+
+
+def main(self=None):
+    factory = self or j.threebot.package.workloadmanager
+    try:
+        bcdb = j.data.bcdb.new("tf_workloads")
+    except:
+        bcdb = j.data.bcdb.get("tf_workloads")
+    model = bcdb.model_get(url="tfgrid.reservation.1")
+    db = bcdb.sqlite_index_client
+
+    node_id = uuid.uuid4().hex
+    reservation = model.new()
+    reservation.customer_tid = 1
+    reservation.next_action = "deploy"
+    reservation.epoch = j.data.time.epoch
+    reservation.data_reservation.expiration_provisioning = int(j.data.time.epoch + 3 * 60)
+    reservation.data_reservation.expiration_reservation = int(j.data.time.epoch + 5 * 60)
+    for workload_id, url, field in (
+        (1, "tfgrid.reservation.volume.1", "volumes"),
+        (2, "tfgrid.reservation.zdb.1", "zdbs"),
+    ):
+        workload = bcdb.model_get(url=url).new()
+        workload.node_id = node_id
+        workload.workload_id = workload_id
+        workload.farmer_tid = 2
+        getattr(reservation.data_reservation, field).append(workload)
+    reservation.save()
+    queued = model.queue_find(node_id)
+    assert [item.workload_id for item in queued] == [1, 2]
+
+    logging.info("An index without the expiration columns is dropped when the model is loaded")
+    model.IndexTable.drop_table()
+    db.execute_sql("CREATE TABLE indextable (id INTEGER PRIMARY KEY, reservation_id INTEGER, node_id TEXT)")
+    db.execute_sql("INSERT INTO indextable (reservation_id, node_id) VALUES (?, ?)", (reservation.id, node_id))
+    model._init2()
+    columns = [column.name for column in db.get_columns("indextable")]
+    assert "expiration_reservation" in columns
+    assert "next_action" in columns
+    assert not model.IndexTable.select().exists()
+    assert not model.index_find(node_id=node_id)
+
+    logging.info("Reindex indexes all reservations again and adds their workloads at the end of the queues")
+    factory.reindex()
+    assert model.index_find(node_id=node_id, states=["deploy"]) == [reservation.id]
+    assert model.index_find(customer_tid=1, states=["deploy"])[-1] == reservation.id
+    assert not model.index_find(node_id=node_id, states=["create"])
+    expiring = model.IndexTable.select().where(model.IndexTable.reservation_id == reservation.id)
+    assert {row.expiration_reservation for row in expiring} == {reservation.data_reservation.expiration_reservation}
+    requeued = model.queue_find(node_id)
+    assert [item.workload_id for item in requeued] == [1, 2]
+    assert min(item.seq for item in requeued) > max(item.seq for item in queued)
+
+    reservation.delete()
+    assert not model.queue_find(node_id)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
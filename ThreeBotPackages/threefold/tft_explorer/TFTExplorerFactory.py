@@ -91,5 +91,7 @@ class TFTExplorerFactory(j.baseclasses.object, j.baseclasses.testtools):
         assert trans[0].senders == t.senders
         assert trans[0].amount == t.amount
         print("test ok")
+
+        self._test_run(name=name)
         self._log_info("All TESTS DONE")
         return "OK"
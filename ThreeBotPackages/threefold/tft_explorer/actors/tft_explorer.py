@@ -9,6 +9,17 @@ class tft_explorer(j.baseclasses.threebot_actor):
         self.tft_ex_t = bcdb.model_get(url="tft.explorer.transaction.1")
         self.tft_ex_w = bcdb.model_get(url="tft.explorer.wallet.1")
 
+        if not self.tft_ex_t.TransactionIndex.select().exists():
+            self.tft_ex_t.ledger_rebuild()
+
+    def _transactions_get(self, transactions_ids):
+        transactions = []
+        for transaction_id in transactions_ids:
+            transaction = self.tft_ex_t.get(transaction_id, die=False)
+            if transaction:
+                transactions.append(transaction)
+        return transactions
+
     def data_dump_transaction(self, transaction_data, schema_out=None, user_session=None):
         # we can't use schema_out because it is not linked to a bcdb
         # neither to a namespace id
@@ -26,6 +37,8 @@ class tft_explorer(j.baseclasses.threebot_actor):
 
     def set_transactions(self, trans, schema_out=None, user_session=None):
         """
+        add many transactions at once, transactions with a hash which is known already are skipped
+
         ```in
         trans = (LO) !tft.explorer.transaction.1
         ```
@@ -34,20 +47,8 @@ class tft_explorer(j.baseclasses.threebot_actor):
         success = (LO) !tft.explorer.transaction.1
         ```
         """
-        res = []
-        for t in trans:
-            tmp = self.tft_ex_t.new()
-            tmp.hash = t.hash
-            tmp.lock.value = t.lock.value
-            tmp.lock.type = t.lock.type
-            tmp.message = t.message
-            tmp.fee = t.fee
-            tmp.senders = t.senders
-            tmp.recipient = t.recipient
-            tmp.amount = t.amount
-            tmp.include_in_block_height = t.include_in_block_height
-            res.append(self.tft_ex_t.set(tmp))
-        return res
+        added, _ = self.tft_ex_t.transactions_add(trans)
+        return added
 
     def get_transaction_by_recipient(self, recipient, schema_out=None, user_session=None):
         """
@@ -59,7 +60,19 @@ class tft_explorer(j.baseclasses.threebot_actor):
         trans =  (LO) !tft.explorer.transaction.1
         ```
         """
-        return self.tft_ex_t.find(recipient=recipient)
+        return self._transactions_get(self.tft_ex_t.find_by_recipient(recipient))
+
+    def get_transactions_by_sender(self, sender, schema_out=None, user_session=None):
+        """
+        ```in
+        sender = (S)
+        ```
+
+        ```out
+        trans =  (LO) !tft.explorer.transaction.1
+        ```
+        """
+        return self._transactions_get(self.tft_ex_t.find_by_sender(sender))
 
     def get_transactions_in_block(self, block_height, schema_out=None, user_session=None):
         """
@@ -71,7 +84,35 @@ class tft_explorer(j.baseclasses.threebot_actor):
         trans =  (LO) !tft.explorer.transaction.1
         ```
         """
-        return self.tft_ex_t.find(include_in_block_height=block_height)
+        return self._transactions_get(self.tft_ex_t.find_by_block(block_height))
+
+    def get_transactions_in_blocks(self, block_height_from, block_height_to, schema_out=None, user_session=None):
+        """
+        ```in
+        block_height_from = (I)
+        block_height_to = (I)  # included
+        ```
+
+        ```out
+        trans =  (LO) !tft.explorer.transaction.1
+        ```
+        """
+        return self._transactions_get(self.tft_ex_t.find_by_block(block_height_from, block_height_to))
+
+    def get_by_hash(self, hash, schema_out=None, user_session=None):
+        """
+        ```in
+        hash = (S)
+        ```
+
+        ```out
+        transaction = (O) !tft.explorer.transaction.1
+        ```
+        """
+        transaction = self.tft_ex_t.get_by_hash(hash)
+        if not transaction:
+            raise j.exceptions.NotFound("transaction with hash %s not found" % hash)
+        return transaction
 
     def get(self, transaction_id, schema_out=None, user_session=None):
         """
@@ -91,8 +132,43 @@ class tft_explorer(j.baseclasses.threebot_actor):
         except j.exceptions.NotFound:
             raise j.exceptions.NotFound("transaction %s not found" % transaction_id)
 
-    def set_block(self, blockheight, transactions, balances):
-        pass
+    def set_block(self, blockheight, transactions, schema_out=None, user_session=None):
+        """
+        add all transactions of a block at once, transactions which are known already are skipped
+        so a block can be sent again
+
+        ```in
+        blockheight = (I)
+        transactions = (LO) !tft.explorer.transaction.1
+        ```
+
+        ```out
+        added = (I)
+        duplicates = (I)
+        ```
+        """
+        added, duplicates = self.tft_ex_t.transactions_add(transactions, block_height=blockheight)
+        out = schema_out.new()
+        out.added = len(added)
+        out.duplicates = duplicates
+        return out
+
+    def ingest_stats(self, schema_out=None, user_session=None):
+        """
+        counters of the transactions added through set_transactions & set_block
+
+        ```out
+        transactions = (I)
+        duplicates = (I)
+        per_second = (F)
+        ```
+        """
+        stats = self.tft_ex_t.ingest_stats
+        out = schema_out.new()
+        out.transactions = stats["transactions"]
+        out.duplicates = stats["duplicates"]
+        out.per_second = stats["transactions"] / stats["seconds"] if stats["seconds"] else 0
+        return out
 
     def get_balance(self, recipient, schema_out=None, user_session=None):
         """
@@ -105,6 +181,22 @@ class tft_explorer(j.baseclasses.threebot_actor):
         ```
         """
         out = schema_out.new()
-        for t in self.tft_ex_t.find(recipient=recipient):
-            out.balance += t.amount
+        out.balance = self.tft_ex_t.balance_get(recipient)
+        return out
+
+    def get_balance_at(self, recipient, block_height, schema_out=None, user_session=None):
+        """
+        balance at the end of a block
+
+        ```in
+        recipient = (S)
+        block_height = (I)
+        ```
+
+        ```out
+        balance =  (F)
+        ```
+        """
+        out = schema_out.new()
+        out.balance = self.tft_ex_t.balance_get(recipient, block_height)
         return out
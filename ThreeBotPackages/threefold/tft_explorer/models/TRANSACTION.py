@@ -0,0 +1,304 @@
+import gevent.local
+import time
+
+from Jumpscale import j
+
+# max amount of values in 1 sqlite statement
+QUERY_CHUNK_SIZE = 500
+# rows per insert, stays below the max number of variables sqlite accepts in 1 statement
+INSERT_CHUNK_SIZE = 100
+
+
+class TRANSACTION(j.data.bcdb._BCDBModelClass):
+    """
+    transaction model which keeps a ledger next to the transactions (sqlite)
+
+    - TransactionIndex: hash, recipient, block height & amount of every transaction
+    - TransactionSender: the senders of every transaction
+    - Balance: the balance of every address, updated when a transaction is added, changed or deleted
+    - BalanceCheckpoint: the balance of an address at the end of every block it received something in,
+      so the balance at any block height is 1 lookup
+
+    the balance of an address is the sum of the amounts it received
+    """
+
+    def _init2(self, **kwargs):
+        pw = j.clients.peewee
+
+        class TransactionIndex(pw.Model):
+            class Meta:
+                database = None
+                indexes = ((("recipient", "block_height"), False),)
+
+            obj_id = pw.IntegerField(primary_key=True)
+            hash = pw.TextField(unique=True, null=True)
+            recipient = pw.TextField(default="")
+            block_height = pw.IntegerField(index=True, default=0)
+            amount = pw.FloatField(default=0)
+
+        class TransactionSender(pw.Model):
+            class Meta:
+                database = None
+                indexes = ((("obj_id", "sender"), True),)
+
+            obj_id = pw.IntegerField()
+            sender = pw.TextField(index=True)
+
+        class Balance(pw.Model):
+            class Meta:
+                database = None
+
+            address = pw.TextField(primary_key=True)
+            balance = pw.FloatField(default=0)
+
+        class BalanceCheckpoint(pw.Model):
+            class Meta:
+                database = None
+                indexes = ((("address", "block_height"), True),)
+
+            address = pw.TextField()
+            block_height = pw.IntegerField()
+            balance = pw.FloatField(default=0)
+
+        self._tables = (TransactionIndex, TransactionSender, Balance, BalanceCheckpoint)
+        for table in self._tables:
+            table._meta.database = self.bcdb.sqlite_index_client
+            table.create_table(safe=True)
+        self.TransactionIndex = TransactionIndex
+        self.TransactionSender = TransactionSender
+        self.Balance = Balance
+        self.BalanceCheckpoint = BalanceCheckpoint
+        # ingesting is set while transactions_add saves a batch, the trigger leaves the ledger to it
+        self._ingest = gevent.local.local()
+        self.ingest_stats = {"transactions": 0, "duplicates": 0, "seconds": 0.0}
+        self.trigger_add(self._ledger_trigger)
+
+    def _schema_get(self):
+        return j.data.schema.get_from_url("tft.explorer.transaction.1")
+
+    def _ledger_trigger(self, obj, action, **kwargs):
+        if getattr(self._ingest, "ingesting", False):
+            # hash is checked & ledger is updated by transactions_add
+            return
+        if action == "set_pre":
+            index = self.TransactionIndex
+            if obj.hash:
+                query = index.select().where(index.hash == obj.hash)
+                if obj.id:
+                    query = query.where(index.obj_id != obj.id)
+                if query.exists():
+                    raise j.exceptions.Input("transaction with hash %s already exists" % obj.hash)
+        elif action == "set_post":
+            with self.bcdb.sqlite_index_client.atomic():
+                self._ledger_remove(obj.id)
+                self._ledger_add(obj)
+        elif action == "delete":
+            with self.bcdb.sqlite_index_client.atomic():
+                self._ledger_remove(obj.id)
+
+    def _ledger_add(self, obj):
+        self.TransactionIndex.insert(
+            obj_id=obj.id,
+            hash=obj.hash or None,
+            recipient=obj.recipient,
+            block_height=obj.include_in_block_height,
+            amount=obj.amount,
+        ).execute()
+        senders = [{"obj_id": obj.id, "sender": sender} for sender in set(obj.senders)]
+        for i in range(0, len(senders), QUERY_CHUNK_SIZE):
+            self.TransactionSender.insert_many(senders[i : i + QUERY_CHUNK_SIZE]).on_conflict_ignore().execute()
+        self._balance_add(obj.recipient, obj.include_in_block_height, obj.amount)
+
+    def _ledger_add_many(self, objs):
+        """
+        same as _ledger_add for many new transactions, the balance of an address is only updated
+        once per block
+        """
+        rows = [
+            {
+                "obj_id": obj.id,
+                "hash": obj.hash or None,
+                "recipient": obj.recipient,
+                "block_height": obj.include_in_block_height,
+                "amount": obj.amount,
+            }
+            for obj in objs
+        ]
+        senders = [{"obj_id": obj.id, "sender": sender} for obj in objs for sender in set(obj.senders)]
+        for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+            self.TransactionIndex.insert_many(rows[i : i + INSERT_CHUNK_SIZE]).execute()
+        for i in range(0, len(senders), INSERT_CHUNK_SIZE):
+            self.TransactionSender.insert_many(senders[i : i + INSERT_CHUNK_SIZE]).on_conflict_ignore().execute()
+
+        amounts = {}
+        for obj in objs:
+            key = (obj.include_in_block_height, obj.recipient)
+            amounts[key] = amounts.get(key, 0) + obj.amount
+        for (block_height, address), amount in sorted(amounts.items()):
+            self._balance_add(address, block_height, amount)
+
+    def hashes_existing(self, hashes):
+        """
+        :return: the hashes of which a transaction is stored already
+        """
+        hashes = list(hashes)
+        index = self.TransactionIndex
+        existing = set()
+        for i in range(0, len(hashes), QUERY_CHUNK_SIZE):
+            query = index.select(index.hash).where(index.hash.in_(hashes[i : i + QUERY_CHUNK_SIZE]))
+            existing.update(row.hash for row in query)
+        return existing
+
+    def transactions_add(self, transactions, block_height=None):
+        """
+        add many transactions (e.g. a whole block) at once
+
+        transactions with a hash which is stored already or which is given more then once are skipped,
+        so the same block can be added again safely
+        the transactions are saved in BCDB one by one, their indexes & balances are updated in 1 sqlite
+        transaction. BCDB is not part of that transaction, so when the batch fails the transactions which
+        were saved already are deleted again, the batch can be retried without storing them twice
+
+        :param transactions: tft.explorer.transaction.1 objects or dicts
+        :param block_height: when set, include_in_block_height of all transactions is set to it
+        :return: (list of the added transactions, amount of duplicates)
+        """
+        start = time.time()
+        existing = self.hashes_existing(t["hash"] if isinstance(t, dict) else t.hash for t in transactions)
+        added = []
+        duplicates = 0
+        self._ingest.ingesting = True
+        try:
+            with self.bcdb.sqlite_index_client.atomic():
+                for transaction in transactions:
+                    obj = self.new(transaction)
+                    if obj.hash and obj.hash in existing:
+                        duplicates += 1
+                        continue
+                    if obj.hash:
+                        existing.add(obj.hash)
+                    if block_height is not None:
+                        obj.include_in_block_height = block_height
+                    obj.save()
+                    added.append(obj)
+                self._ledger_add_many(added)
+        except Exception:
+            # the ledger got rolled back, the transactions it does not know are removed from BCDB
+            for obj in added:
+                obj.delete()
+            raise
+        finally:
+            self._ingest.ingesting = False
+
+        self.ingest_stats["transactions"] += len(added)
+        self.ingest_stats["duplicates"] += duplicates
+        self.ingest_stats["seconds"] += time.time() - start
+        return added, duplicates
+
+    def _ledger_remove(self, obj_id):
+        """
+        undo what _ledger_add did for the transaction, if it was added before
+        """
+        row = self.TransactionIndex.get_or_none(self.TransactionIndex.obj_id == obj_id)
+        if not row:
+            return
+        self._balance_add(row.recipient, row.block_height, -row.amount)
+        self.TransactionIndex.delete().where(self.TransactionIndex.obj_id == obj_id).execute()
+        self.TransactionSender.delete().where(self.TransactionSender.obj_id == obj_id).execute()
+
+    def _balance_add(self, address, block_height, amount):
+        if not address or not amount:
+            return
+        balance = self.Balance
+        if not balance.update(balance=balance.balance + amount).where(balance.address == address).execute():
+            balance.insert(address=address, balance=amount).execute()
+
+        checkpoint = self.BalanceCheckpoint
+        # all later checkpoints include this amount as well
+        checkpoint.update(balance=checkpoint.balance + amount).where(
+            (checkpoint.address == address) & (checkpoint.block_height >= block_height)
+        ).execute()
+        exists = (
+            checkpoint.select()
+            .where((checkpoint.address == address) & (checkpoint.block_height == block_height))
+            .exists()
+        )
+        if not exists:
+            previous = self.balance_get(address, block_height - 1)
+            checkpoint.insert(address=address, block_height=block_height, balance=previous + amount).execute()
+
+    def balance_get(self, address, block_height=None):
+        """
+        :param block_height: the balance at the end of this block, None for the current balance
+        :return: the sum of the amounts the address received
+        """
+        if block_height is None:
+            row = self.Balance.get_or_none(self.Balance.address == address)
+            return row.balance if row else 0
+        checkpoint = self.BalanceCheckpoint
+        row = (
+            checkpoint.select(checkpoint.balance)
+            .where((checkpoint.address == address) & (checkpoint.block_height <= block_height))
+            .order_by(checkpoint.block_height.desc())
+            .first()
+        )
+        return row.balance if row else 0
+
+    def find_by_recipient(self, recipient):
+        """
+        :return: ids of the transactions to the recipient ordered by block height
+        """
+        index = self.TransactionIndex
+        query = index.select(index.obj_id).where(index.recipient == recipient)
+        return [row.obj_id for row in query.order_by(index.block_height, index.obj_id)]
+
+    def find_by_sender(self, sender):
+        """
+        :return: ids of the transactions with the sender as one of the senders
+        """
+        senders = self.TransactionSender
+        query = senders.select(senders.obj_id).where(senders.sender == sender).order_by(senders.obj_id)
+        return [row.obj_id for row in query]
+
+    def find_by_block(self, block_height_from, block_height_to=None):
+        """
+        :param block_height_to: last block (included), None for only block_height_from
+        :return: ids of the transactions in the range of blocks ordered by block height
+        """
+        if block_height_to is None:
+            block_height_to = block_height_from
+        index = self.TransactionIndex
+        query = index.select(index.obj_id).where(index.block_height.between(block_height_from, block_height_to))
+        return [row.obj_id for row in query.order_by(index.block_height, index.obj_id)]
+
+    def get_by_hash(self, hash):
+        """
+        :return: the transaction with this hash or None
+        """
+        row = self.TransactionIndex.get_or_none(self.TransactionIndex.hash == hash)
+        return self.get(row.obj_id, die=False) if row else None
+
+    def ledger_rebuild(self):
+        """
+        rebuild the indexes & balances from the transactions stored in BCDB
+
+        a transaction with the same hash as one which was added before is a duplicate, it is skipped
+        and logged
+
+        :return: ids of the skipped transactions
+        """
+        hashes = set()
+        skipped = []
+        with self.bcdb.sqlite_index_client.atomic():
+            for table in self._tables:
+                table.delete().execute()
+            for obj in self.iterate():
+                if obj.hash:
+                    if obj.hash in hashes:
+                        skipped.append(obj.id)
+                        continue
+                    hashes.add(obj.hash)
+                self._ledger_add(obj)
+        if skipped:
+            self._log_warning("transactions %s are duplicates of another transaction, not in the ledger" % skipped)
+        return skipped
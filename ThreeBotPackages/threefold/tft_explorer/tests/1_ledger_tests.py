@@ -0,0 +1,96 @@
+import logging
+import os
+import uuid
+
+from Jumpscale import j
+
+
+def _transaction(recipient, amount, block_height, hash=None):
+    return {
+        "hash": hash or uuid.uuid4().hex,
+        "recipient": recipient,
+        "senders": [uuid.uuid4().hex],
+        "amount": amount,
+        "include_in_block_height": block_height,
+    }
+
+
+def main(self=None):
+    if "tft_explorer" in [b.name for b in j.data.bcdb.instances]:
+        bcdb = j.data.bcdb.get("tft_explorer")
+    else:
+        bcdb = j.data.bcdb.new("tft_explorer")
+    bcdb.models_add(path=os.path.join(os.path.dirname(os.path.dirname(__file__)), "models"))
+    model = bcdb.model_get(url="tft.explorer.transaction.1")
+    model.destroy()
+    model.ledger_rebuild()
+
+    logging.info("A hash is only stored once, in a batch, in a later batch and by save")
+    address = uuid.uuid4().hex
+    first = _transaction(address, 1, 1)
+    added, duplicates = model.transactions_add([first, dict(first), _transaction(address, 2, 1)])
+    assert len(added) == 2
+    assert duplicates == 1
+    added, duplicates = model.transactions_add([first])
+    assert not added
+    assert duplicates == 1
+    obj = model.new(first)
+    try:
+        obj.save()
+        raise AssertionError("a transaction with an existing hash got saved")
+    except j.exceptions.Input:
+        pass
+    assert len(model.find_by_recipient(address)) == 2
+    assert model.balance_get(address) == 3
+
+    logging.info("A batch which fails leaves nothing behind and can be added again")
+    address = uuid.uuid4().hex
+    batch = [_transaction(address, amount, 5) for amount in (1, 2, 3)]
+
+    def ledger_add_many_fail(objs):
+        raise j.exceptions.Runtime("ledger can not be updated")
+
+    model._ledger_add_many = ledger_add_many_fail
+    try:
+        model.transactions_add(batch)
+        raise AssertionError("batch did not fail")
+    except j.exceptions.Runtime:
+        pass
+    finally:
+        del model._ledger_add_many
+    assert not model.hashes_existing(t["hash"] for t in batch)
+    assert not model.find_by_recipient(address)
+    assert not [obj for obj in model.iterate() if obj.recipient == address]
+    assert model.balance_get(address) == 0
+    added, duplicates = model.transactions_add(batch)
+    assert len(added) == 3
+    assert duplicates == 0
+    assert model.balance_get(address) == 6
+
+    logging.info("The balance at a block height between checkpoints is the one of the checkpoint before it")
+    address = uuid.uuid4().hex
+    model.transactions_add([_transaction(address, 10, 10), _transaction(address, 20, 20)])
+    assert model.balance_get(address, 5) == 0
+    assert model.balance_get(address, 10) == 10
+    assert model.balance_get(address, 15) == 10
+    assert model.balance_get(address, 20) == 30
+    assert model.balance_get(address, 25) == 30
+    # a transaction in an earlier block is counted in all checkpoints after it
+    added, _ = model.transactions_add([_transaction(address, 5, 15)])
+    assert model.balance_get(address, 12) == 10
+    assert model.balance_get(address, 15) == 15
+    assert model.balance_get(address, 19) == 15
+    assert model.balance_get(address, 20) == 35
+    assert model.balance_get(address) == 35
+
+    logging.info("Deleting a transaction takes it out of the balances")
+    model.get_by_hash(added[0].hash).delete()
+    assert model.balance_get(address, 15) == 10
+    assert model.balance_get(address) == 30
+
+    model.destroy()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()